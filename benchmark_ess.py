@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:20:05 2026
+
+@author: fan
+"""
+
+# This file:
+# sampler efficiency benchmark:
+# effective sample size (ESS) per wall-clock second of each model/sampler,
+# on fixed simulated scenarios (the V1, V2, V3 settings in main2_DPGMM.py)
+
+#%%
+import sys
+import warnings
+from time import perf_counter
+
+import numpy as np
+
+import main
+import main2
+import mainH
+import mainPT
+import main2_DPGMM
+import mainShard
+import mainDistributed
+from main2_DPGMM import SettingsV1, SettingsV2, SettingsV3
+from utils2_DPGMM import simulateLatentPoissonGMM2
+
+Scenarios = {'V1': SettingsV1, 'V2': SettingsV2, 'V3': SettingsV3}
+
+# the chains to compute ESS for ("logLik" is the log joint of data and types, 
+# with the component labels summed out; the random-scan, sharded and distributed modes 
+# record "logLikGivenZ" instead, which also conditions on the labels: 
+# a different quantity, so it has its own column; a mode without the chain shows nan)
+ESS_params = ['N_MF', 'N_FM', 'muL', 'muD', 'logLik', 'logLikGivenZ']
+
+
+def getPriors():
+    '''
+    A fresh prior dictionary (with entries for all the models) for every run,
+    since some of the updates modify the prior arrays in place
+    '''
+    return {"gammaScore": {'nu0': 2, 'sigma0': 1},
+            "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
+            "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
+            "weight": np.ones(3), "probs": np.ones(3),
+            "alpha": {'a': 2.0, 'b':3.0},
+            "gammaPP": {'n0': 1, 'b0': 0.02},
+            "eta": {'a': 1, 'b': 1}}
+
+
+# worker processes started by the distributed mode (joined by runMode after the fit)
+LocalWorkers = []
+
+
+def makeDistributedModel(Pr, nWorkers=2):
+    '''
+    DistributedDPGMM with nWorkers local socket workers 
+    (their processes are kept in LocalWorkers)
+    '''
+    transports, processes = mainDistributed.startLocalWorkers(nWorkers, kind='socket')
+    LocalWorkers.extend(processes)
+    return mainDistributed.DistributedDPGMM(Priors = Pr, K=3, Kmax=10, transports=transports)
+
+
+# all the available fit modes:
+# name -> (model constructor, extra fit arguments, number of iterations relative to the Gibbs samplers)
+# (the single-move MH sampler only changes one pair per iteration, so it gets many more iterations;
+#  the tempered mode uses one process per replica, so its CPU time is about 4x its wall-clock time)
+Modes = {'MH (LatentPoissonGMM)':
+             (lambda Pr: main.LatentPoissonGMM(Priors = Pr, K=3), {'batch_size': 1}, 20),
+         'MH, delayed acceptance':
+             (lambda Pr: main.LatentPoissonGMM(Priors = Pr, K=3), {'batch_size': 1, 'delayed': True}, 20),
+         'MH batched (LatentPoissonGMM)':
+             (lambda Pr: main.LatentPoissonGMM(Priors = Pr, K=3), {'batch_size': 100, 'batched': True}, 1),
+         'MH batched, 4 tempered replicas (mainPT)':
+             (lambda Pr: mainPT.ParallelTemperingGMM(Priors = Pr, K=3, nReplicas=4),
+              {'batch_size': 100, 'batched': True, 'swapEvery': 5}, 1),
+         'Gibbs GMM (LatentPoissonGMM2)':
+             (lambda Pr: main2.LatentPoissonGMM2(Priors = Pr, K=3), {}, 1),
+         'Gibbs shared GMM (LatentPoissonHGMM)':
+             (lambda Pr: mainH.LatentPoissonHGMM(Priors = Pr, K=3), {}, 1),
+         'Gibbs DP GMM (LatentPoissonDPGMM2)':
+             (lambda Pr: main2_DPGMM.LatentPoissonDPGMM2(Priors = Pr, K=3, Kmax=10), {}, 1),
+         'Gibbs DP GMM, slice sampler':
+             (lambda Pr: main2_DPGMM.LatentPoissonDPGMM2(Priors = Pr, K=3, Kmax=10), 
+              {'sliceSampler': True}, 1),
+         'Gibbs DP GMM, joint type/label draws':
+             (lambda Pr: main2_DPGMM.LatentPoissonDPGMM2(Priors = Pr, K=3, Kmax=10), 
+              {'jointUpdate': True}, 1),
+         'Gibbs DP GMM, split-merge moves':
+             (lambda Pr: main2_DPGMM.LatentPoissonDPGMM2(Priors = Pr, K=3, Kmax=10), 
+              {'splitMerge': True}, 1),
+         'Gibbs DP GMM, random scan (10%)':
+             (lambda Pr: main2_DPGMM.LatentPoissonDPGMM2(Priors = Pr, K=3, Kmax=10), 
+              {'scanFraction': 0.1}, 10),
+         'Gibbs DP GMM, 2 threads':
+             (lambda Pr: main2_DPGMM.LatentPoissonDPGMM2(Priors = Pr, K=3, Kmax=10), 
+              {'nThreads': 2}, 1),
+         'Gibbs DP GMM, 2 shards (mainShard)':
+             (lambda Pr: mainShard.ShardedDPGMM(Priors = Pr, K=3, Kmax=10, nShards=2), {}, 1),
+         'Gibbs DP GMM, 2 local workers (mainDistributed)':
+             (makeDistributedModel, {}, 1)}
+
+
+def effectiveSampleSize(x):
+    '''
+    Effective sample size of a 1-d chain
+    (autocorrelations via FFT, truncated by Geyer's initial monotone sequence)
+    Returns nan if the chain is constant
+    '''
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+
+    if n < 4:
+        return np.nan
+    xc = x - x.mean()
+    if not np.any(xc):
+        return np.nan
+
+    f = np.fft.rfft(xc, n=2*n)
+    acov = np.fft.irfft(f * np.conj(f))[:n] / n
+    rho = acov / acov[0]
+
+    # sums of adjacent pairs of autocorrelations
+    P = rho[:2*(n//2)].reshape(-1,2).sum(axis=1)
+    # initial positive sequence...
+    neg = np.where(P <= 0)[0]
+    P = P[:neg[0]] if len(neg) > 0 else P
+    # ... made monotone
+    P = np.minimum.accumulate(P)
+
+    tau = max(-1 + 2*P.sum(), 1/np.log10(n))
+
+    return n/tau
+
+
+def runMode(name, E, L, D, samples, burn, seed):
+    '''
+    Fit one mode on a dataset;
+    Returns (dictionary of ESS for each parameter in ESS_params, wall-clock seconds)
+    '''
+    makeModel, fitArgs, scale = Modes[name]
+
+    try:
+        model = makeModel(getPriors())
+
+        tic = perf_counter()
+        model.fit(E, L, D, samples=samples*scale, burn=burn*scale, random_seed=seed,
+                  verbose=False, **fitArgs)
+        elapsed = perf_counter() - tic
+    finally:
+        # (the workers exit when the fit stops them; terminate any that did not)
+        while LocalWorkers:
+            p = LocalWorkers.pop()
+            p.join(10)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+
+    ess = {param: effectiveSampleSize(model.chains.get(param, [])) for param in ESS_params}
+
+    return ess, elapsed
+
+
+def runESSBenchmarks(modes=None, scenarios=None, samples=500, burn=100, seed=42):
+    '''
+    Run every mode on every scenario and print ESS per second for each parameter;
+    Returns a dictionary of (scenario, mode) -> (ESS dictionary, seconds)
+    '''
+    modes = list(Modes) if modes is None else modes
+    scenarios = list(Scenarios) if scenarios is None else scenarios
+
+    results = dict()
+
+    print('{:<4} {:<38} {:>8} '.format('', 'mode', 'seconds') +
+          ' '.join('{:>12}'.format(p) for p in ESS_params) + '   (ESS/sec)')
+
+    for sc in scenarios:
+        # the same dataset for all modes
+        np.random.seed(seed)
+        E, L, D = simulateLatentPoissonGMM2(Scenarios[sc])
+
+        for name in modes:
+            try:
+                ess, elapsed = runMode(name, E, L, D, samples, burn, seed)
+            except Exception as e:
+                print('{:<4} {:<38} failed: {}'.format(sc, name, repr(e)))
+                continue
+
+            print('{:<4} {:<38} {:>8.1f} '.format(sc, name, elapsed) +
+                  ' '.join('{:>12.2f}'.format(ess[p]/elapsed) for p in ESS_params))
+            results[(sc, name)] = (ess, elapsed)
+
+    return results
+
+
+#%%
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore')
+
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    runESSBenchmarks(samples=samples, burn=samples//5)
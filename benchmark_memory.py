@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:02:41 2026
+
+@author: fan
+"""
+
+# This file:
+# peak-memory and allocation benchmarks (via tracemalloc)
+# for the hot steps of the DP GMM sampler (LatentPoissonDPGMM2), across N
+
+# timing is NOT measured here (tracemalloc slows everything down)
+
+#%%
+import sys
+import tracemalloc
+import warnings
+
+from main2_DPGMM import *
+
+# the same priors as in the main2_DPGMM.py demo
+Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
+      "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
+      "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
+      "alpha": {'a': 2.0, 'b':3.0},
+      "gammaPP": {'n0': 1, 'b0': 0.02},
+      "eta": {'a': 1, 'b': 1}}
+
+# the "V3" setting from main2_DPGMM.py, with counts scaled to N
+BaseSettings = SettingsV3
+
+
+def scaleSettings(Settings, N):
+    '''
+    Return a copy of Settings with the four type counts scaled to add up to (about) N
+    '''
+    Settings = dict(Settings)
+    keys = ['N_MF', 'N_FM', 'N_MF0', 'N_FM0']
+    total = sum(Settings[k] for k in keys)
+    for k in keys:
+        Settings[k] = max(int(round(Settings[k] * N / total)), 1)
+    return Settings
+
+
+def measureAllocations(func, repeats=5, warmup=1):
+    '''
+    Call func() `repeats` times under tracemalloc 
+    (after `warmup` un-measured calls, so one-time buffer set-up is not counted);
+    Returns a dictionary of per-call averages:
+        - "peak": peak traced memory above the pre-call level (bytes)
+        - "retained": memory still allocated after the call (bytes)
+        - "blocks": number of memory blocks still allocated after the call
+    (tracemalloc must already be tracing)
+    '''
+    for r in range(warmup):
+        func()
+        
+    peaks = []; retained = []; blocks = []
+    for r in range(repeats):
+        before = tracemalloc.take_snapshot()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        func()
+
+        after_current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        stats = after.compare_to(before, 'filename')
+
+        peaks.append(peak - current)
+        retained.append(after_current - current)
+        blocks.append(sum(s.count_diff for s in stats))
+
+    return {'peak': np.mean(peaks), 'retained': np.mean(retained),
+            'blocks': np.mean(blocks)}
+
+
+def setupModel(N, Kmax=10):
+    '''
+    Simulate a dataset of about N pairs and initialize a LatentPoissonDPGMM2 on it
+    (a fit with 0 samples only runs the initialization)
+    '''
+    E, L, D = simulateLatentPoissonGMM2(scaleSettings(BaseSettings, N))
+    model = LatentPoissonDPGMM2(Priors = Pr, K=3, Kmax=Kmax)
+    model.fit(E, L, D, samples=0, burn=0, verbose=False)
+
+    return model
+
+
+def benchmarkSteps(model):
+    '''
+    Measure the allocations of the hot steps of one MCMC iteration on an initialized model;
+    Returns a dictionary of step name -> measurement dictionary
+    '''
+    ws = model.workspace
+    X = ws.X
+    X_MF = model.X_MF
+    n_MF = X_MF.shape[0]
+    Z_MF = updateComponentIndicator(X_MF, model.weightMF, model.componentsMF)
+
+    steps = {'updateScoreModels': lambda: model.updateScoreModels(),
+             'updateTypeIndicator': lambda: model.updateTypeIndicator(),
+             'groupPairs': lambda: model.groupPairs(),
+             'updateComponentIndicator': lambda: updateComponentIndicator(X_MF, model.weightMF,
+                                                                         model.componentsMF,
+                                                                         out=ws.get('Z_MF', n_MF, np.intp),
+                                                                         ws=ws),
+             'evalDensity': lambda: evalDensity(X, model.weightMF, model.componentsMF,
+                                                out=ws.get('logMF', len(X)), ws=ws),
+             'updateGaussianComponents': lambda: updateGaussianComponents(X_MF, Z_MF,
+                                                                         model.componentsMF.copy(),
+                                                                         model.muPrior,
+                                                                         model.precisionPrior,
+                                                                         ws=ws,
+                                                                         priorCache=model.priorCache),
+             'recordChains': lambda: model.recordChains()}
+
+    res = dict()
+    for name, func in steps.items():
+        res[name] = measureAllocations(func)
+
+    return res
+
+
+def runMemoryBenchmarks(Ns=(250, 1000, 4000), Kmax=10):
+    '''
+    Run the allocation benchmarks for each N and print a table;
+    "N-vectors" is the peak expressed in length-N float64 arrays,
+    which is what an O(N) allocation regression shows up in
+    Returns a dictionary of N -> results
+    '''
+    results = dict()
+
+    print('{:>8} {:<26} {:>12} {:>10} {:>12} {:>10}'.format('N', 'step', 'peak (KB)',
+                                                           'N-vectors', 'retained', 'blocks'))
+
+    for N in Ns:
+        model = setupModel(N, Kmax)
+        N = len(model.E)
+
+        tracemalloc.start()
+        res = benchmarkSteps(model)
+        tracemalloc.stop()
+
+        for name, r in res.items():
+            print('{:>8} {:<26} {:>12.1f} {:>10.1f} {:>12.0f} {:>10.1f}'.format(N, name, r['peak']/1024,
+                                                                           r['peak']/(8*N),
+                                                                           r['retained'], r['blocks']))
+        results[N] = res
+
+    return results
+
+
+#%%
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore')
+
+    Ns = [int(a) for a in sys.argv[1:]] if len(sys.argv) > 1 else [250, 1000, 4000]
+    runMemoryBenchmarks(Ns)
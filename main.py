@@ -8,7 +8,8 @@ Created on Wed May  6 16:45:23 2020
 
 #%%
 import os
-os.chdir('/Users/fan/Documents/Research_and_References/HIV_transmission_flow/')
+if __name__ == '__main__':
+    os.chdir('/Users/fan/Documents/Research_and_References/HIV_transmission_flow/')
 
 from copy import copy#, deepcopy
 
@@ -54,6 +55,7 @@ class LatentPoissonGMM:
         self.indsFM = None # indices on the FM surface
         self.E_MF = None # event set on MF surface
         self.E_FM = None # event set on FM surface
+        self.indexSets = None # index sets of the "out", "MF", "FM" pairs (kept in sync with E_MF, E_FM)
         # parameters
         self.muL = None
         self.muD = None
@@ -71,7 +73,7 @@ class LatentPoissonGMM:
         self.params_to_record = ['muL','muD', 'muNegD', 'gammaL', 'gammaD', 
                                  'N_MF', 'N_FM', 'gammaMF', 'gammaFM', 
                                  'componentsMF', 'weightMF',
-                                 'componentsFM', 'weightFM']
+                                 'componentsFM', 'weightFM', 'logLik']
         # log-likelihood
         #self.log-lik-terms = None # each pair's contribution to the log-likelihood
         self.log_lik = None # total log-likelihood
@@ -80,59 +82,447 @@ class LatentPoissonGMM:
         self.burn = 0
         self.thin = 1
         self.batch_size = None
+        self.Xall = None # all the points as an (N,2) array
         self.accept = dict() # counter for acceptance times
+        self.proposed = dict() # counter for proposal times
+        # proposal tuning (adapted during burn-in only if "adapt" in fit)
+        self.moveWeights = np.ones(3) # weights of the birth, death, swap moves in proposePP
+        self.acceptRates = None # running acceptance rate estimates of the b, d, s moves
+        self.logBatchSize = None # log of the (real valued) adapted batch size
+        # inverse temperature of the tempered posterior: 
+        # (complete-data likelihood)^temperature * prior, with the component labels summed out
+        # (so each surface point contributes sum_k (w_k f_k)^temperature, see evalLikelihood)
+        self.temperature = 1
+        # delayed acceptance (proposals are first screened with a cheap surrogate likelihood, 
+        # see evalPairTerms)
+        self.delayed = False
+        self.firstStageRejects = dict() # counter for proposals rejected by the surrogate
         self.chains = {param: list() for param in self.params_to_record}
             # a dictionary for parameter samples
             
-    def evalLikelihood(self, E_MF, E_FM, X_MF=None, X_FM=None, subset=None):
+    def evalLikelihood(self, E_MF, E_FM, X_MF=None, X_FM=None, subset=None, temperature=None):
         '''
         Evaluate likelihood
         #E_MF, E_FM: dictionary of points in MF and FM
         X_MF, X_FM: optional; (n,p) arrays of points in MF and FM
         subset: SORTED indices of subset to evaluate on
+        temperature: inverse temperature (default: the chain's, self.temperature)
         Returns total log likelihood (or log-likehood part on the subset)
+        
+        On a subset, the result is the sum of the per-pair terms only 
+        (score models, and surface density + log scale for the points on a surface);
+        the Poisson count terms (see "evalCountTerms") depend on the whole configuration
+        
+        For temperature < 1 this is the log of the tempered likelihood that all the updates 
+        target: every term times temperature, except the surface densities, which are 
+        log sum_k (w_k f_k)^temperature (see evalDensity)
         '''
+        beta = self.temperature if temperature is None else temperature
         
         if (X_FM is None) or (X_MF is None):
-            X_FM = getPoints(E_FM, subset=subset)
-            X_MF = getPoints(E_MF, subset=subset)
+            if subset is None:
+                X_FM = getPoints(E_FM)
+                X_MF = getPoints(E_MF)
+            else:
+                X_FM = np.array([E_FM[i] for i in subset if i in E_FM]).reshape((-1,2))
+                X_MF = np.array([E_MF[i] for i in subset if i in E_MF]).reshape((-1,2))
             
         #print(X_FM)
         #print(X_MF)
         
-        # Right now: STUPID WAY - sum over individual entries
-        # later might change
-        
         LLik = np.sum(evalLLikelihood(self.L, E_MF, E_FM, self.muL, 
                                       self.gammaL, subset=subset, log=True))
         DLik = np.sum(evalDLikelihood(self.D, E_MF, E_FM, self.muD, self.muNegD, 
                                       self.gammaD, subset=subset, log=True))
         
-        MFLik = np.sum(evalDensity(X_MF, self.weightMF, self.componentsMF, log=True)) if X_MF.size > 0 else 0
-        FMLik = np.sum(evalDensity(X_FM, self.weightFM, self.componentsFM, log=True)) if X_FM.size > 0 else 0
+        MFLik = np.sum(evalDensity(X_MF, self.weightMF, self.componentsMF, log=True, 
+                                   temperature=beta)) if X_MF.size > 0 else 0
+        FMLik = np.sum(evalDensity(X_FM, self.weightFM, self.componentsFM, log=True, 
+                                   temperature=beta)) if X_FM.size > 0 else 0
         
         #N_MF = len(E_MF); N_FM = len(E_FM)
         N_MF = X_MF.shape[0]; N_FM = X_FM.shape[0]
         
-        ## This is WRONG! NEED TO FIX THIS
-        
-        total = LLik + DLik + MFLik + FMLik
+        total = (beta * (LLik + DLik + N_MF * np.log(self.gammaMF) + N_FM * np.log(self.gammaFM)) + 
+                 MFLik + FMLik)
         
         if subset is None:
-            to_add = (N_MF * np.log(self.gammaMF) + N_FM * np.log(self.gammaFM) - 
-                      np.log(range(1,N_MF+1)).sum() - np.log(range(1,N_FM+1)).sum())
-            total += to_add - (self.gammaMF + self.gammaFM)
+            total += beta * self.evalCountTerms(N_MF, N_FM)
             self.log_lik = total
             
         return total
+    
+    def evalCountTerms(self, N_MF, N_FM):
+        '''
+        The Poisson count part of the log likelihood that is not a sum over pairs:
+            - log(N_MF!) - log(N_FM!) - gammaMF - gammaFM
+        '''
+        return -gammaln(N_MF+1) - gammaln(N_FM+1) - (self.gammaMF + self.gammaFM)
+    
+    def evalLikelihoodDelta(self, E_MF_old, E_FM_old, subset, N_MF_old=None, N_FM_old=None):
+        '''
+        Local change of the log likelihood, from the old configuration (E_MF_old, E_FM_old)
+        to the current one (self.E_MF, self.E_FM), when only the pairs in "subset" differ;
+        costs O(len(subset)) instead of O(N)
+        subset: SORTED indices of the changed pairs
+        N_MF_old, N_FM_old: old sizes of the event sets; needed if E_MF_old, E_FM_old
+            only contain the subset (e.g. from getUndoneEventSets), 
+            otherwise taken as len(E_MF_old), len(E_FM_old)
+        '''
+        N_MF_old = len(E_MF_old) if N_MF_old is None else N_MF_old
+        N_FM_old = len(E_FM_old) if N_FM_old is None else N_FM_old
+        
+        logLik_old = self.evalLikelihood(E_MF_old, E_FM_old, subset=subset)
+        logLik_propose = self.evalLikelihood(self.E_MF, self.E_FM, subset=subset)
+        
+        return (logLik_propose - logLik_old + 
+                self.temperature * (self.evalCountTerms(len(self.E_MF), len(self.E_FM)) - 
+                                    self.evalCountTerms(N_MF_old, N_FM_old)))
         
 
     
+    def updatePPSingle(self, it=0, verbose=False):
+        '''
+        One MH step on the point configurations (E_MF, E_FM):
+        propose ONE birth/death/swap move (proposePP) and accept or reject it
+        Returns the move type and whether it was accepted
+        '''
+        ### propose change (recording the moves in an undo log instead of copying E_MF, E_FM)
+        N_MF_old = len(self.E_MF); N_FM_old = len(self.E_FM)
+        N_out_old = len(self.E) - N_MF_old - N_FM_old
+        undoLog = []
+        self.E_MF, self.E_FM, chosen, step = proposePP(self.E, self.E_MF, self.E_FM, self.batch_size,
+                                                       self.indexSets, undoLog, self.moveWeights)
+        self.proposed[step] = self.proposed.get(step, 0) + 1
+        E_MF_old, E_FM_old = getUndoneEventSets(self.E, undoLog)
+        
+        ### accept or reject
+        ACC = "accepted"
+        
+        # Hastings correction (0 for single moves with equal move weights)
+        logHastings = logProposalRatio(step, len(chosen), N_out_old, N_MF_old + N_FM_old, 
+                                       self.moveWeights)
+        
+        # delayed acceptance: first screen with the surrogate (score terms only), 
+        # and only evaluate the exact likelihood for the proposals that pass
+        logSurrogate = 0
+        if self.delayed:
+            logSurrogate = self.evalSurrogateDelta(chosen, E_MF_old, E_FM_old, N_MF_old, N_FM_old)
+            prob = np.exp(min(logSurrogate + logHastings, 0))
+            if np.random.random_sample() >= prob:
+                ACC = "rejected"
+                self.firstStageRejects[step] = self.firstStageRejects.get(step, 0) + 1
+        
+        if ACC == "accepted":
+#            logLik_old = self.evalLikelihood(E_MF_old, E_FM_old, subset=chosen)
+#            logLik_propose = self.evalLikelihood(self.E_MF, self.E_FM, subset=chosen)
+            
+            # (no more HACK 2: only the changed pairs are evaluated)
+            # (of the tempered likelihood)
+            logDiff = self.evalLikelihoodDelta(E_MF_old, E_FM_old, chosen, N_MF_old, N_FM_old)
+            logNoise = self.temperature * len(chosen) * np.log(1/30 * 1/30)
+            
+            # HACK 3: add a "random noise point" density component to the likelihood
+            # assume an outside point comes from Unif([15,45] x [15,45])
+            # (one such term for each pair that is born/killed)
+            if step == 'b':
+                logDiff -= logNoise
+            elif step == 'd':
+                logDiff += logNoise
+            else:
+                pass
+            
+            # second stage of delayed acceptance: correct for the surrogate 
+            # (the proposal ratio cancels out here)
+            if self.delayed:
+                logDiff -= logSurrogate
+            else:
+                logDiff += logHastings
+            
+            if logDiff > 0:
+                prob = 1
+            else:
+                draw = np.random.random_sample()
+                prob = np.exp(logDiff)
+                if draw >= prob:
+                    ACC = "rejected"
+                    
+        if ACC == "rejected":
+            self.E_MF, self.E_FM = undoProposal(self.E, self.E_MF, self.E_FM, 
+                                                undoLog, self.indexSets)
+                
+        if ACC == "accepted":
+            if step in self.accept:
+                self.accept[step] += 1
+            else:
+                self.accept[step] = 1
+                
+        if verbose:
+            print("In iteration {}, acceptance prob. ={}, proposal type {} gets {}!".format(it, prob, step, ACC))
+        
+        return step, (ACC == "accepted")
+    
+    def adaptProposals(self, it, step, accepted, targetAccept=0.25):
+        '''
+        Stochastic approximation update of the proposal tuning after a proposePP move
+        (ONLY to be used during burn-in, so that the chain afterwards is a fixed MH kernel):
+            - running acceptance rates of each move type; the move weights follow them 
+                (floored at 0.05, so no move type is switched off)
+            - the batch size moves towards the overall target acceptance rate
+        it: iteration number (the step sizes decay as 1/(it+1)^0.6)
+        step: type of the move ('b', 'd', 's')
+        accepted: bool
+        targetAccept: target acceptance rate for the batch size
+        '''
+        gain = 1/(it+1)**0.6
+        k = 'bds'.index(step)
+        self.acceptRates[k] += gain * (accepted - self.acceptRates[k])
+        
+        self.moveWeights = np.maximum(self.acceptRates, 0.05)
+        self.moveWeights /= self.moveWeights.mean()
+        
+        maxLogBatch = np.log(max(len(self.E)/10, 1))
+        self.logBatchSize = np.clip(self.logBatchSize + gain * (accepted - targetAccept), 
+                                    0, maxLogBatch)
+        self.batch_size = int(round(np.exp(self.logBatchSize)))
+        
+        return
+    
+    def getProposalTuning(self):
+        '''
+        The current (e.g. tuned) proposal settings:
+            - "moveWeights": weights of the b, d, s moves
+            - "moveProbs": resulting move type probabilities at the current configuration
+            - "batch_size"
+            - "acceptRates": acceptance rate of each move type so far (accepted/proposed)
+        '''
+        N_in = len(self.E_MF) + len(self.E_FM)
+        return {'moveWeights': self.moveWeights.copy(),
+                'moveProbs': moveTypeProbs(len(self.E) - N_in, N_in, self.moveWeights),
+                'batch_size': self.batch_size,
+                'acceptRates': {t: self.accept.get(t, 0)/self.proposed[t] for t in self.proposed}}
+    
+    def evalPairTerms(self, pairs, surrogate=False):
+        '''
+        Per-pair log-likelihood terms of some pairs under each of the 3 states
+        (tempered as in evalLikelihood);
+        Returns (B,3) array, columns: outside, on MF surface, on FM surface
+        (the outside term includes the "random noise point" density of HACK 3;
+        the Poisson count terms are not included, see "evalCountTerms")
+        pairs: length B int array of pair indices
+        surrogate: if True, the surface densities are replaced by the uniform 
+            "random noise point" density (the delayed acceptance surrogate: 
+            only the score model, scale and count terms, no mixture density evaluations)
+        '''
+        L = self.L[pairs]; D = self.D[pairs]
+        beta = self.temperature
+        logNoise = np.log(1/30 * 1/30)
+        
+        terms = np.empty((len(pairs),3))
+        scoreL = normLogpdf(L, self.muL, self.gammaL)
+        
+        terms[:,0] = normLogpdf(L, 0, self.gammaL) + normLogpdf(D, 0, self.gammaD) + logNoise
+        if surrogate:
+            densMF = densFM = beta * logNoise
+        else:
+            X = self.Xall[pairs,:]
+            densMF = evalDensity(X, self.weightMF, self.componentsMF, temperature=beta)
+            densFM = evalDensity(X[:,::-1], self.weightFM, self.componentsFM, temperature=beta)
+        terms[:,0] *= beta
+        terms[:,1] = (beta * (scoreL + normLogpdf(D, self.muD, self.gammaD) + np.log(self.gammaMF)) + 
+                      densMF)
+        terms[:,2] = (beta * (scoreL + normLogpdf(D, self.muNegD, self.gammaD) + np.log(self.gammaFM)) + 
+                      densFM)
+        
+        return terms
+    
+    def evalSurrogateDelta(self, chosen, E_MF_old, E_FM_old, N_MF_old, N_FM_old):
+        '''
+        Cheap approximation of the log target change of a proposePP move 
+        (evalLikelihoodDelta plus the HACK 3 noise terms), 
+        with the surrogate terms of evalPairTerms
+        chosen: SORTED indices of the changed pairs
+        E_MF_old, E_FM_old, N_MF_old, N_FM_old: as in evalLikelihoodDelta
+        '''
+        pairs = np.array(chosen, dtype=int)
+        old = np.array([1 if i in E_MF_old else (2 if i in E_FM_old else 0) for i in chosen])
+        new = (np.where(self.indexSets['MF'].pos[pairs] >= 0, 1, 0) + 
+               np.where(self.indexSets['FM'].pos[pairs] >= 0, 2, 0))
+        
+        terms = self.evalPairTerms(pairs, surrogate=True)
+        rows = np.arange(len(pairs))
+        
+        return (np.sum(terms[rows, new] - terms[rows, old]) + 
+                self.temperature * (self.evalCountTerms(len(self.E_MF), len(self.E_FM)) - 
+                                    self.evalCountTerms(N_MF_old, N_FM_old)))
+    
+    def getFirstStageRejectionRate(self):
+        '''
+        Fraction of the proposals of each move type (and of all of them, "all") 
+        that were rejected by the surrogate in the first stage of delayed acceptance
+        '''
+        rates = {t: self.firstStageRejects.get(t, 0)/self.proposed[t] for t in self.proposed}
+        rates['all'] = sum(self.firstStageRejects.values())/max(sum(self.proposed.values()), 1)
+        
+        return rates
+    
+    def updatePPBatch(self, batch_size):
+        '''
+        A batch of MH moves on the point configurations (E_MF, E_FM):
+        draw up to batch_size DISTINCT pairs, propose to move each to one of its 
+        two other states (uniformly, so the proposal is symmetric), 
+        and accept or reject each move on its own.
+        
+        The per-pair terms and the acceptance draws are vectorized;
+        the moves are accepted in sequence since they are coupled through 
+        the Poisson count terms (log N_MF! and log N_FM!), which are tracked as running counts
+        '''
+        S = self.indexSets
+        pairs = np.array(samplePairs([S['out'], S['MF'], S['FM']], batch_size), dtype=int)
+        B = len(pairs)
+        if B == 0:
+            return
+        
+        # current states (0: outside, 1: MF, 2: FM), and the proposed ones
+        states = np.where(S['MF'].pos[pairs] >= 0, 1, 0) + np.where(S['FM'].pos[pairs] >= 0, 2, 0)
+        proposed = (states + np.random.randint(1, 3, size=B)) % 3
+        
+        terms = self.evalPairTerms(pairs)
+        rows = np.arange(B)
+        logDiff = terms[rows, proposed] - terms[rows, states]
+        beta = self.temperature
+        logU = np.log(np.random.random_sample(B))
+        
+        # change in N_MF and N_FM of each move
+        dMF = (proposed == 1).astype(int) - (states == 1)
+        dFM = (proposed == 2).astype(int) - (states == 2)
+        
+        # move types
+        steps = np.where(states == 0, 'b', np.where(proposed == 0, 'd', 's'))
+        for t in 'bds':
+            self.proposed[t] = self.proposed.get(t, 0) + int(np.sum(steps == t))
+        
+        N_MF = len(S['MF']); N_FM = len(S['FM'])
+        sets = [S['out'], S['MF'], S['FM']]
+        # (only moves that pass with the largest possible count term, log(N_MF+N_FM+B+1), 
+        # can be accepted, so the rest are skipped right away)
+        candidates = np.flatnonzero(logU < logDiff + beta * np.log(N_MF + N_FM + B + 1))
+        
+        for b in candidates:
+            # count terms: log(N!) changes by log(N+1) when adding, by -log(N) when removing
+            countDiff = 0.0
+            if dMF[b] == 1:
+                countDiff -= np.log(N_MF + 1)
+            elif dMF[b] == -1:
+                countDiff += np.log(N_MF)
+            if dFM[b] == 1:
+                countDiff -= np.log(N_FM + 1)
+            elif dFM[b] == -1:
+                countDiff += np.log(N_FM)
+                
+            if logU[b] >= logDiff[b] + beta * countDiff:
+                continue
+            
+            # accepted: apply the move
+            c = pairs[b]; old = states[b]; new = proposed[b]
+            if old == 1:
+                del self.E_MF[c]
+            elif old == 2:
+                del self.E_FM[c]
+            if new == 1:
+                self.E_MF[c] = self.E[c]
+            elif new == 2:
+                self.E_FM[c] = self.E[c][::-1]
+            sets[old].remove(c); sets[new].add(c)
+            N_MF += dMF[b]; N_FM += dFM[b]
+            
+            step = steps[b]
+            self.accept[step] = self.accept.get(step, 0) + 1
+            
+        return
+    
+    def evalTargetLikelihood(self, temperature=None):
+        '''
+        The (tempered) log likelihood of the current state that all the updates target
+        (evalLikelihood plus the "random noise point" density of HACK 3 for each outside pair),
+        at inverse temperature "temperature" (default: the chain's);
+        the log of the tempered posterior is this plus the log prior
+        '''
+        beta = self.temperature if temperature is None else temperature
+        N_out = len(self.E) - len(self.E_MF) - len(self.E_FM)
+        return (self.evalLikelihood(self.E_MF, self.E_FM, temperature=beta) + 
+                beta * N_out * np.log(1/30 * 1/30))
+    
+    def getState(self):
+        '''
+        The current state as two flat arrays (for cheap exchange between chains):
+            - C: length N int8 array, 0 = outside, 1 = on MF surface, 2 = on FM surface
+            - theta: float array of all the parameters, in the order
+                muL, gammaL, muD, muNegD, gammaD, gammaMF, gammaFM, weightMF, weightFM,
+                means and precisions of componentsMF, means and precisions of componentsFM
+        '''
+        C = np.zeros(len(self.E), dtype=np.int8)
+        C[self.indexSets['MF'].items[:len(self.indexSets['MF'])]] = 1
+        C[self.indexSets['FM'].items[:len(self.indexSets['FM'])]] = 2
+        
+        theta = np.concatenate([[self.muL, self.gammaL, self.muD, self.muNegD, self.gammaD,
+                                 self.gammaMF, self.gammaFM], 
+                                self.weightMF, self.weightFM] + 
+                               [np.ravel(a) for comps in (self.componentsMF, self.componentsFM)
+                                for comp in comps for a in comp])
+        return C, theta
+    
+    def setState(self, C, theta):
+        '''
+        Set the current state from the arrays returned by getState
+        '''
+        K = self.K
+        self.muL, self.gammaL, self.muD, self.muNegD, self.gammaD, self.gammaMF, self.gammaFM = theta[:7]
+        self.weightMF = np.array(theta[7:7+K]); self.weightFM = np.array(theta[7+K:7+2*K])
+        
+        comps = np.array(theta[7+2*K:]).reshape((2,K,6))
+        self.componentsMF = [(c[:2], c[2:].reshape((2,2))) for c in comps[0]]
+        self.componentsFM = [(c[:2], c[2:].reshape((2,2))) for c in comps[1]]
+        
+        self.E_MF = {i: self.E[i] for i in np.flatnonzero(C == 1)}
+        self.E_FM = {i: self.E[i][::-1] for i in np.flatnonzero(C == 2)}
+        self.indexSets = initializeIndexSets(len(self.E), self.E_MF, self.E_FM)
+        self.indsMF = self.indexSets['MF']
+        self.indsFM = self.indexSets['FM']
+        
+        return
+    
     def fit(self, E, L, D, samples = 1000, burn = 0, thin = 1, batch_size = 1,
-            random_seed = 42, verbose = True, debugHack = False):
+            random_seed = 42, verbose = True, debugHack = False, batched = False,
+            adapt = False, targetAccept = 0.25, temperature = 1, iterationHook = None,
+            delayed = False):
         '''
         Fit the model via MCMC
+        batched: if True, each iteration runs a batch of (up to) batch_size MH moves 
+            on distinct pairs (updatePPBatch), instead of one proposePP move
+        adapt: if True (and not batched), tune the move type weights and the batch size 
+            of proposePP during burn-in (see adaptProposals); they are fixed afterwards
+            and available from getProposalTuning
+        targetAccept: target acceptance rate for the batch size adaptation
+        temperature: inverse temperature; if < 1, sample from 
+            (complete-data likelihood)^temperature * prior, with the component labels summed out
+            (all updates target it, see evalTargetLikelihood; used by the replicas in parallel tempering)
+        iterationHook: optional function, called as iterationHook(self, it) 
+            at the end of each iteration (e.g. for state exchange between chains;
+            it may also change self.temperature, which is used from the next iteration on)
+        delayed: if True (single moves only, not batched), use delayed acceptance for 
+            the point configuration moves: proposals are first screened with a surrogate 
+            likelihood (the score model terms, see evalPairTerms), and the exact likelihood 
+            is only evaluated for those that pass; the chain still targets the exact posterior
+            (see getFirstStageRejectionRate). This shortens the MH step by about 20%, 
+            but also lowers its acceptance rate, and the mixture Gibbs updates dominate 
+            each iteration, so there is no net ESS/sec gain at the data sizes tried so far
+            (a surrogate with grid-interpolated surface densities was slower than the exact step)
         '''
+        if delayed and batched:
+            raise ValueError('delayed acceptance is only for single moves (batched=False): '
+                             'a batched move already evaluates its per-pair terms in one pass')
+        
         # set up
         self.E = E
         self.L = L
@@ -142,6 +532,14 @@ class LatentPoissonGMM:
         self.thin = thin
         self.maxIter = samples * thin + burn
         self.batch_size = batch_size
+        self.temperature = temperature
+        self.moveWeights = np.ones(3)
+        self.acceptRates = np.full(3, targetAccept)
+        self.logBatchSize = np.log(batch_size)
+        # all the points as an (N,2) array (row i is pair i)
+        self.Xall = np.array([E[i] for i in range(len(E))], dtype=float)
+        self.delayed = delayed
+        self.firstStageRejects = dict()
         
         np.random.seed(random_seed)
         
@@ -151,6 +549,7 @@ class LatentPoissonGMM:
         self.D, self.indsMF, self.indsFM, self.muD, self.muNegD, self.gammaD = initializeDirectScore(self.D, inds)
         # 2) the PP
         self.E_MF, self.E_FM, self.gammaMF, self.gammaFM = initializePP(self.E, self.indsMF, self.indsFM)
+        self.indexSets = initializeIndexSets(len(self.E), self.E_MF, self.E_FM)
         # 3) the MF surface
         X_MF = getPoints(self.E_MF)
         self.componentsMF, self.Z_MF = initializeGMM(X_MF, self.K)
@@ -166,6 +565,9 @@ class LatentPoissonGMM:
         # MCMC
         # 05/09 debug: hack it to fix everything else except E_MF, E_FM and see how it goes...
         for it in range(self.maxIter):
+            # (the temperature can be changed by iterationHook, see ParallelTemperingGMM)
+            temperature = self.temperature
+            
             ## 1. the score models
             # HACK it for debugging purposes:
             if debugHack:
@@ -173,82 +575,35 @@ class LatentPoissonGMM:
                 self.muD, self.muNegD, self.gammaD = Settings['muD'], Settings['muNegD'], Settings['gammaD']
             else:
                 self.muL, self.gammaL = updateLModel(self.L, self.E_MF, self.E_FM, self.muL, 
-                                                     self.gammaL, self.ScoreGammaPrior)
+                                                     self.gammaL, self.ScoreGammaPrior, temperature)
                 
                 self.muD, self.muNegD, self.gammaD = updateDModel(self.D, self.E_MF, self.E_FM, 
                                                                   self.muD, self.muNegD, 
-                                                                  self.gammaD, self.ScoreGammaPrior)                
+                                                                  self.gammaD, self.ScoreGammaPrior,
+                                                                  temperature)                
                 
             
             
             ## 2. the MF and FM point configurations
-            ### make a copy of the current version first
-            E_MF_old = copy(self.E_MF); E_FM_old = copy(self.E_FM)
-            
-            ### then propose change
-            self.E_MF, self.E_FM, chosen, step = proposePP(self.E, self.E_MF, self.E_FM, self.batch_size)
-            
-            ### accept or reject
-            ACC = "accepted"
-            
-#            logLik_old = self.evalLikelihood(E_MF_old, E_FM_old, subset=chosen)
-#            logLik_propose = self.evalLikelihood(self.E_MF, self.E_FM, subset=chosen)
-            
-#            N_MF_old = len(E_MF_old); N_FM_old = len(E_FM_old)
-#            N_MF = len(self.E_MF); N_FM = len(self.E_FM)
-#            
-#            logDiff = (logLik_propose - logLik_old + 
-#                       (N_MF - N_MF_old) * np.log(self.gammaMF) + 
-#                       (N_FM - N_FM_old) * np.log(self.gammaFM) -
-#                       np.sign(N_MF - N_MF_old) * np.log(range(min(N_MF,N_MF_old)+1,max(N_MF,N_MF_old)+1)).sum() -
-#                       np.sign(N_FM - N_FM_old) * np.log(range(min(N_FM,N_FM_old)+1,max(N_FM,N_FM_old)+1)).sum())
-#            
-            # HACK 2: calculate log-lik on the whole dataset instead of on subset...
-            logLik_old = self.evalLikelihood(E_MF_old, E_FM_old, subset=None)
-            logLik_propose = self.evalLikelihood(self.E_MF, self.E_FM, subset=None)
-            logDiff = logLik_propose - logLik_old
-            
-            # HACK 3: add a "random noise point" density component to the likelihood
-            # assume an outside point comes from Unif([15,45] x [15,45])
-            # NOTE: this only works with batch_size == 1 case!!
-            if step == 'b':
-                logDiff -= np.log(1/30 * 1/30)
-            elif step == 'd':
-                logDiff += np.log(1/30 * 1/30)
-            else:
-                pass
-            
-            if logDiff > 0:
-                #self.accept += 1
-                prob = 1
+            if batched:
+                self.updatePPBatch(self.batch_size)
             else:
-                draw = np.random.random_sample()
-                prob = np.exp(logDiff)
-                if draw < prob:
-                    #self.accept += 1
-                    pass
-                else:
-                    self.E_MF = E_MF_old; self.E_FM = E_FM_old
-                    ACC = "rejected"
-                    
-            if ACC == "accepted":
-                if step in self.accept:
-                    self.accept[step] += 1
-                else:
-                    self.accept[step] = 1
-                    
-            if verbose:
-                print("In iteration {}, acceptance prob. ={}, proposal type {} gets {}!".format(it, prob, step, ACC))
+                step, accepted = self.updatePPSingle(it, verbose)
+                if adapt and it < burn:
+                    self.adaptProposals(it, step, accepted, targetAccept)
+                    if verbose and it == burn-1:
+                        print('Tuned proposals: {}'.format(self.getProposalTuning()))
                 
-            self.indsMF = list(self.E_MF.keys())
-            self.indsFM = list(self.E_FM.keys())
+            self.indsMF = self.indexSets['MF']
+            self.indsFM = self.indexSets['FM']
                     
             ## 3. Update gammaMF and gammaFM
             # Hack it for debugging...
             if debugHack:
                 self.gammaMF, self.gammaFM = Settings['N_MF'], Settings['N_FM']
             else:
-                self.gammaMF, self.gammaFM = updateGammaPP(self.E_MF, self.E_FM, self.PPGammaPrior)
+                self.gammaMF, self.gammaFM = updateGammaPP(self.indexSets['MF'], self.indexSets['FM'], 
+                                                           self.PPGammaPrior, temperature)
             
             
             ## 4. Update the Gaussian Mixture Model for the densities
@@ -261,11 +616,13 @@ class LatentPoissonGMM:
                 self.weightMF = Settings['weightMF']
                 self.Z_MF = updateComponentIndicator(X_MF, self.weightMF, self.componentsMF)
             else:
-                self.Z_MF = updateComponentIndicator(X_MF, self.weightMF, self.componentsMF)
+                self.Z_MF = updateComponentIndicator(X_MF, self.weightMF, self.componentsMF, 
+                                                     temperature)
                 self.componentsMF = updateGaussianComponents(X_MF, self.Z_MF, 
                                                              self.componentsMF, 
-                                                             self.muPrior, self.precisionPrior)
-                self.weightMF = updateMixtureWeight(self.Z_MF, self.weightPrior)
+                                                             self.muPrior, self.precisionPrior,
+                                                             temperature)
+                self.weightMF = updateMixtureWeight(self.Z_MF, self.weightPrior, temperature)
             
             
             ### FM surface
@@ -277,11 +634,13 @@ class LatentPoissonGMM:
                 self.weightFM = Settings['weightFM']
                 self.Z_FM = updateComponentIndicator(X_FM, self.weightFM, self.componentsFM)
             else:
-                self.Z_FM = updateComponentIndicator(X_FM, self.weightFM, self.componentsFM)
+                self.Z_FM = updateComponentIndicator(X_FM, self.weightFM, self.componentsFM, 
+                                                     temperature)
                 self.componentsFM = updateGaussianComponents(X_FM, self.Z_FM, 
                                                              self.componentsFM, 
-                                                             self.muPrior, self.precisionPrior)
-                self.weightFM = updateMixtureWeight(self.Z_FM, self.weightPrior)
+                                                             self.muPrior, self.precisionPrior,
+                                                             temperature)
+                self.weightFM = updateMixtureWeight(self.Z_FM, self.weightPrior, temperature)
             
             ## 5. Save parameter in chains if...
             if (it >= burn) & ((it+1-burn) % thin == 0):
@@ -294,13 +653,18 @@ class LatentPoissonGMM:
                 self.chains['N_FM'].append(len(self.indsFM))
                 self.chains['gammaMF'].append(self.gammaMF)
                 self.chains['gammaFM'].append(self.gammaFM)
-                self.chains['componentsMF'].append(self.componentsMF)
-                self.chains['componentsFM'].append(self.componentsFM)
+                # (the component lists are updated in place, so save copies)
+                self.chains['componentsMF'].append(list(self.componentsMF))
+                self.chains['componentsFM'].append(list(self.componentsFM))
                 self.chains['weightMF'].append(self.weightMF)
                 self.chains['weightFM'].append(self.weightFM)
+                self.chains['logLik'].append(self.evalLikelihood(self.E_MF, self.E_FM, temperature=1))
                 
                 if verbose:
                     print('Parameters saved at iteration {}/{}.'.format(it, self.maxIter))
+                    
+            if iterationHook is not None:
+                iterationHook(self, it)
             
         return
     
@@ -322,25 +686,8 @@ class LatentPoissonGMM:
             
 
 #%%
-
-# try running the original model        
-
-Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
-      "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
-      "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
-      "weight": np.ones(3),
-      "gammaPP": {'n0': 1, 'b0': 0.02}}  
-
-model = LatentPoissonGMM(Priors = Pr, K=3)
-
-## Some completely made-up data that won't follow the model at all
-#E = {i: (np.random.random_sample(),np.random.random_sample()) for i in range(100)}
-#L = (1-0.3)* np.random.random_sample(100) + 0.3
-#D = np.random.random_sample(100)
-#
-#model.fit(E,L,D, samples=2000, burn=0, random_seed = 71)
-# for this one: one of the event sets will eventually get empty...
-
+# the simulation setting of the demo below
+# (fit with debugHack=True fixes the parameters at these values)
 Settings = {'N_MF': 100, 'N_FM': 100, 
             'muL': 2, 'muD': 1.5, 'muNegD': -1.5, 
             'gammaL': 1, 'gammaD': 1, 
@@ -351,35 +698,55 @@ Settings = {'N_MF': 100, 'N_FM': 100,
                              ([25,40], np.diag([1/9,1/4]))]}
 
 
-E, L, D = simulateLatentPoissonGMM(250, Settings)
+#%%
+if __name__ == '__main__':
+    # try running the original model        
+
+    Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
+          "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
+          "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
+          "weight": np.ones(3),
+          "gammaPP": {'n0': 1, 'b0': 0.02}}  
+
+    model = LatentPoissonGMM(Priors = Pr, K=3)
+
+    ## Some completely made-up data that won't follow the model at all
+    #E = {i: (np.random.random_sample(),np.random.random_sample()) for i in range(100)}
+    #L = (1-0.3)* np.random.random_sample(100) + 0.3
+    #D = np.random.random_sample(100)
+    #
+    #model.fit(E,L,D, samples=2000, burn=0, random_seed = 71)
+    # for this one: one of the event sets will eventually get empty...
+
+    E, L, D = simulateLatentPoissonGMM(250, Settings)
 
-E_MF = {i:a for i,a in E.items() if i in range(50)}
-E_FM = {i:a[::-1] for i,a in E.items() if i in range(50,100)}
+    E_MF = {i:a for i,a in E.items() if i in range(50)}
+    E_FM = {i:a[::-1] for i,a in E.items() if i in range(50,100)}
 
-# visualize a bit
-X = getPoints(E)
-plt.plot(X[:,0], X[:,1], "o")
-plt.show()
+    # visualize a bit
+    X = getPoints(E)
+    plt.plot(X[:,0], X[:,1], "o")
+    plt.show()
 
-plt.plot(L,"o")
-plt.show()
+    plt.plot(L,"o")
+    plt.show()
 
-plt.plot(D, "o")
-plt.show()
+    plt.plot(D, "o")
+    plt.show()
 
-# try to fit 
-model.fit(E, L, D, samples=3000, burn=0, random_seed = 71, batch_size=1, debugHack=False)
+    # try to fit 
+    model.fit(E, L, D, samples=3000, burn=0, random_seed = 71, batch_size=1, debugHack=False)
 
-# plot number of points in each process
-model.plotChains('N_MF')
-model.plotChains('N_FM')
-model.plotChains('weightMF')
-model.plotChains('weightFM')
-model.plotChains('muL')
-model.plotChains('muD')
+    # plot number of points in each process
+    model.plotChains('N_MF')
+    model.plotChains('N_FM')
+    model.plotChains('weightMF')
+    model.plotChains('weightFM')
+    model.plotChains('muL')
+    model.plotChains('muD')
 
-# check proposals
-print(model.accept) #{'s': 146, 'd': 206, 'b': 104}
+    # check proposals
+    print(model.accept) #{'s': 146, 'd': 206, 'b': 104}
 
 #%%
 # check GMM log density
@@ -418,431 +785,3 @@ print(model.accept) #{'s': 146, 'd': 206, 'b': 104}
 #np.all(all_DL == np.concatenate((LL_MF,LL_FM,LL_out)))
 
 #all_DL[50:100] == LL_FM # False!
-
-
-#%%
-
-# UPDATED model class and inference method       
-        
-from utilsH import *
-
-class LatentPoissonHGMM:
-    def __init__(self, Priors, K=3, linkThreshold=0.6):
-        '''
-        Inialize an instance of the LatentPoisson Hierarchical GMM model;
-        Priors: a big dictionary of all the priors
-            - "gammaPP": prior dictionary for the NHPP scale (gamma); 
-                need "n0" and "b0"
-            - "probs": prior vector (length 3) for the surface probability/proportion vector
-            - "muGMM": prior dictionary for the means in Gaussian Mixture; 
-                need "mean" and "precision"
-            - "precisionGMM": prior dictionary for the precision matrices in Gaussian Mixture;
-                need "df" and "invScale"
-            - "weight": prior vector (length K) for Gaussian Mixture weight;
-            - "gammaScore": prior dictionary for inverse variance of the score models;
-                need "nu0" and "sigma0"
-            
-        '''
-        self.name = "Latent Poisson Process with Gaussian Mixture density"
-        self.linkInitialThreshold = linkThreshold
-        # number of mixture components
-        self.K = K
-        # prior part
-        self.ScoreGammaPrior = Priors["gammaScore"]
-        self.muPrior = Priors["muGMM"]
-        self.precisionPrior = Priors["precisionGMM"]
-        self.weightPrior = Priors["weight"]
-        self.PPGammaPrior = Priors["gammaPP"]
-        self.probPrior = Priors["probs"]
-        # data part
-        self.E = None # all the (a_M,a_F) pairs
-        self.L = None # all the linked scores
-        self.D = None # all the direction scores
-        self.indsMF = None # indices on the MF surface
-        self.indsFM = None # indices on the FM surface
-        self.inds0 = None # indices for the outsider points
-        #self.E_MF = None # event set on MF surface
-        #self.E_FM = None # event set on FM surface
-        #self.E_0 = None # event set on the outside
-        # parameters
-        self.muL = None
-        self.muD = None
-        self.muNegD = None
-        self.gammaL = None
-        self.gammaD = None
-        self.gamma = None # the scale parameter for the entire NHPP
-        self.probs = None # the surface probability/proportions vector
-        self.C = None # the surface allocation vector for all events
-        self.components = None # a joint set of GMM components shared by all 3 surfaces
-        self.weightMF = None
-        self.weightFM = None
-        self.weight0 = None # GMM weights for the "outside" surface
-        self.Z = None # component indicator for all points (length N)
-#        self.Z_FM = None # component indicator for MF process
-#        self.Z_0 = None # component indicator for the outside process
-        self.params_to_record = ['muL','muD', 'muNegD', 'gammaL', 'gammaD', 
-                                 'N_MF', 'N_FM', 'gamma', 'probs', 'C', 
-                                 'components', 'weightMF', 'weightFM', 'weight0']
-        # log-likelihood
-        #self.log-lik-terms = None # each pair's contribution to the log-likelihood
-        self.log_lik = None # total log-likelihood
-        # posterior inference (summary statistics and chains)
-        self.maxIter = None
-        self.burn = 0
-        self.thin = 1
-        self.chains = {param: list() for param in self.params_to_record}
-            # a dictionary for parameter samples
-            
-    def evalLikelihood(self, subset=None):
-        '''
-        Evaluate likelihood
-        Returns total log likelihood 
-        (Currently no implementation on subset!!)
-        '''
-
-        # Right now: STUPID WAY - sum over individual entries
-        # later might change
-        
-        LLik = np.sum(evalLLikelihood(self.L, self.indsMF, self.indsFM, self.muL, 
-                                      self.gammaL, subset=subset, log=True))
-        DLik = np.sum(evalDLikelihood(self.D, self.indsMF, self.indsFM, 
-                                      self.muD, self.muNegD, 
-                                      self.gammaD, subset=subset, log=True))
-        
-        X = getPoints(self.E)
-        N = len(self.E)
-        
-        MFLik = np.sum(evalDensity(X[self.indsMF,:], self.weightMF, self.components, log=True)) if len(self.indsMF) > 0 else 0
-        FMLik = np.sum(evalDensity(X[self.indsFM,:], self.weightFM, self.components, log=True)) if len(self.indsFM) > 0 else 0
-        Lik0 =  np.sum(evalDensity(X[self.inds0,:], self.weight0, self.components, log=True)) if len(self.inds0) > 0 else 0 
-        
-        counts = np.array([len(self.inds0), len(self.indsMF), len(self.indsFM)])
-        
-        
-        total = LLik + DLik + MFLik + FMLik + Lik0 + counts.dot(np.log(self.probs))
-        total += N * np.log(self.gamma) - np.log(range(N)).sum() - self.gamma
-        
-#        if subset is None:
-#            to_add = (N_MF * np.log(self.gammaMF) + N_FM * np.log(self.gammaFM) - 
-#                      np.log(range(1,N_MF+1)).sum() - np.log(range(1,N_FM+1)).sum())
-#            total += to_add - (self.gammaMF + self.gammaFM)
-#            self.log_lik = total
-            
-        return total
-    
-    def updateTypeIndicator(self):
-        '''
-        Update the type indicator "C" for each point in the dataset
-        Returns a length-N vector of indicators (values in 0, 1, 2)
-        '''
-
-        N = len(self.E)
-        indsall = list(range(N))
-        
-        condProbs = np.empty((N,3))
-        
-        # h=0 (all outside)
-        condProbs[:,0] = (evalLLikelihood(self.L, [], [], self.muL, self.gammaL) + 
-                 evalDLikelihood(self.D, [], [], self.muD, self.muNegD, self.gammaD) + 
-                 evalDensity(getPoints(self.E), self.weight0, self.components) +
-                 np.log(self.probs[0]))
-        
-        # h=1 (all in MF)
-        condProbs[:,1] = (evalLLikelihood(self.L, indsall, [], self.muL, self.gammaL) + 
-                 evalDLikelihood(self.D, indsall, [], self.muD, self.muNegD, self.gammaD) + 
-                 evalDensity(getPoints(self.E), self.weightMF, self.components) +
-                 np.log(self.probs[1]))
-        
-        # h=2 (all in FM)
-        condProbs[:,2] = (evalLLikelihood(self.L, [], indsall, self.muL, self.gammaL) + 
-                 evalDLikelihood(self.D, [], indsall, self.muD, self.muNegD, self.gammaD) + 
-                 evalDensity(getPoints(self.E), self.weightFM, self.components) +
-                 np.log(self.probs[2]))
-        
-        self.C = np.apply_along_axis(lambda v: choice(range(3), replace=False, 
-                                                      p=getProbVector(v)), 1, condProbs)
-
-        
-        return
-        
-
-    
-    def fit(self, E, L, D, samples = 1000, burn = 0, thin = 1, random_seed = 42, 
-            verbose = True, debugHack = False):
-        '''
-        Fit the model via MCMC
-        '''
-        # set up
-        self.E = E
-        self.L = L
-        self.D = D
-        N = len(E)
-        #self.log-lik-terms = np.empty(len(E))
-        self.burn = burn
-        self.thin = thin
-        self.maxIter = samples * thin + burn
-        
-        np.random.seed(random_seed)
-        
-        # (Take care of all the gamma draws at the beginning???)
-        
-        
-        # initialize
-        # 1) scores
-        self.L, inds, self.muL, self.gammaL = initializeLinkedScore(self.L, self.linkInitialThreshold)
-        self.D, self.indsMF, self.indsFM, self.muD, self.muNegD, self.gammaD = initializeDirectScore(self.D, inds)
-        # 2) the PP
-        self.gamma, self.probs = initializePP(self.E, self.indsMF, self.indsFM)
-        self.C = np.zeros(N)
-        self.C[self.indsMF] = 1
-        self.C[self.indsFM] = 2
-        # 3) Gaussian components
-        X = getPoints(self.E)
-        self.components, self.Z = initializeGMM(X, self.K)
-        # 4) GMM weights
-        # 4.1) MF surface
-        X_MF = X[self.indsMF,:]
-        self.weightMF = updateMixtureWeight(self.Z[self.indsMF], self.weightPrior)
-        # 4.2) the FM surface
-        X_FM = X[self.indsFM,:]
-        self.weightFM = updateMixtureWeight(self.Z[self.indsFM], self.weightPrior)
-        # 4.2) the outsiders
-        self.inds0 = np.where(self.C == 0)[0]
-        X_0 = X[self.inds0,:]
-        self.weight0 = updateMixtureWeight(self.Z[self.inds0], self.weightPrior)
-        
-        if(verbose):
-            print('Initialization done!')
-        
-        # MCMC
-        # 05/09 debug: hack it to fix everything else except E_MF, E_FM and see how it goes...
-        for it in range(self.maxIter):
-            ## 1. the score models
-            # HACK it for debugging purposes:
-            if debugHack:
-                self.muL, self.gammaL = Settings['muL'], Settings['gammaL']
-                self.muD, self.muNegD, self.gammaD = Settings['muD'], Settings['muNegD'], Settings['gammaD']
-            else:
-                self.muL, self.gammaL = updateLModel(self.L, self.indsMF, self.indsFM, self.muL, 
-                                                     self.gammaL, self.ScoreGammaPrior)
-                
-                self.muD, self.muNegD, self.gammaD = updateDModel(self.D, self.indsMF, self.indsFM, 
-                                                                  self.muD, self.muNegD, 
-                                                                  self.gammaD, self.ScoreGammaPrior)                
-                
-            
-            
-            ## 2. the point configurations
-            
-            ## 2.1 update event type allocation
-            self.updateTypeIndicator()
-            
-            ## 2.2 update probs
-            self.probs = updateProbs(self.C, self.probPrior)
-            
-            ## 2.3 bookkeeping
-            self.indsMF = np.where(self.C == 1)[0]
-            self.indsFM = np.where(self.C == 2)[0]
-            self.inds0 = np.where(self.C == 0)[0]
-            
-            #self.E_MF = {pair: age for pair, age in self.E.items() if pair in self.indsMF}
-            #self.E_FM = {pair: age for pair, age in self.E.items() if pair in self.indsFM}
-            #self.E_0 = {pair: age for pair, age in self.E.items() if pair in inds0}
-            
-                    
-            ## 3. Update gamma
-            self.gamma = np.random.gamma(self.PPGammaPrior['n0']+N, 1/(self.PPGammaPrior['b0']+1))
-            
-            ## 4. Update the Gaussian Mixture Model for the densities
-            ### the part shared by everyone
-            self.components = updateGaussianComponents(X, self.Z, self.components, 
-                                                       self.muPrior, self.precisionPrior)
-            
-            
-            # 4.1 MF surface
-            X_MF = X[self.indsMF,:]
-            self.Z[self.indsMF] = updateComponentIndicator(X_MF, self.weightMF, self.components)
-            self.weightMF = updateMixtureWeight(self.Z[self.indsMF], self.weightPrior)
-            # 4.2 the FM surface
-            X_FM = X[self.indsFM,:]
-            self.Z[self.indsFM] = updateComponentIndicator(X_FM, self.weightFM, self.components)
-            self.weightFM = updateMixtureWeight(self.Z[self.indsFM], self.weightPrior)
-            # 4.3 the outsiders
-            X_0 = X[self.inds0,:]
-            self.Z[self.inds0] = updateComponentIndicator(X_0, self.weight0, self.components)
-            self.weight0 = updateMixtureWeight(self.Z[self.inds0], self.weightPrior)
-
-            
-            ## 5. Save parameter in chains if...
-            if (it >= burn) & ((it+1-burn) % thin == 0):
-                self.chains['muL'].append(self.muL)
-                self.chains['muD'].append(self.muD)
-                self.chains['muNegD'].append(self.muNegD)
-                self.chains['gammaL'].append(self.gammaL)
-                self.chains['gammaD'].append(self.gammaD)
-                self.chains['N_MF'].append(len(self.indsMF))
-                self.chains['N_FM'].append(len(self.indsFM))
-                self.chains['gamma'].append(self.gamma)
-                self.chains['probs'].append(self.probs)
-                self.chains['C'].append(self.C)
-                self.chains['components'].append(self.components)
-                self.chains['weightMF'].append(self.weightMF)
-                self.chains['weightFM'].append(self.weightFM)
-                self.chains['weight0'].append(self.weight0)
-                
-                if verbose:
-                    print('Parameters saved at iteration {}/{}.'.format(it, self.maxIter))
-            
-        return
-    
-    def plotChains(self, param):
-        if param.startswith('compo'):
-            # don't deal with components right now...
-            pass
-        elif param=="C":
-            # don't deal with C indicators either...
-            pass
-        elif param.startswith('weight'):
-            chain = np.array(self.chains[param])
-            for k in range(self.K):
-                plt.plot(chain[:,k],"-",label=str(k))
-            plt.legend('upper right')
-            plt.show()
-        elif param.startswith('prob'):
-            chain = np.array(self.chains[param])
-            for h in range(3):
-                plt.plot(chain[:,h],"-",label=str(h))
-            plt.legend('upper right')
-            plt.show()
-        else:
-            plt.plot(self.chains[param])
-            plt.show()
-            
-        return
-
-
-
- 
-#%%
-# try running the updated new model
- 
-Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
-      "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
-      "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
-      "weight": np.ones(3), "probs": np.ones(3),
-      "gammaPP": {'n0': 1, 'b0': 0.02}}  
-
-model = LatentPoissonHGMM(Priors = Pr, K=3)
-
-## Some completely made-up data that won't follow the model at all
-#E = {i: (np.random.random_sample(),np.random.random_sample()) for i in range(100)}
-#L = (1-0.3)* np.random.random_sample(100) + 0.3
-#D = np.random.random_sample(100)
-#
-#model.fit(E,L,D, samples=2000, burn=0, random_seed = 71)
-# for this one: one of the event sets will eventually get empty...
-
-Settings = {'N_MF': 100, 'N_FM': 100, 
-            'muL': 2, 'muD': 1.5, 'muNegD': -1.5, 
-            'gammaL': 1, 'gammaD': 1, 
-            'weightMF': np.array([0.4, 0.5, 0.1]), 'weightFM': np.array([0.4, 0.1, 0.5]),
-            'weight0': np.array([0.1,0.1,0.8]),
-            'components': [([40,40], np.diag([1/4,1/4])), ([25,25], np.diag([1/9,1/9])), 
-                             ([40,25], np.diag([1/4,1/9]))]}
-
-
-E, L, D = simulateLatentPoissonHGMM(250, Settings)
-
-E_MF = {i:a for i,a in E.items() if i in range(100)}
-E_FM = {i:a for i,a in E.items() if i in range(100,200)}
-
-# visualize a bit
-X = getPoints(E)
-plt.plot(X[:,0], X[:,1], "o")
-plt.show()
-
-plt.plot(L,"o")
-plt.show()
-
-plt.plot(D, "o")
-plt.show()
-
-# try to fit 
-model.fit(E, L, D, samples=3000, burn=0, random_seed = 71, debugHack=False)
-
-# plot number of points in each process
-model.plotChains('N_MF')
-model.plotChains('N_FM')
-model.plotChains('weightMF')
-model.plotChains('weightFM')
-model.plotChains('weight0')
-model.plotChains('muL')
-model.plotChains('muD')
-
-
-#%%
-# try running the updated new model
-# a harder version
- 
-Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
-      "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
-      "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
-      "weight": np.ones(6), "probs": np.ones(3),
-      "gammaPP": {'n0': 1, 'b0': 0.02}}  
-
-model = LatentPoissonHGMM(Priors = Pr, K=6)
-
-## Some completely made-up data that won't follow the model at all
-#E = {i: (np.random.random_sample(),np.random.random_sample()) for i in range(100)}
-#L = (1-0.3)* np.random.random_sample(100) + 0.3
-#D = np.random.random_sample(100)
-#
-#model.fit(E,L,D, samples=2000, burn=0, random_seed = 71)
-# for this one: one of the event sets will eventually get empty...
-
-Settings = {'N_MF': 100, 'N_FM': 100, 
-            'muL': 2, 'muD': 1.5, 'muNegD': -1.5, 
-            'gammaL': 1, 'gammaD': 1, 
-            'weightMF': np.array([0.6, 0.4, 0, 0, 0, 0]), 
-            'weightFM': np.array([0.1, 0.4, 0.5, 0, 0, 0]),
-            'weight0': np.array([0, 0, 0, 0.3, 0.3, 0.4]),
-            'components': [([40,40], np.diag([1/4,1/4])), ([25,25], np.diag([1/9,1/9])), 
-                             ([40,25], np.diag([1/4,1/9])), ([30,30], np.diag([1/9,1/9])),
-                             ([35,20], np.diag([1/16,1/16])), ([35,35], np.diag([1/9,1/4]))]}
-
-
-E, L, D = simulateLatentPoissonHGMM(250, Settings)
-
-E_MF = {i:a for i,a in E.items() if i in range(100)}
-E_FM = {i:a for i,a in E.items() if i in range(100,200)}
-
-# visualize a bit
-X = getPoints(E)
-plt.plot(X[:,0], X[:,1], "o")
-plt.show()
-
-plt.plot(X[range(100),0], X[range(100),1], "o")
-plt.show()
-
-plt.plot(X[range(100,200),0], X[range(100,200),1], "o")
-plt.show()
-
-
-plt.plot(L,"o")
-plt.show()
-
-plt.plot(D, "o")
-plt.show()
-
-# try to fit 
-model.fit(E, L, D, samples=3000, burn=0, random_seed = 71, debugHack=False)
-
-# plot number of points in each process
-model.plotChains('N_MF')
-model.plotChains('N_FM')
-model.plotChains('weightMF')
-model.plotChains('weightFM')
-model.plotChains('weight0')
-model.plotChains('muL')
-model.plotChains('muD')
-model.plotChains('probs')
\ No newline at end of file
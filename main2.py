@@ -8,7 +8,8 @@ Created on Sun Jun 28 15:14:35 2020
 
 #%%
 import os
-os.chdir('/Users/fan/Documents/Research_and_References/HIV_transmission_flow/')
+if __name__ == '__main__':
+    os.chdir('/Users/fan/Documents/Research_and_References/HIV_transmission_flow/')
 
 from copy import copy#, deepcopy
 
@@ -83,7 +84,7 @@ class LatentPoissonGMM2:
                                  'N_MF', 'N_FM', 'gammaMF', 'gammaFM', 
                                  'componentsMF', 'weightMF',
                                  'componentsFM', 'weightFM',
-                                 'N_MF', 'N_FM', 'C', 'etaMF', 'etaFM']
+                                 'N_MF', 'N_FM', 'C', 'etaMF', 'etaFM', 'logLik']
         # log-likelihood
         #self.log-lik-terms = None # each pair's contribution to the log-likelihood
         self.log_lik = None # total log-likelihood
@@ -96,40 +97,37 @@ class LatentPoissonGMM2:
             
     def evalLikelihood(self, subset=None):
         '''
-        Evaluate likelihood
-        Returns total log likelihood 
-        (Currently no implementation on subset!!)
-        
-        (06/28: not modified yet - not used right now)
+        Evaluate the complete-data log likelihood given the type indicators C
+        Returns total log likelihood (or log-likelihood part on the subset)
+        subset: SORTED indices of subset to evaluate on 
+            (the -gammaMF-gammaFM term is only added for the whole dataset)
         '''
 
-        # Right now: STUPID WAY - sum over individual entries
-        # later might change
-        
         LLik = np.sum(evalLLikelihood(self.L, self.indsMF, self.indsFM, self.muL, 
                                       self.gammaL, subset=subset, log=True))
         DLik = np.sum(evalDLikelihood(self.D, self.indsMF, self.indsFM, 
                                       self.muD, self.muNegD, 
                                       self.gammaD, subset=subset, log=True))
         
-        X = getPoints(self.E)
-        N = len(self.E)
-        
-        MFLik = np.sum(evalDensity(X[self.indsMF,:], self.weightMF, self.components, log=True)) if len(self.indsMF) > 0 else 0
-        FMLik = np.sum(evalDensity(X[self.indsFM,:], self.weightFM, self.components, log=True)) if len(self.indsFM) > 0 else 0
-        Lik0 =  np.sum(evalDensity(X[self.inds0,:], self.weight0, self.components, log=True)) if len(self.inds0) > 0 else 0 
+        inds = np.arange(len(self.E)) if subset is None else np.array(subset)
+        X = getPoints(self.E)[inds,:]
+        C = self.C[inds]
         
-        counts = np.array([len(self.inds0), len(self.indsMF), len(self.indsFM)])
+        onMF = (C % 2 == 0)
+        MFLik = np.sum(evalDensity(X[onMF,:], self.weightMF, self.componentsMF, log=True)) if np.any(onMF) else 0
+        FMLik = np.sum(evalDensity(X[~onMF,:][:,(1,0)], self.weightFM, self.componentsFM, log=True)) if np.any(~onMF) else 0
         
+        # counts of C=0,1,2,3
+        counts = np.bincount(C, minlength=4)
         
-        total = LLik + DLik + MFLik + FMLik + Lik0 + counts.dot(np.log(self.probs))
-        total += N * np.log(self.gamma) - np.log(range(N)).sum() - self.gamma
+        total = LLik + DLik + MFLik + FMLik
+        total += counts.dot(np.log([1-self.etaMF, 1-self.etaFM, self.etaMF, self.etaFM]))
+        total += ((counts[0] + counts[2]) * np.log(self.gammaMF) + 
+                  (counts[1] + counts[3]) * np.log(self.gammaFM))
         
-#        if subset is None:
-#            to_add = (N_MF * np.log(self.gammaMF) + N_FM * np.log(self.gammaFM) - 
-#                      np.log(range(1,N_MF+1)).sum() - np.log(range(1,N_FM+1)).sum())
-#            total += to_add - (self.gammaMF + self.gammaFM)
-#            self.log_lik = total
+        if subset is None:
+            total -= (self.gammaMF + self.gammaFM)
+            self.log_lik = total
             
         return total
     
@@ -300,6 +298,7 @@ class LatentPoissonGMM2:
                 self.chains['componentsFM'].append(self.componentsFM)
                 self.chains['weightMF'].append(self.weightMF)
                 self.chains['weightFM'].append(self.weightFM)
+                self.chains['logLik'].append(self.evalLikelihood())
                 
                 if verbose:
                     print('Parameters saved at iteration {}/{}.'.format(it, self.maxIter))
@@ -345,26 +344,8 @@ class LatentPoissonGMM2:
 
  
 #%%
-# try running the updated new model
- 
-Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
-      "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
-      "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
-      "weight": np.ones(3), "probs": np.ones(3),
-      "gammaPP": {'n0': 1, 'b0': 0.02},
-      "eta": {'a': 1, 'b': 1}}  
-
-model = LatentPoissonGMM2(Priors = Pr, K=3)
-
-## Some completely made-up data that won't follow the model at all
-#E = {i: (np.random.random_sample(),np.random.random_sample()) for i in range(100)}
-#L = (1-0.3)* np.random.random_sample(100) + 0.3
-#D = np.random.random_sample(100)
-#
-#model.fit(E,L,D, samples=2000, burn=0, random_seed = 71)
-# for this one: one of the event sets will eventually get empty...
-
-
+# the simulation settings (pick one of V1, V2, V3)
+# (fit with debugHack=True fixes the score models at these values)
 # =============================================================================
 # V1
 ## adapted from the 2-surface version
@@ -377,7 +358,7 @@ model = LatentPoissonGMM2(Priors = Pr, K=3)
 #             'componentsFM': [([40,40], np.diag([1/4,1/4])), ([25,25], np.diag([1/9,1/9])), 
 #                              ([25,40], np.diag([1/9,1/4]))]}
               ## In this setting: components of MF and FM are essentially the same!
-              
+
 # =============================================================================
 
 # =============================================================================
@@ -406,43 +387,64 @@ Settings = {'N_MF': 80, 'N_FM': 70, 'N_MF0':20, 'N_FM0': 30,
 #            'componentsFM': [([20,40], np.diag([1/4,1/4])), ([25,45], np.diag([1/9,1/9])), 
 #                             ([25,40], np.diag([1/9,1/4]))]}
 
-            
 
-E, L, D = simulateLatentPoissonGMM2(Settings)
+#%%
+# try running the updated new model
+if __name__ == '__main__':
+    Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
+          "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
+          "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
+          "weight": np.ones(3), "probs": np.ones(3),
+          "gammaPP": {'n0': 1, 'b0': 0.02},
+          "eta": {'a': 1, 'b': 1}}  
+
+    model = LatentPoissonGMM2(Priors = Pr, K=3)
+
+    ## Some completely made-up data that won't follow the model at all
+    #E = {i: (np.random.random_sample(),np.random.random_sample()) for i in range(100)}
+    #L = (1-0.3)* np.random.random_sample(100) + 0.3
+    #D = np.random.random_sample(100)
+    #
+    #model.fit(E,L,D, samples=2000, burn=0, random_seed = 71)
+    # for this one: one of the event sets will eventually get empty...
+
+
+    E, L, D = simulateLatentPoissonGMM2(Settings)
 
-E_MF = {i:a for i,a in E.items() if i in range(80)}
-E_FM = {i:a[::-1] for i,a in E.items() if i in range(80,150)}
+    E_MF = {i:a for i,a in E.items() if i in range(80)}
+    E_FM = {i:a[::-1] for i,a in E.items() if i in range(80,150)}
 
 
-# visualize a bit
-X = getPoints(E)
-plt.plot(X[:,0], X[:,1], "o")
-plt.show()
+    # visualize a bit
+    X = getPoints(E)
+    plt.plot(X[:,0], X[:,1], "o")
+    plt.show()
 
-plt.plot(L,"o")
-plt.show()
+    plt.plot(L,"o")
+    plt.show()
 
-plt.plot(D, "o")
-plt.show()
+    plt.plot(D, "o")
+    plt.show()
 
 #%%
 # try to fit 
-model.fit(E, L, D, samples=2000, burn=0, random_seed = 89, debugHack=False)
-
-# plot number of points in each process
-model.plotChains('N_MF')
-model.plotChains('N_FM')
-model.plotChains('weightMF','weightMF_diffGMM.pdf')
-model.plotChains('weightFM','weightFM_diffGMM.pdf')
-model.plotChains('etaMF')
-model.plotChains('muL')
-model.plotChains('muD')
-
-### Finding based on v1 and v2
-## The MF and FM surfaces should have different patterns 
-## (If pattern similar, then a lot of points will be dragged to one surface and the chain breaks down)
-## the GMM may experience label switching problems
-## but otherwise not too bad (the type indicators not exactly correct, but mostly alright)
-
-### Based on V3
-### As long as the components are somewhat different, it works!
\ No newline at end of file
+if __name__ == '__main__':
+    model.fit(E, L, D, samples=2000, burn=0, random_seed = 89, debugHack=False)
+
+    # plot number of points in each process
+    model.plotChains('N_MF')
+    model.plotChains('N_FM')
+    model.plotChains('weightMF','weightMF_diffGMM.pdf')
+    model.plotChains('weightFM','weightFM_diffGMM.pdf')
+    model.plotChains('etaMF')
+    model.plotChains('muL')
+    model.plotChains('muD')
+
+    ### Finding based on v1 and v2
+    ## The MF and FM surfaces should have different patterns 
+    ## (If pattern similar, then a lot of points will be dragged to one surface and the chain breaks down)
+    ## the GMM may experience label switching problems
+    ## but otherwise not too bad (the type indicators not exactly correct, but mostly alright)
+
+    ### Based on V3
+    ### As long as the components are somewhat different, it works!
\ No newline at end of file
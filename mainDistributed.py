@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:12:27 2026
+
+@author: fan
+"""
+
+# This file:
+# multi-node version of the data-parallel DP GMM sampler (see mainShard.py):
+# the workers hold their shard of the pairs (data AND state) and can run on other machines,
+# talking to the coordinator through a pluggable transport (TCP sockets, or a local pipe);
+# the coordinator keeps no per-pair state (types, labels, type probabilities) during the run 
+# and records no C chain (use getTypeProbabilities); the workers draw the initial types 
+# and labels of their shard themselves.
+# NOTE: the coordinator still holds the data (fit takes E, L, D): the initialization 
+# (scores, first mixtures) uses all the pairs, and each worker gets its shard from it
+#
+# To run a worker on a node:  python mainDistributed.py worker PORT
+# then give the coordinator SocketTransport.connect(host, PORT) for each node
+# (for a test on one machine: startLocalWorkers)
+
+# Wire format (the same for every transport; integers are big-endian)
+#   frame  = length (uint64, size of the rest of the frame)
+#            + headerLength (uint32) + header + data
+#   header = UTF-8 JSON object:
+#            {"kind": message kind,
+#             "values": {name: number, or (nested) list/dict of numbers/strings},
+#             "arrays": [{"name": ..., "dtype": numpy dtype string (e.g. "<f8", "<i8"), "shape": [...]}, ...]}
+#   data   = the bytes of the arrays (C order), one after another, in the order of "arrays"
+# Messages (coordinator -> worker, and the reply):
+#   "init":    the shard: arrays X (n,2), L, D; values K, Kmax, Priors, 
+#              seed (entropy and spawn_key of a numpy SeedSequence); and the initial 
+#              parameters, as in "sweep" -> "ready": the sufficient statistics of the shard 
+#              after its initial joint draw of the types and labels
+#              (values sumSqL, sumSqD; arrays as in "stats")
+#   "sweep":   values fraction and the scalar parameters; arrays of the weights and components
+#              (see packParameters) -> "stats": the changes of the sufficient statistics
+#              (arrays typeCounts, sumL, sumD, compCounts, compSums, compXXsums)
+#   "record":  (no reply) the worker adds its typeProbs to its running sum
+#   "collect": -> "state": arrays C, Z, typeProbSum of the shard
+#   "stop":    (no reply) the worker exits
+#   (a worker that fails replies "error", with values message)
+
+#%%
+import sys
+import json
+import socket
+import struct
+import multiprocessing as mp
+
+import numpy as np
+
+from main2_DPGMM import LatentPoissonDPGMM2
+from utils2_DPGMM import DPGMMWorkspace, GaussianComponents, rng, default_rng
+
+
+def encodeMessage(kind, values=None, arrays=None):
+    '''
+    Encode a message as one frame of the wire format;
+    values: dictionary of JSON-able values (numpy scalars and arrays are converted to lists)
+    arrays: dictionary of numpy arrays
+    Returns bytes
+    '''
+    arrays = dict() if arrays is None else arrays
+    data = [np.ascontiguousarray(a) for a in arrays.values()]
+    header = {'kind': kind, 'values': dict() if values is None else values,
+              'arrays': [{'name': name, 'dtype': a.dtype.str, 'shape': list(a.shape)}
+                         for name, a in zip(arrays, data)]}
+    header = json.dumps(header, default=lambda x: x.tolist()).encode('utf-8')
+
+    body = b''.join([struct.pack('>I', len(header)), header] + [a.tobytes() for a in data])
+
+    return struct.pack('>Q', len(body)) + body
+
+
+def decodeMessage(frame):
+    '''
+    Decode one frame of the wire format;
+    Returns (kind, values, arrays) (arrays: dictionary of numpy arrays)
+    '''
+    headerLength, = struct.unpack_from('>I', frame, 8)
+    header = json.loads(frame[12:12+headerLength].decode('utf-8'))
+
+    arrays = dict()
+    offset = 12 + headerLength
+    for spec in header['arrays']:
+        dtype = np.dtype(spec['dtype'])
+        size = int(np.prod(spec['shape'])) * dtype.itemsize
+        arrays[spec['name']] = np.frombuffer(frame, dtype=dtype, count=size // dtype.itemsize,
+                                             offset=offset).reshape(spec['shape']).copy()
+        offset += size
+
+    return header['kind'], header['values'], arrays
+
+
+class Transport:
+    '''
+    A connection between the coordinator and one worker, carrying messages in the
+    wire format above; a transport only has to move whole frames (sendBytes, recvBytes),
+    so e.g. a message queue can be plugged in by implementing those two
+    '''
+    def send(self, kind, values=None, arrays=None):
+        self.sendBytes(encodeMessage(kind, values, arrays))
+
+    def recv(self):
+        '''
+        Receive one message; Returns (kind, values, arrays);
+        raises RuntimeError if the other end replied with an error
+        '''
+        kind, values, arrays = decodeMessage(self.recvBytes())
+        if kind == 'error':
+            raise RuntimeError('Worker failed: {}'.format(values['message']))
+        return kind, values, arrays
+
+    def sendBytes(self, frame):
+        raise NotImplementedError
+
+    def recvBytes(self):
+        raise NotImplementedError
+
+    def close(self):
+        return
+
+
+class SocketTransport(Transport):
+    def __init__(self, sock):
+        '''
+        Transport over a connected TCP socket
+        '''
+        self.sock = sock
+
+    @classmethod
+    def connect(cls, host, port, timeout=30.0):
+        '''
+        Connect to a worker listening on (host, port) (timeout: seconds to wait for it)
+        '''
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(sock)
+
+    def sendBytes(self, frame):
+        self.sock.sendall(frame)
+
+    def recvBytes(self):
+        length = self.recvExactly(8)
+        return length + self.recvExactly(struct.unpack('>Q', length)[0])
+
+    def recvExactly(self, n):
+        buf = bytearray(n)
+        view = memoryview(buf)
+        start = 0
+        while start < n:
+            got = self.sock.recv_into(view[start:])
+            if got == 0:
+                raise ConnectionError('connection closed')
+            start += got
+        return bytes(buf)
+
+    def close(self):
+        self.sock.close()
+
+
+class PipeTransport(Transport):
+    def __init__(self, conn):
+        '''
+        Transport over a multiprocessing Connection (for workers on the same machine)
+        '''
+        self.conn = conn
+
+    def sendBytes(self, frame):
+        self.conn.send_bytes(frame)
+
+    def recvBytes(self):
+        return self.conn.recv_bytes()
+
+    def close(self):
+        self.conn.close()
+
+
+def packParameters(model):
+    '''
+    The global parameters of a LatentPoissonDPGMM2 that the workers need
+    Returns (values, arrays) for a message
+    '''
+    values = {key: float(getattr(model, key)) for key in
+              ['muL', 'gammaL', 'muD', 'muNegD', 'gammaD', 'gammaMF', 'gammaFM', 'etaMF', 'etaFM']}
+    arrays = {'weightMF': model.weightMF, 'weightFM': model.weightFM,
+              'meansMF': model.componentsMF.means, 'precisionsMF': model.componentsMF.precisions,
+              'meansFM': model.componentsFM.means, 'precisionsFM': model.componentsFM.precisions}
+    return values, arrays
+
+
+def unpackParameters(model, values, arrays):
+    '''
+    Set the global parameters of a (worker's) model from packParameters
+    '''
+    for key in ['muL', 'gammaL', 'muD', 'muNegD', 'gammaD', 'gammaMF', 'gammaFM', 'etaMF', 'etaFM']:
+        setattr(model, key, values[key])
+    model.weightMF, model.weightFM = arrays['weightMF'], arrays['weightFM']
+    model.componentsMF = GaussianComponents(arrays['meansMF'], arrays['precisionsMF'])
+    model.componentsFM = GaussianComponents(arrays['meansFM'], arrays['precisionsFM'])
+
+    return
+
+
+def runWorker(transport):
+    '''
+    Serve one coordinator over a transport (see the messages above) until "stop"
+    '''
+    try:
+        kind, values, arrays = transport.recv()
+        Priors = {key: ({k: np.asarray(v) for k, v in value.items()} if isinstance(value, dict)
+                        else np.asarray(value))
+                  for key, value in values['Priors'].items()}
+
+        # a model that only holds this shard
+        model = LatentPoissonDPGMM2(Priors, K=values['K'], Kmax=values['Kmax'])
+        model.L, model.D = arrays['L'], arrays['D']
+        model.workspace = DPGMMWorkspace(arrays['X'], values['Kmax'])
+        unpackParameters(model, values, arrays)
+
+        entropy, spawnKey = values['seed']
+        generator = default_rng(np.random.SeedSequence(entropy, spawn_key=spawnKey))
+        n = len(model.L)
+
+        # the initial joint draw of the types and labels of the shard
+        # (copies: the draws of a subset live in buffers that the sweeps re-use)
+        pairs = np.arange(n)
+        C, Z, probs = model.drawTypesAndLabels(pairs, ws=model.workspace, generator=generator)
+        model.C, model.Z_joint, model.typeProbs = C.copy(), Z.copy(), probs.copy()
+        typeProbSum = np.zeros_like(model.typeProbs)
+        transport.send('ready', {'sumSqL': np.dot(model.L, model.L), 
+                                 'sumSqD': np.dot(model.D, model.D)}, 
+                       model.getScanStats(pairs, model.C, model.Z_joint))
+
+        while True:
+            kind, values, arrays = transport.recv()
+            if kind == 'stop':
+                break
+            elif kind == 'sweep':
+                unpackParameters(model, values, arrays)
+                m = max(1, int(round(values['fraction'] * n)))
+                subset = np.arange(n) if m == n else np.sort(generator.choice(n, m, replace=False))
+                transport.send('stats', arrays=model.drawChunk(subset, model.workspace, generator))
+            elif kind == 'record':
+                typeProbSum += model.typeProbs
+            elif kind == 'collect':
+                transport.send('state', arrays={'C': model.C, 'Z': model.Z_joint,
+                                                'typeProbSum': typeProbSum})
+            else:
+                raise ValueError('unknown message kind: {}'.format(kind))
+
+    except Exception as e:
+        transport.send('error', {'message': repr(e)})
+
+    finally:
+        transport.close()
+
+
+def serveWorker(port, host=''):
+    '''
+    Run a worker on this node: listen on (host, port), serve one coordinator, then return
+    '''
+    with socket.create_server((host, port)) as server:
+        conn, _ = server.accept()
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    runWorker(SocketTransport(conn))
+
+
+def _localSocketWorker(ports):
+    '''
+    Local stand-in for a worker node: listen on a free port (reported through "ports")
+    '''
+    with socket.create_server(('127.0.0.1', 0)) as server:
+        ports.put(server.getsockname()[1])
+        conn, _ = server.accept()
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    runWorker(SocketTransport(conn))
+
+
+def _localPipeWorker(conn):
+    runWorker(PipeTransport(conn))
+
+
+def startLocalWorkers(nWorkers, kind='socket'):
+    '''
+    Start nWorkers worker processes on this machine, standing in for remote nodes;
+    kind: 'socket' (TCP on localhost, as with real nodes) or 'pipe'
+    Returns the transports to them (for DistributedDPGMM) and the processes
+    '''
+    ctx = mp.get_context()
+    transports, processes = [], []
+    for r in range(nWorkers):
+        if kind == 'socket':
+            ports = ctx.Queue()
+            p = ctx.Process(target=_localSocketWorker, args=(ports,))
+            p.start()
+            transports.append(SocketTransport.connect('127.0.0.1', ports.get()))
+        else:
+            conn, workerConn = ctx.Pipe()
+            p = ctx.Process(target=_localPipeWorker, args=(workerConn,))
+            p.start()
+            transports.append(PipeTransport(conn))
+        processes.append(p)
+
+    return transports, processes
+
+
+class DistributedDPGMM(LatentPoissonDPGMM2):
+    useScanSampler = True
+
+    def __init__(self, Priors, transports, K=3, Kmax=10, linkThreshold=0.6):
+        '''
+        LatentPoissonDPGMM2 with the type and label draws on worker nodes
+        (the same sampler as mainShard.ShardedDPGMM, but the workers hold their shards,
+        and draw their initial types and labels);
+        LIMITATION: this spreads the work, NOT the data: fit takes the full E, L, D, 
+            and the coordinator must hold them (and the N-length arrays of the 
+            initialization: scores, first mixtures, the shards it sends out), and at 
+            the end it gathers C, Z_joint and typeProbSum of all the pairs again; 
+            so N is bounded by the memory of the coordinator (there is no fit path 
+            where the workers load their own shards)
+        transports: one connected Transport per worker (e.g. SocketTransport.connect to each
+            node, or startLocalWorkers); the pairs are split into that many shards
+        Priors, K, Kmax, linkThreshold: as in LatentPoissonDPGMM2
+        '''
+        super().__init__(Priors, K=K, Kmax=Kmax, linkThreshold=linkThreshold)
+        self.name = "Distributed Latent Poisson Process with Dirichlet Process Gaussian Mixture density"
+        self.Priors = Priors
+        self.transports = transports
+        self.shardBounds = None
+
+    def runRandomScan(self, scanFractions, verbose = True, nThreads = 1):
+        '''
+        The MCMC loop (see LatentPoissonDPGMM2.runRandomScan), with the workers:
+        the workers get their shards and start from a joint draw of the types and labels
+        of their pairs, the coordinator sums their statistics
+        (and drops its per-pair state until the end)
+        '''
+        N = len(self.E)
+        nWorkers = len(self.transports)
+        self.shardBounds = np.linspace(0, N, nWorkers+1).astype(int)
+
+        X = self.workspace.X
+        values, arrays = packParameters(self)
+        seeds = np.random.SeedSequence(rng.integers(2**63)).spawn(nWorkers)
+        for r, transport in enumerate(self.transports):
+            a, b = self.shardBounds[r], self.shardBounds[r+1]
+            transport.send('init',
+                           dict(values, K=self.K, Kmax=self.Kmax, Priors=self.Priors,
+                                seed=[seeds[r].entropy, list(seeds[r].spawn_key)]),
+                           dict(arrays, X=X[a:b], L=self.L[a:b], D=self.D[a:b]))
+        replies = [transport.recv() for transport in self.transports]
+        self.scanStats = {key: sum(arrays[key] for _, _, arrays in replies) 
+                          for key in replies[0][2]}
+        self.scanStats['sumSqL'] = sum(values['sumSqL'] for _, values, _ in replies)
+        self.scanStats['sumSqD'] = sum(values['sumSqD'] for _, values, _ in replies)
+
+        self.C = self.Z_joint = self.typeProbs = None
+        self.workspace.buffers.clear()
+
+        try:
+            self.runScanIterations(scanFractions, verbose)
+
+            # the final state and the Rao-Blackwellized type probabilities
+            for transport in self.transports:
+                transport.send('collect')
+            states = [transport.recv()[2] for transport in self.transports]
+            self.C = np.concatenate([state['C'] for state in states])
+            self.Z_joint = np.concatenate([state['Z'] for state in states])
+            self.typeProbSum = np.concatenate([state['typeProbSum'] for state in states])
+            # (the grouped indices of the final state)
+            LatentPoissonDPGMM2.groupPairs(self)
+        finally:
+            # (one at a time: a worker that is gone must not keep the others open,
+            # nor hide the error that ended the run)
+            for transport in self.transports:
+                try:
+                    transport.send('stop')
+                except (OSError, ValueError):
+                    pass
+                try:
+                    transport.close()
+                except OSError:
+                    pass
+
+        return
+
+    def sweepTypesAndLabels(self, fraction):
+        '''
+        Send the global parameters to all the workers, and sum the changes of the
+        sufficient statistics they send back (see LatentPoissonDPGMM2.sweepTypesAndLabels)
+        '''
+        values, arrays = packParameters(self)
+        values['fraction'] = fraction
+        for transport in self.transports:
+            transport.send('sweep', values, arrays)
+
+        changes = [transport.recv()[2] for transport in self.transports]
+
+        return {key: sum(change[key] for change in changes) for key in changes[0]}
+
+    def groupPairs(self):
+        '''
+        (the coordinator holds no per-pair state during the run; see recordChains;
+        runRandomScan groups the final state)
+        '''
+        return
+
+    def recordChains(self):
+        '''
+        Append the current values of the recorded parameters to the chains
+        (all but C; N_MF, N_FM from the type counts, logLikGivenZ from evalScanLikelihood)
+        '''
+        for transport in self.transports:
+            transport.send('record')
+
+        counts = self.scanStats['typeCounts']
+
+        self.chains['muL'].append(self.muL)
+        self.chains['muD'].append(self.muD)
+        self.chains['muNegD'].append(self.muNegD)
+        self.chains['gammaL'].append(self.gammaL)
+        self.chains['gammaD'].append(self.gammaD)
+        self.chains['N_MF'].append(counts[2])
+        self.chains['N_FM'].append(counts[3])
+        self.chains['gammaMF'].append(self.gammaMF)
+        self.chains['gammaFM'].append(self.gammaFM)
+        self.chains['etaMF'].append(self.etaMF)
+        self.chains['etaFM'].append(self.etaFM)
+        self.chains['componentsMF'].append(self.componentsMF.copy())
+        self.chains['componentsFM'].append(self.componentsFM.copy())
+        self.chains['weightMF'].append(self.weightMF)
+        self.chains['weightFM'].append(self.weightFM)
+        self.chains['alpha_MF'].append(self.alpha_MF)
+        self.chains['alpha_FM'].append(self.alpha_FM)
+        self.chains['logLikGivenZ'].append(self.evalScanLikelihood())
+
+        # (the workers add their type probabilities)
+        self.accumulateDensities()
+
+        return
+
+
+#%%
+if __name__ == '__main__':
+
+    if len(sys.argv) > 2 and sys.argv[1] == 'worker':
+        serveWorker(int(sys.argv[2]))
+        sys.exit()
+
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    from main2_DPGMM import SettingsV3
+    from utils2_DPGMM import simulateLatentPoissonGMM2
+
+    Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
+          "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
+          "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
+          "alpha": {'a': 2.0, 'b':3.0},
+          "gammaPP": {'n0': 1, 'b0': 0.02},
+          "eta": {'a': 1, 'b': 1}}
+
+    E, L, D = simulateLatentPoissonGMM2(SettingsV3)
+
+    # local processes standing in for the worker nodes
+    transports, workers = startLocalWorkers(3, kind='socket')
+
+    model = DistributedDPGMM(Priors = Pr, transports = transports, K=3, Kmax=10)
+    model.fit(E, L, D, samples=500, burn=100, verbose=False)
+
+    for w in workers:
+        w.join()
+
+    print(np.mean(model.chains['N_MF']), np.mean(model.chains['N_FM']))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:40:12 2026
+
+@author: fan
+"""
+
+# This file:
+# parallel tempering (replica exchange) for the MH model (LatentPoissonGMM in main.py)
+# each tempered replica runs in its own worker process;
+# states are exchanged through shared arrays (see LatentPoissonGMM.getState/setState);
+# during burn-in the spacing of the temperature ladder is adapted (see adaptLadder)
+
+#%%
+import multiprocessing as mp
+from threading import BrokenBarrierError
+
+import numpy as np
+
+from main import LatentPoissonGMM
+
+
+def _replicaWorker(r, Priors, K, E, L, D, fitArgs, swapEvery, sharedTemperatures,
+                   sharedC, sharedTheta, sharedLogLik, sharedSource, barrier, results):
+    '''
+    Run replica r (at inverse temperature sharedTemperatures[r]) in a worker process;
+    every swapEvery iterations:
+        1) write the state, and its tempered log-likelihood at its own and the 
+            neighbouring temperatures (see LatentPoissonGMM.evalTargetLikelihood), 
+            to row r of the shared arrays
+        2) (the coordinator decides on the swaps, and may move the temperatures)
+        3) take the state from row sharedSource[r], and the (new) temperature
+    At the end, the cold replica (r = 0) puts its chains (and acceptance counts) in "results"
+    '''
+    try:
+        N = len(E)
+        stateC = np.frombuffer(sharedC, dtype=np.int8).reshape((-1,N))
+        stateTheta = np.frombuffer(sharedTheta).reshape((stateC.shape[0],-1))
+        temperatures = np.frombuffer(sharedTemperatures)
+        R = len(temperatures)
+        logLik = np.frombuffer(sharedLogLik).reshape((R,R))
+        source = np.frombuffer(sharedSource, dtype=np.int32)
+
+        def exchange(model, it):
+            if (it+1) % swapEvery != 0:
+                return
+            C, theta = model.getState()
+            stateC[r,:] = C; stateTheta[r,:] = theta
+            for j in range(max(r-1, 0), min(r+2, R)):
+                logLik[r,j] = model.evalTargetLikelihood(temperatures[j])
+            barrier.wait()
+            # ... coordinator decides ...
+            barrier.wait()
+            if source[r] != r:
+                model.setState(stateC[source[r]].copy(), stateTheta[source[r]].copy())
+            model.temperature = temperatures[r]
+            # (everyone has read before anyone writes again)
+            barrier.wait()
+
+        model = LatentPoissonGMM(Priors = Priors, K = K)
+        model.fit(E, L, D, temperature=temperatures[r], iterationHook=exchange, **fitArgs)
+
+        if r == 0:
+            results.put((r, model.chains, model.accept))
+        else:
+            results.put((r, None, model.accept))
+
+    except Exception as e:
+        barrier.abort()
+        results.put((r, e, None))
+
+
+class ParallelTemperingGMM:
+    def __init__(self, Priors, K=3, temperatures=None, nReplicas=4, minTemperature=0.1):
+        '''
+        Parallel tempering for the LatentPoissonGMM model;
+        Priors, K: as in LatentPoissonGMM
+        temperatures: inverse temperatures of the replicas (decreasing, starting at 1);
+            if None, a geometric ladder of nReplicas values from 1 down to minTemperature
+            (the hottest replica has to be hot enough to cross between the modes;
+            by default the ladder is adapted during burn-in, see fit and adaptLadder;
+            check swapRates after fitting)
+        minTemperature: also the lower bound for the adapted ladder
+        '''
+        self.name = "Parallel tempering for Latent Poisson Process with Gaussian Mixture density"
+        self.Priors = Priors
+        self.K = K
+        if temperatures is None:
+            temperatures = minTemperature ** (np.arange(nReplicas)/max(nReplicas-1, 1))
+        self.temperatures = np.asarray(temperatures, dtype=float)
+        self.minTemperature = min(minTemperature, self.temperatures[-1])
+        # results
+        self.chains = None # chains of the cold (temperature = 1) replica
+        self.accept = None # MH acceptance counts of each replica
+        self.swapAttempts = None # number of proposed swaps between replica r and r+1
+        self.swapAccepts = None # number of accepted swaps between replica r and r+1
+        self.swapRates = None # swapAccepts/swapAttempts
+        # ladder adaptation (see adaptLadder): 
+        # log of the gaps between the log temperatures, and running swap probability estimates
+        self.ladderLogGaps = None
+        self.swapProbs = None
+
+    def fit(self, E, L, D, samples = 1000, burn = 0, thin = 1, swapEvery = 10,
+            random_seed = 42, verbose = True, adapt = True, **fitArgs):
+        '''
+        Run all replicas, with swap proposals between neighbouring temperatures
+        every swapEvery iterations (alternating even and odd neighbour pairs);
+        adapt: if True, move the temperatures during burn-in so that each neighbour pair 
+            has about the target swap acceptance (see adaptLadder); the cold one (1) stays, 
+            and the ladder is fixed after burn-in (self.temperatures has the final one)
+        fitArgs: other arguments for LatentPoissonGMM.fit (e.g. batched, batch_size)
+        '''
+        R = len(self.temperatures)
+        N = len(E)
+        maxIter = samples * thin + burn
+
+        # the size of the parameter vector
+        P = 7 + 2*self.K + 2*self.K*6
+
+        ctx = mp.get_context()
+        sharedTemperatures = ctx.RawArray('d', R)
+        temperatures = np.frombuffer(sharedTemperatures)
+        temperatures[:] = self.temperatures
+        sharedC = ctx.RawArray('b', R*N)
+        sharedTheta = ctx.RawArray('d', R*P)
+        # (row r: tempered log-likelihoods of replica r's state at each temperature)
+        sharedLogLik = ctx.RawArray('d', R*R)
+        sharedSource = ctx.RawArray('i', R)
+        source = np.frombuffer(sharedSource, dtype=np.int32)
+        logLik = np.frombuffer(sharedLogLik).reshape((R,R))
+        barrier = ctx.Barrier(R+1)
+        results = ctx.Queue()
+
+        workers = []
+        for r in range(R):
+            args = dict(fitArgs, samples=samples, burn=burn, thin=thin,
+                        random_seed=random_seed+r, verbose=False)
+            w = ctx.Process(target=_replicaWorker,
+                            args=(r, self.Priors, self.K, E, L, D, args, swapEvery,
+                                  sharedTemperatures, sharedC, sharedTheta, sharedLogLik,
+                                  sharedSource, barrier, results))
+            w.start()
+            workers.append(w)
+
+        rng = np.random.default_rng(random_seed)
+        self.swapAttempts = np.zeros(R-1, dtype=int)
+        self.swapAccepts = np.zeros(R-1, dtype=int)
+        self.ladderLogGaps = np.log(np.diff(-np.log(self.temperatures)))
+        self.swapProbs = np.zeros(R-1)
+
+        # coordinate the exchanges
+        try:
+            for rnd in range(maxIter // swapEvery):
+                barrier.wait()
+
+                source[:] = np.arange(R)
+                # (the tempered targets are not linear in the temperature, 
+                # so all four values are needed; the prior cancels out)
+                logAlpha = np.array([logLik[i+1,i] + logLik[i,i+1] - logLik[i,i] - logLik[i+1,i+1] 
+                                     for i in range(R-1)])
+                for i in range(rnd % 2, R-1, 2):
+                    self.swapAttempts[i] += 1
+                    if np.log(rng.random()) < logAlpha[i]:
+                        self.swapAccepts[i] += 1
+                        source[i], source[i+1] = i+1, i
+                
+                if adapt and R > 1 and (rnd+1) * swapEvery <= burn:
+                    temperatures[:] = self.adaptLadder(rnd, logAlpha)
+
+                barrier.wait()
+                barrier.wait()
+
+                if verbose and (rnd+1) % 10 == 0:
+                    print('Swap round {}: swap rates {}'.format(rnd+1,
+                          np.round(self.swapAccepts/np.maximum(self.swapAttempts, 1), 3)))
+        except BrokenBarrierError:
+            pass
+
+        # collect the results
+        self.accept = [None] * R
+        errors = []
+        for r in range(R):
+            rr, chains, accept = results.get()
+            if isinstance(chains, Exception):
+                errors.append((rr, chains))
+                continue
+            self.accept[rr] = accept
+            if rr == 0:
+                self.chains = chains
+
+        for w in workers:
+            w.join()
+
+        if errors:
+            raise RuntimeError('Replica {} failed: {!r}'.format(*errors[0]))
+
+        self.swapRates = self.swapAccepts / np.maximum(self.swapAttempts, 1)
+        self.temperatures = temperatures.copy()
+
+        if verbose:
+            print('Temperatures: {}'.format(np.round(self.temperatures, 3)))
+            print('Swap rates between neighbouring temperatures: {}'.format(self.swapRates))
+
+        return
+
+    def adaptLadder(self, rnd, logAlpha, targetRate=0.25, rate=1.0):
+        '''
+        Stochastic approximation update of the temperature ladder after swap round rnd 
+        (ONLY during burn-in, so that the chains afterwards use a fixed ladder):
+        the log temperatures step down from 0 (cold) by exp(ladderLogGaps); 
+        a gap grows if the swap acceptance probability of its pair is above targetRate, 
+        and shrinks if below (the ladder stops at minTemperature)
+        logAlpha: log swap acceptance ratio of each neighbour pair in this round 
+            (all of them, also the ones that were not proposed)
+        rate: step size multiplier (the step sizes decay as 1/(rnd+1)^0.6)
+        Returns the new (decreasing) inverse temperatures
+        '''
+        gain = 1/(rnd+1)**0.6
+        probs = np.exp(np.minimum(logAlpha, 0))
+        self.swapProbs += gain * (probs - self.swapProbs)
+        
+        self.ladderLogGaps += rate * gain * (probs - targetRate)
+        temperatures = np.exp(-np.concatenate([[0], np.cumsum(np.exp(self.ladderLogGaps))]))
+        
+        return np.maximum(temperatures, self.minTemperature)
+
+
+#%%
+if __name__ == '__main__':
+
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    from main2_DPGMM import SettingsV1
+    from utils2_DPGMM import simulateLatentPoissonGMM2
+
+    Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
+          "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
+          "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
+          "weight": np.ones(3),
+          "gammaPP": {'n0': 1, 'b0': 0.02}}
+
+    # V1: MF and FM surfaces are essentially the same (the hard case)
+    E, L, D = simulateLatentPoissonGMM2(SettingsV1)
+
+    model = ParallelTemperingGMM(Priors = Pr, K=3, nReplicas=4)
+    # (the ladder is adapted during burn-in: 100 swap rounds)
+    model.fit(E, L, D, samples=500, burn=500, swapEvery=5, batched=True, batch_size=100)
+
+    print(np.mean(model.chains['N_MF']), np.mean(model.chains['N_FM']))
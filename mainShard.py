@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:05:41 2026
+
+@author: fan
+"""
+
+# This file:
+# data-parallel version of the DP GMM model (LatentPoissonDPGMM2 in main2_DPGMM.py)
+# for very large N: the pairs are split into shards, one worker process per shard;
+# the data and the allocations live in shared memory, each worker draws the types and
+# labels of its shard and only sends back sufficient statistics,
+# the coordinator (this process) does all the global updates
+
+#%%
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from main2_DPGMM import LatentPoissonDPGMM2
+from utils2_DPGMM import DPGMMWorkspace, GaussianComponents, getPoints, rng, default_rng
+
+
+# the shared arrays: name -> (row shape, dtype)
+SharedSpecs = {'X': ((2,), float), 'L': ((), float), 'D': ((), float),
+               'C': ((), np.intp), 'Z': ((), np.intp), 'typeProbs': ((4,), float)}
+
+# seconds between checks that a shard process is still alive while waiting for its reply,
+# and to wait for a shard process to exit at the end (before it is terminated)
+PollInterval = 1.0
+JoinTimeout = 10.0
+
+
+def _attachShared(names, N):
+    '''
+    Attach to the shared memory blocks (names: array name -> block name);
+    Returns the blocks and the (N, ...) arrays on them
+    '''
+    blocks = {key: shared_memory.SharedMemory(name=name) for key, name in names.items()}
+    arrays = {key: np.ndarray((N,) + SharedSpecs[key][0], dtype=SharedSpecs[key][1],
+                              buffer=blocks[key].buf)
+              for key in names}
+    return blocks, arrays
+
+
+def _shardWorker(r, start, stop, names, N, Priors, K, Kmax, seed, conn):
+    '''
+    Worker process for the pairs start,...,stop-1 (shard r);
+    every iteration:
+        1) receive (fraction, global parameters) from the coordinator (None to stop)
+        2) draw the types and labels of a random subset (fraction) of the shard,
+            written into the shared C, Z and typeProbs arrays
+        3) send back the changes of the sufficient statistics (see LatentPoissonDPGMM2.getScanStats)
+    '''
+    blocks = dict()
+    try:
+        blocks, arrays = _attachShared(names, N)
+
+        # a model that only holds this shard
+        model = ShardedDPGMM(Priors, K=K, Kmax=Kmax, nShards=1)
+        model.L = arrays['L'][start:stop]
+        model.D = arrays['D'][start:stop]
+        model.workspace = DPGMMWorkspace(arrays['X'][start:stop], Kmax)
+        model.C = arrays['C'][start:stop]
+        model.Z_joint = arrays['Z'][start:stop]
+        model.typeProbs = arrays['typeProbs'][start:stop]
+
+        generator = default_rng(seed)
+        n = stop - start
+
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            fraction, params = message
+            model.setSweepParameters(params)
+
+            m = max(1, int(round(fraction * n)))
+            subset = np.arange(n) if m == n else np.sort(generator.choice(n, m, replace=False))
+            conn.send(model.drawChunk(subset, model.workspace, generator))
+
+    except Exception as e:
+        conn.send(e)
+
+    finally:
+        # (drop the views before closing the blocks)
+        model = arrays = None
+        for block in blocks.values():
+            block.close()
+
+
+class ShardedDPGMM(LatentPoissonDPGMM2):
+    useScanSampler = True
+
+    def __init__(self, Priors, K=3, Kmax=10, nShards=4, linkThreshold=0.6):
+        '''
+        Data-parallel LatentPoissonDPGMM2: the same model and sampler as
+        LatentPoissonDPGMM2.fit with scanFraction/nThreads (the sufficient statistics sampler),
+        but the type and label draws run in nShards worker processes, on shards of the pairs;
+        Priors, K, Kmax, linkThreshold: as in LatentPoissonDPGMM2
+        '''
+        super().__init__(Priors, K=K, Kmax=Kmax, linkThreshold=linkThreshold)
+        self.name = "Data-parallel Latent Poisson Process with Dirichlet Process Gaussian Mixture density"
+        self.Priors = Priors
+        self.nShards = nShards
+        # shards (set up in "fit"): boundaries, worker processes, their connections,
+        # and the shared memory blocks
+        self.shardBounds = None
+        self.workers = None
+        self.connections = None
+        self.sharedBlocks = None
+
+    def fit(self, E, L, D, samples = 1000, burn = 0, thin = 1, random_seed = 42,
+            verbose = True, scanFraction = 1.0, **fitArgs):
+        '''
+        Fit the model via MCMC, with the type and label draws on the shards
+        scanFraction: fraction of the pairs (of each shard) updated per iteration, see LatentPoissonDPGMM2.fit
+        fitArgs: other arguments for LatentPoissonDPGMM2.fit
+        '''
+        return super().fit(E, L, D, samples=samples, burn=burn, thin=thin,
+                           random_seed=random_seed, verbose=verbose,
+                           scanFraction=scanFraction, **fitArgs)
+
+    def runRandomScan(self, scanFractions, verbose = True, nThreads = 1):
+        '''
+        The MCMC loop (see LatentPoissonDPGMM2.runRandomScan), with the shard workers:
+        the initial state is drawn here, then put into shared memory together with the data
+        '''
+        # start from a joint draw of the types and labels of all the pairs
+        self.updateTypeAndComponentIndicators()
+        self.initScanStats()
+
+        N = len(self.E)
+        self.shardBounds = np.linspace(0, N, self.nShards+1).astype(int)
+
+        # shared memory: the data, and the state (C, Z_joint, typeProbs) of all the pairs
+        self.sharedBlocks = dict()
+        arrays = dict()
+        for key, (shape, dtype) in SharedSpecs.items():
+            size = max(N * int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            self.sharedBlocks[key] = shared_memory.SharedMemory(create=True, size=size)
+            arrays[key] = np.ndarray((N,) + shape, dtype=dtype, buffer=self.sharedBlocks[key].buf)
+        arrays['X'][:] = getPoints(self.E)
+        arrays['L'][:] = self.L
+        arrays['D'][:] = self.D
+        arrays['C'][:] = self.C
+        arrays['Z'][:] = self.Z_joint
+        arrays['typeProbs'][:] = self.typeProbs
+        self.C, self.Z_joint, self.typeProbs = arrays['C'], arrays['Z'], arrays['typeProbs']
+
+        names = {key: block.name for key, block in self.sharedBlocks.items()}
+        seeds = np.random.SeedSequence(rng.integers(2**63)).spawn(self.nShards)
+
+        ctx = mp.get_context()
+        self.workers = []
+        self.connections = []
+        for r in range(self.nShards):
+            conn, workerConn = ctx.Pipe()
+            w = ctx.Process(target=_shardWorker,
+                            args=(r, self.shardBounds[r], self.shardBounds[r+1], names, N,
+                                  self.Priors, self.K, self.Kmax, seeds[r], workerConn))
+            w.start()
+            self.workers.append(w)
+            self.connections.append(conn)
+
+        try:
+            self.runScanIterations(scanFractions, verbose)
+        finally:
+            # (a shard process may be gone already: don't let the shutdown hide the error)
+            for conn in self.connections:
+                try:
+                    conn.send(None)
+                except (OSError, ValueError):
+                    pass
+            for w in self.workers:
+                w.join(JoinTimeout)
+                if w.is_alive():
+                    w.terminate()
+                    w.join()
+            for conn in self.connections:
+                conn.close()
+            # (keep private copies of the state, the shared memory goes away)
+            self.C, self.Z_joint, self.typeProbs = self.C.copy(), self.Z_joint.copy(), self.typeProbs.copy()
+            arrays = None
+            for block in self.sharedBlocks.values():
+                block.close()
+                block.unlink()
+            self.sharedBlocks = None
+
+        return
+
+    def sweepTypesAndLabels(self, fraction):
+        '''
+        Send the global parameters to all the shards, and sum the changes of the
+        sufficient statistics they send back (see LatentPoissonDPGMM2.sweepTypesAndLabels)
+        '''
+        params = self.getSweepParameters()
+        for conn in self.connections:
+            conn.send((fraction, params))
+
+        changes = [self.receive(r) for r in range(self.nShards)]
+
+        return {key: sum(change[key] for change in changes) for key in changes[0]}
+
+    def receive(self, r):
+        '''
+        Wait for the reply of shard r; raises RuntimeError if the shard failed, 
+        or if its process is gone (e.g. killed by a signal or out of memory)
+        instead of blocking forever
+        '''
+        conn, w = self.connections[r], self.workers[r]
+        try:
+            while not conn.poll(PollInterval):
+                if not w.is_alive():
+                    raise RuntimeError('Shard {} died (exit code {})'.format(r, w.exitcode))
+            reply = conn.recv()
+        except (EOFError, OSError):
+            w.join(PollInterval)
+            raise RuntimeError('Shard {} died (exit code {})'.format(r, w.exitcode))
+
+        if isinstance(reply, Exception):
+            raise RuntimeError('Shard {} failed: {!r}'.format(r, reply))
+
+        return reply
+
+    def getSweepParameters(self):
+        '''
+        The global parameters that the type and label draws depend on (a dictionary)
+        '''
+        return {'muL': self.muL, 'gammaL': self.gammaL,
+                'muD': self.muD, 'muNegD': self.muNegD, 'gammaD': self.gammaD,
+                'gammaMF': self.gammaMF, 'gammaFM': self.gammaFM,
+                'etaMF': self.etaMF, 'etaFM': self.etaFM,
+                'weightMF': self.weightMF, 'weightFM': self.weightFM,
+                'componentsMF': (self.componentsMF.means, self.componentsMF.precisions),
+                'componentsFM': (self.componentsFM.means, self.componentsFM.precisions)}
+
+    def setSweepParameters(self, params):
+        '''
+        Set the global parameters from getSweepParameters (in a worker)
+        '''
+        for key, value in params.items():
+            if key.startswith('components'):
+                value = GaussianComponents(*value)
+            setattr(self, key, value)
+
+        return
+
+
+#%%
+if __name__ == '__main__':
+
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    from main2_DPGMM import SettingsV3
+    from utils2_DPGMM import simulateLatentPoissonGMM2
+
+    Pr = {"gammaScore": {'nu0': 2, 'sigma0': 1},
+          "muGMM": {'mean': np.array([0,0]), 'precision': np.eye(2)*.0001},
+          "precisionGMM": {'df': 2, 'invScale': np.eye(2)},
+          "alpha": {'a': 2.0, 'b':3.0},
+          "gammaPP": {'n0': 1, 'b0': 0.02},
+          "eta": {'a': 1, 'b': 1}}
+
+    E, L, D = simulateLatentPoissonGMM2(SettingsV3)
+
+    model = ShardedDPGMM(Priors = Pr, K=3, Kmax=10, nShards=4)
+    model.fit(E, L, D, samples=500, burn=100, verbose=False)
+
+    print(np.mean(model.chains['N_MF']), np.mean(model.chains['N_FM']))
@@ -0,0 +1,5 @@
+# the modules are flat scripts at the top level of the repository
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
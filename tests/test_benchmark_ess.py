@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from benchmark_ess import effectiveSampleSize
+
+
+def ar1(phi, n, seed=0):
+    rng = np.random.default_rng(seed)
+    e = rng.standard_normal(n)
+    x = np.empty(n)
+    x[0] = e[0] / np.sqrt(1 - phi**2)
+    for t in range(1, n):
+        x[t] = phi*x[t-1] + e[t]
+    return x
+
+
+@pytest.mark.parametrize('phi', [0.0, 0.5, 0.9])
+def test_effectiveSampleSize_ar1(phi):
+    # integrated autocorrelation time of AR(1): (1 + phi)/(1 - phi)
+    n = 100000
+    ess = effectiveSampleSize(ar1(phi, n))
+    assert ess == pytest.approx(n*(1 - phi)/(1 + phi), rel=0.1)
+
+
+def test_effectiveSampleSize_degenerate():
+    assert np.isnan(effectiveSampleSize(np.ones(100)))
+    assert np.isnan(effectiveSampleSize([1.0, 2.0, 3.0]))
+    assert np.isnan(effectiveSampleSize([]))
@@ -0,0 +1,47 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from benchmark_ess import getPriors
+from main2_DPGMM import LatentPoissonDPGMM2, SettingsV3
+from utils2_DPGMM import simulateLatentPoissonGMM2
+
+
+@pytest.fixture(scope='module')
+def data():
+    np.random.seed(3)
+    return simulateLatentPoissonGMM2(SettingsV3)
+
+
+def fit(data, **fitArgs):
+    model = LatentPoissonDPGMM2(getPriors(), K=3, Kmax=10)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        model.fit(*data, samples=20, burn=5, random_seed=5, verbose=False, **fitArgs)
+    return model
+
+
+def test_epsilon_pruning(data):
+    # Kmax = 10 components for a few clusters: the empty ones have tiny weights
+    assert fit(data).densityErrorBound == 0.0
+    assert 0 < fit(data, epsilon=1e-3).densityErrorBound < 1e-2
+
+
+def test_threaded_fit_reproducible(data):
+    # (each chunk has its own random substream: the scheduling does not change the draws)
+    a, b = fit(data, nThreads=2), fit(data, nThreads=2)
+    assert np.array_equal(a.chains['N_MF'], b.chains['N_MF'])
+    assert np.allclose(a.chains['logLik'], b.chains['logLik'])
+
+
+def test_joint_update(data):
+    model = fit(data, jointUpdate=True)
+    assert len(model.chains['logLik']) == 20
+    assert np.all(np.isfinite(model.chains['logLik']))
+    assert model.chains['N_MF'][-1] == np.sum(model.C == 2)
+
+
+def test_scan_records_logLikGivenZ(data):
+    model = fit(data, scanFraction=0.5)
+    assert len(model.chains['logLikGivenZ']) == 20 and len(model.chains['logLik']) == 0
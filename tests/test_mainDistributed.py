@@ -0,0 +1,61 @@
+import multiprocessing as mp
+
+import numpy as np
+import pytest
+
+from mainDistributed import encodeMessage, decodeMessage, PipeTransport
+
+
+def checkRoundTrip(kind, values, arrays):
+    gotKind, gotValues, gotArrays = decodeMessage(encodeMessage(kind, values, arrays))
+
+    assert gotKind == kind
+    assert list(gotArrays) == list(arrays)
+    for name, a in arrays.items():
+        assert gotArrays[name].dtype == a.dtype
+        assert gotArrays[name].shape == a.shape
+        assert np.array_equal(gotArrays[name], a)
+    return gotValues
+
+
+def test_message_round_trip():
+    arrays = {'X': np.random.default_rng(0).standard_normal((7, 2)),
+              'C': np.arange(7, dtype=np.intp) % 4,
+              'Z': np.array([3, 1, 2], dtype=np.int8),
+              'precisions': np.tile(np.eye(2), (3, 1, 1)),
+              'empty': np.zeros((0, 2)),
+              # (not C-contiguous)
+              'strided': np.arange(20.0).reshape((4, 5))[:, ::2]}
+    values = {'fraction': 0.25, 'K': np.int64(3), 'alpha': np.float64(1.5),
+              'Priors': {'eta': {'a': 1, 'b': 1}, 'muGMM': {'mean': np.array([0.0, 1.0])}},
+              'seed': [12345, [0, 1]]}
+
+    got = checkRoundTrip('sweep', values, arrays)
+    assert got == {'fraction': 0.25, 'K': 3, 'alpha': 1.5,
+                   'Priors': {'eta': {'a': 1, 'b': 1}, 'muGMM': {'mean': [0.0, 1.0]}},
+                   'seed': [12345, [0, 1]]}
+
+
+def test_message_without_payload():
+    assert checkRoundTrip('stop', None, dict()) == dict()
+
+
+def test_frame_length():
+    frame = encodeMessage('stats', arrays={'a': np.zeros(10)})
+    assert int.from_bytes(frame[:8], 'big') == len(frame) - 8
+
+
+def test_transport_error_reply():
+    a, b = mp.Pipe()
+    coordinator, worker = PipeTransport(a), PipeTransport(b)
+
+    worker.send('state', {'n': 2}, {'C': np.array([1, 2])})
+    kind, values, arrays = coordinator.recv()
+    assert kind == 'state' and values == {'n': 2} and np.array_equal(arrays['C'], [1, 2])
+
+    worker.send('error', {'message': 'boom'})
+    with pytest.raises(RuntimeError, match='boom'):
+        coordinator.recv()
+
+    coordinator.close()
+    worker.close()
@@ -0,0 +1,39 @@
+import numpy as np
+
+from benchmark_ess import getPriors
+from mainPT import ParallelTemperingGMM
+
+
+def adapt(model, swapProb, rounds=200):
+    R = len(model.temperatures)
+    model.ladderLogGaps = np.log(np.diff(-np.log(model.temperatures)))
+    model.swapProbs = np.zeros(R-1)
+    for rnd in range(rounds):
+        temperatures = model.adaptLadder(rnd, np.log(np.full(R-1, swapProb)))
+    return temperatures
+
+
+def test_default_ladder():
+    model = ParallelTemperingGMM(getPriors(), nReplicas=4)
+    assert np.allclose(model.temperatures, 0.1 ** (np.arange(4)/3))
+
+
+def test_adaptLadder_spreads_out_when_swaps_are_easy():
+    model = ParallelTemperingGMM(getPriors(), temperatures=[1.0, 0.95, 0.9, 0.85], 
+                                 minTemperature=0.1)
+    temperatures = adapt(model, 0.9)
+
+    assert temperatures[0] == 1.0
+    assert np.all(np.diff(temperatures) <= 0)
+    assert temperatures[-1] < 0.5
+    assert temperatures[-1] >= 0.1
+    assert np.allclose(model.swapProbs, 0.9)
+
+
+def test_adaptLadder_closes_up_when_swaps_are_rare():
+    model = ParallelTemperingGMM(getPriors(), nReplicas=4, minTemperature=0.1)
+    temperatures = adapt(model, 0.01)
+
+    assert temperatures[0] == 1.0
+    assert np.all(np.diff(temperatures) < 0)
+    assert temperatures[-1] > 0.5
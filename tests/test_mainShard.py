@@ -0,0 +1,63 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from benchmark_ess import getPriors
+from main2_DPGMM import LatentPoissonDPGMM2, SettingsV3
+from mainShard import ShardedDPGMM
+from utils2_DPGMM import simulateLatentPoissonGMM2
+
+
+class ScanDPGMM(LatentPoissonDPGMM2):
+    # (the in-process random-scan sampler, also at scanFraction = 1)
+    useScanSampler = True
+
+
+@pytest.fixture(scope='module')
+def data():
+    np.random.seed(3)
+    return simulateLatentPoissonGMM2(SettingsV3)
+
+
+def fit(model, data, **fitArgs):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        model.fit(*data, samples=20, burn=5, random_seed=5, verbose=False, **fitArgs)
+    return model
+
+
+def checkScanStats(model):
+    # the statistics kept up to date from the changed pairs match a fresh pass
+    N = len(model.E)
+    fresh = model.getScanStats(np.arange(N), model.C, model.Z_joint)
+    for key, value in fresh.items():
+        assert np.allclose(model.scanStats[key], value), key
+    assert np.isclose(model.scanStats['sumSqL'], np.dot(model.L, model.L))
+    assert model.scanStats['typeCounts'][2] == model.chains['N_MF'][-1]
+    assert model.scanStats['typeCounts'][3] == model.chains['N_FM'][-1]
+
+
+@pytest.mark.parametrize('nShards', [1, 2])
+def test_sharded_scan_stats(data, nShards):
+    model = fit(ShardedDPGMM(getPriors(), K=3, Kmax=10, nShards=nShards), data)
+
+    assert len(model.chains['logLikGivenZ']) == 20 and len(model.chains['logLik']) == 0
+    assert all(not w.is_alive() for w in model.workers)
+    checkScanStats(model)
+
+
+def test_in_process_scan_stats(data):
+    checkScanStats(fit(ScanDPGMM(getPriors(), K=3, Kmax=10), data))
+
+
+def test_sharded_matches_threads(data):
+    # at scanFraction 1 the shard processes draw the same random numbers as the 
+    # threaded sweep over the same chunks, so the chains are the same
+    threaded = fit(ScanDPGMM(getPriors(), K=3, Kmax=10), data, nThreads=2)
+    sharded = fit(ShardedDPGMM(getPriors(), K=3, Kmax=10, nShards=2), data)
+
+    for param in ['N_MF', 'N_FM', 'muL', 'muD', 'gammaL', 'alpha_MF', 'logLikGivenZ']:
+        assert np.allclose(threaded.chains[param], sharded.chains[param]), param
+    assert np.array_equal(threaded.C, sharded.C)
+    assert np.array_equal(threaded.Z_joint, sharded.Z_joint)
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+from scipy.stats import kstest, truncnorm
+
+import utils
+import utils2_DPGMM
+from utils2_DPGMM import (sampleWishart2, sampleTruncatedNormal, adaptTruncation, 
+                          pruneComponents, evalDensity, getPriorCache, GaussianComponents)
+
+
+
+@pytest.fixture(autouse=True)
+def seeded():
+    # (the samplers draw from the module Generator, as in fit)
+    utils2_DPGMM.rng.bit_generator.state = np.random.default_rng(2026).bit_generator.state
+    np.random.seed(2026)
+
+
+def test_sampleWishart2_moments():
+    df, n = 5.0, 200000
+    S = np.array([[2.0, 0.6], [0.6, 1.0]])
+    W = sampleWishart2(np.full(n, df), np.linalg.cholesky(S))
+
+    assert W.shape == (n, 2, 2)
+    assert np.allclose(W, np.swapaxes(W, 1, 2))
+    # E[W] = df S, Var[W_ij] = df (S_ij^2 + S_ii S_jj)
+    var = df * (S**2 + np.outer(np.diag(S), np.diag(S)))
+    se = np.sqrt(var / n)
+    assert np.all(np.abs(W.mean(axis=0) - df*S) < 5*se)
+    assert np.allclose(W.var(axis=0), var, rtol=0.05)
+
+
+def test_sampleWishart2_per_component():
+    # (one draw per component: each with its own df and scale)
+    df = np.array([3.0, 30.0])
+    scaleChol = np.linalg.cholesky(np.array([np.eye(2), [[1.0, -0.5], [-0.5, 1.0]]]))
+    W = np.array([sampleWishart2(df, scaleChol) for _ in range(20000)])
+
+    assert np.allclose(W[:,0].mean(axis=0), 3*np.eye(2), atol=0.1)
+    assert np.allclose(W[:,1].mean(axis=0), 30*np.array([[1.0, -0.5], [-0.5, 1.0]]), atol=0.5)
+
+
+@pytest.mark.parametrize('sampler', [utils.sampleTruncatedNormal, sampleTruncatedNormal])
+@pytest.mark.parametrize('mean, std, lower, upper', [(0.0, 1.0, -np.inf, np.inf), 
+                                                     (1.0, 2.0, 0.0, np.inf), 
+                                                     (1.0, 2.0, -np.inf, 0.0), 
+                                                     (0.0, 1.0, -0.5, 0.3), 
+                                                     # (far in the tails)
+                                                     (0.0, 1.0, 8.0, np.inf), 
+                                                     (0.0, 1.0, -np.inf, -12.0)])
+def test_sampleTruncatedNormal(sampler, mean, std, lower, upper):
+    x = sampler(mean, std, lower=lower, upper=upper, size=20000, 
+                generator=np.random.default_rng(1))
+
+    assert np.all((x >= lower) & (x <= upper))
+    a, b = (lower - mean)/std, (upper - mean)/std
+    assert kstest(x, truncnorm(a, b, loc=mean, scale=std).cdf).pvalue > 1e-3
+
+
+def test_sampleTruncatedNormal_broadcast():
+    x = sampleTruncatedNormal(np.zeros(3), 1.0, lower=np.array([0.0, 1.0, 2.0]))
+
+    assert x.shape == (3,)
+    assert np.all(x >= [0.0, 1.0, 2.0])
+    assert isinstance(sampleTruncatedNormal(0.0, 1.0, lower=0.0), float)
+
+
+def makeMixture(weight):
+    K = len(weight)
+    means = np.column_stack([np.arange(K)*5.0, np.zeros(K)])
+    precisions = np.array([np.eye(2)*(k+1) for k in range(K)])
+    return np.array(weight), GaussianComponents(means, precisions)
+
+
+def test_pruneComponents_bound():
+    weight, components = makeMixture([0.7, 0.25, 5e-3, 1e-3, 4e-3])
+    kept, keptComponents, bound = pruneComponents(weight, components, 1e-2)
+
+    assert len(kept) == 2 and len(keptComponents) == 2
+    assert bound > 0
+
+    X = np.random.uniform(-5, 25, size=(5000, 2))
+    full = evalDensity(X, weight, components, log=False)
+    pruned = evalDensity(X, kept, keptComponents, log=False)
+    assert np.all(pruned <= full)
+    assert np.all(full - pruned <= bound)
+
+    # (nothing below epsilon: no pruning)
+    assert pruneComponents(weight, components, 1e-4)[2] == 0.0
+
+
+def drawTailSplits(counts, alpha, draws=4000):
+    '''
+    The first stick split of adaptTruncation with a single grow step
+    '''
+    Pr = {'mean': np.zeros(2), 'precision': np.eye(2)*1e-4}
+    priorCache = getPriorCache(Pr, {'df': 2, 'invScale': np.eye(2)})
+    weight, components = makeMixture([0.5, 0.5])
+    v = np.empty(draws)
+    for i in range(draws):
+        W, grown = adaptTruncation(weight, components, np.array(counts), alpha, priorCache, 
+                                   tailTol=1e-3, maxKmax=3)
+        assert len(W) == 3 and len(grown) == 3
+        assert np.isclose(W.sum(), 1)
+        v[i] = W[1] / 0.5
+    return v
+
+
+def test_adaptTruncation_grow_split():
+    # the stick-breaking posterior of the last component: Beta(1 + n_K, alpha) ...
+    v = drawTailSplits([10, 50], alpha=2.0)
+    assert abs(v.mean() - 51/53) < 5*np.sqrt(51*2/(53**2*54)/len(v))
+    # ... and Beta(1, alpha) behind an empty one
+    v = drawTailSplits([10, 0], alpha=2.0)
+    assert abs(v.mean() - 1/3) < 5*np.sqrt(2/(9*4)/len(v))
+
+
+def test_adaptTruncation_shrink():
+    Pr = {'mean': np.zeros(2), 'precision': np.eye(2)*1e-4}
+    priorCache = getPriorCache(Pr, {'df': 2, 'invScale': np.eye(2)})
+    weight, components = makeMixture([0.6, 0.3999, 5e-5, 3e-5, 2e-5])
+
+    W, shrunk = adaptTruncation(weight, components, np.array([30, 20, 0, 0, 0]), 1.0, priorCache)
+    assert len(W) == 3 and len(shrunk) == 3
+    assert np.isclose(W.sum(), 1)
@@ -9,7 +9,7 @@ Created on Tue May  5 22:17:49 2020
 import numpy as np
 from numpy.linalg import inv
 from numpy.random import choice
-from scipy.special import logit, expit
+from scipy.special import logit, expit, gammaln, log_ndtr, ndtri_exp
 from scipy.stats import multivariate_normal, norm, truncnorm
 from scipy.stats import wishart#, invwishart
 from scipy.stats import dirichlet
@@ -22,6 +22,45 @@ from copy import copy
 
 # 1-d Gaussian stuff (score model)
 
+def normLogpdf(x, mu, gamma):
+    '''
+    log-density of N(mu, 1/gamma) at x (same as norm(mu, 1/sqrt(gamma)).logpdf, without the overhead)
+    '''
+    return -0.5*np.log(2*np.pi) + 0.5*np.log(gamma) - 0.5*gamma*(np.asarray(x) - mu)**2
+
+def sampleTruncatedNormal(mean, std, lower=-np.inf, upper=np.inf, size=None, generator=None):
+    '''
+    Draw from N(mean, std^2) truncated to [lower, upper] by the inverse CDF in log scale
+    (stays accurate far into the tails; no scipy distribution objects);
+    all of mean, std, lower, upper can be arrays (e.g. one entry per chain), they are broadcast
+    generator: Generator (or RandomState) to draw the uniforms from; if None, the global numpy random state (seeded in "fit")
+    
+    returns a float (or an array of the broadcast shape / size)
+    '''
+    generator = np.random if generator is None else generator
+    
+    a = (np.asarray(lower, dtype=float) - mean)/std
+    b = (np.asarray(upper, dtype=float) - mean)/std
+    a, b = np.broadcast_arrays(a, b)
+    
+    # work in the lower tail: if the whole interval is above 0, flip it
+    flip = a > 0
+    a, b = np.where(flip, -b, a), np.where(flip, -a, b)
+    
+    # log CDF at a uniform point between the CDF values at a and b
+    logPa = log_ndtr(a); logPb = log_ndtr(b)
+    # (uniform on (0,1], so that the log below is finite)
+    u = 1 - generator.uniform(size=a.shape if size is None else size)
+    with np.errstate(divide='ignore'):
+        logP = logPb + np.log(u + (1-u) * np.exp(logPa - logPb))
+    
+    z = ndtri_exp(logP)
+    z = np.where(flip, -z, z)
+    
+    res = z * std + mean
+    
+    return res if np.ndim(res) > 0 else float(res)
+
 ## linked score
 
 def initializeLinkedScore(L, initThres = 0.6):
@@ -48,7 +87,7 @@ def initializeLinkedScore(L, initThres = 0.6):
     return L, inds, muL, gammaL
 
 
-def updateLModel(L, E_MF, E_FM, muL, gammaL, gammaPrior):
+def updateLModel(L, E_MF, E_FM, muL, gammaL, gammaPrior, temperature=1):
     '''
     Update linked score model (muL and gammaL) given the point configurations
     Returns muL and gammaL
@@ -56,22 +95,24 @@ def updateLModel(L, E_MF, E_FM, muL, gammaL, gammaPrior):
     E_MF: dictionary of (a_M, a_F) points in the MF process, key is pair index
     E_FM: dictionary of (a_F, a_M) points in the Fm process, key is pair index
     gammaPrior: a dictionary of prior for gammaL, "nu0" and "sigma0"
+    temperature: inverse temperature (beta) of the tempered posterior, likelihood^beta * prior
+        (1 = the usual posterior)
     '''
     
     inds = list(E_MF.keys()) + list(E_FM.keys())
     
     mu_mean = np.mean(L[inds])
-    mu_std = 1/np.math.sqrt(len(inds) * gammaL)
+    mu_std = 1/np.math.sqrt(len(inds) * gammaL * temperature)
     
-    muL = truncnorm(a=(0-mu_mean)/mu_std, b=np.inf).rvs() * mu_std + mu_mean
+    muL = sampleTruncatedNormal(mu_mean, mu_std, lower=0)
     
     #deMean = L
     deMean = copy(L)
     deMean[inds] = deMean[inds] - muL
     SS = np.sum(deMean ** 2)
     
-    gammaL = np.random.gamma((gammaPrior['nu0'] + len(L))/2, 
-                             2/(gammaPrior['nu0'] * gammaPrior['sigma0'] + SS))
+    gammaL = np.random.gamma((gammaPrior['nu0'] + temperature * len(L))/2, 
+                             2/(gammaPrior['nu0'] * gammaPrior['sigma0'] + temperature * SS))
     
     return muL, gammaL
 
@@ -87,25 +128,25 @@ def evalLLikelihood(L, E_MF, E_FM, muL, gammaL, subset=None, log=True):
     log: bool, output log-likelihood?
     '''
     # get the indices in either point process
-    inds= list(E_MF.keys()) + list(E_FM.keys())
     if subset is not None:
-        indsIn = list(set(subset) & set(inds))
-        indsOut = list(set(subset) - set(inds))
+        # (only look up the subset entries, so this is O(len(subset)))
+        indsIn = [i for i in subset if (i in E_MF) or (i in E_FM)]
+        indsOut = [i for i in subset if not ((i in E_MF) or (i in E_FM))]
         res = np.empty(len(subset))
         indices = np.array(subset)
     else:
+        inds= list(E_MF.keys()) + list(E_FM.keys())
         indices = np.array(range(len(L)))
         indsIn = inds
         indsOut = list(set(indices) - set(inds))
         res = np.empty(len(L))
         
-    sd = 1/np.math.sqrt(gammaL)  
     #logDensIn = norm(loc=muL, scale=sd).logpdf(L[indsIn]) if len(indsIn) > 0 else 
     if len(indsIn) > 0:
-        logDensIn = norm(loc=muL, scale=sd).logpdf(L[indsIn])
+        logDensIn = normLogpdf(L[indsIn], muL, gammaL)
         res[np.searchsorted(indices, indsIn)] = logDensIn
     if len(indsOut) > 0:
-        logDensOut = norm(loc=0, scale=sd).logpdf(L[indsOut])
+        logDensOut = normLogpdf(L[indsOut], 0, gammaL)
         res[np.searchsorted(indices, indsOut)] = logDensOut
         
     if not log:
@@ -145,7 +186,7 @@ def initializeDirectScore(D, inds):
     return D, indsMF, indsFM, muD, muNegD, gammaD
 
 
-def updateDModel(D, E_MF, E_FM, muD, muNegD, gammaD, gammaPrior):
+def updateDModel(D, E_MF, E_FM, muD, muNegD, gammaD, gammaPrior, temperature=1):
     '''
     Update linked score model (muL and gammaL) given the point configurations
     Returns muD, muNegD, gammaD
@@ -153,18 +194,20 @@ def updateDModel(D, E_MF, E_FM, muD, muNegD, gammaD, gammaPrior):
     E_MF: dictionary of (a_M, a_F) points in the MF process, key is pair index
     E_FM: dictionary of (a_F, a_M) points in the Fm process, key is pair index
     gammaPrior: a dictionary of prior for gammaL, "nu0" and "sigma0"
+    temperature: inverse temperature (beta) of the tempered posterior, likelihood^beta * prior
+        (1 = the usual posterior)
     '''
     
     indsMF = list(E_MF.keys()) 
     indsFM = list(E_FM.keys())
     
     muD_mean = np.mean(D[indsMF])
-    muD_std = 1/np.math.sqrt(len(indsMF) * gammaD)
-    muD = truncnorm(a=(0-muD_mean)/muD_std, b=np.inf).rvs() * muD_std + muD_mean
+    muD_std = 1/np.math.sqrt(len(indsMF) * gammaD * temperature)
+    muD = sampleTruncatedNormal(muD_mean, muD_std, lower=0)
     
     muNegD_mean = np.mean(D[indsFM])
-    muNegD_std = 1/np.math.sqrt(len(indsFM) * gammaD)
-    muNegD = truncnorm(a=-np.inf, b=(0-muNegD_mean)/muNegD_std).rvs() * muNegD_std + muNegD_mean
+    muNegD_std = 1/np.math.sqrt(len(indsFM) * gammaD * temperature)
+    muNegD = sampleTruncatedNormal(muNegD_mean, muNegD_std, upper=0)
     
     #deMean = D
     deMean = copy(D)
@@ -172,8 +215,8 @@ def updateDModel(D, E_MF, E_FM, muD, muNegD, gammaD, gammaPrior):
     deMean[indsFM] = deMean[indsFM] - muNegD
     SS = np.sum(deMean ** 2)
     
-    gammaD = np.random.gamma((gammaPrior['nu0'] + len(D))/2, 
-                             2/(gammaPrior['nu0'] * gammaPrior['sigma0'] + SS))
+    gammaD = np.random.gamma((gammaPrior['nu0'] + temperature * len(D))/2, 
+                             2/(gammaPrior['nu0'] * gammaPrior['sigma0'] + temperature * SS))
     
     return muD, muNegD, gammaD
 
@@ -189,36 +232,34 @@ def evalDLikelihood(D, E_MF, E_FM, muD, muNegD, gammaD, subset=None, log=True):
     subset: list of SORTED indices (if None, then evaluate likelihood on all entries)
     log: bool, output log-likelihood?
     '''
-    # get the indices in each point process
-    indsMF= list(E_MF.keys())
-    indsFM = list(E_FM.keys())
-    
     # get indices in MF, MF and out
     if subset is not None:
-        indsMF = list(set(subset) & set(indsMF))
-        indsFM = list(set(subset) & set(indsFM))
-        indsOut = list(set(subset) - (set(indsMF) | set(indsFM)))
+        # (only look up the subset entries, so this is O(len(subset)))
+        indsMF = [i for i in subset if i in E_MF]
+        indsFM = [i for i in subset if i in E_FM]
+        indsOut = [i for i in subset if not ((i in E_MF) or (i in E_FM))]
         res = np.empty(len(subset))
         indices = np.array(subset)
     else:
+        # get the indices in each point process
+        indsMF= list(E_MF.keys())
+        indsFM = list(E_FM.keys())
         indices = np.array(range(len(D)))
         indsOut = list(set(indices) - (set(indsMF) | set(indsFM)))
         res = np.empty(len(D))
-        
-    sd = 1/np.math.sqrt(gammaD)  
     
     #print(indices)
     
     #print((set(indsMF) | set(indsMF)), indsOut)
 
     if len(indsMF) > 0:
-        logDensMF = norm(loc=muD, scale=sd).logpdf(D[indsMF])
+        logDensMF = normLogpdf(D[indsMF], muD, gammaD)
         res[np.searchsorted(indices, indsMF)] = logDensMF
     if len(indsFM) > 0:
-        logDensFM = norm(loc=muNegD, scale=sd).logpdf(D[indsFM])
+        logDensFM = normLogpdf(D[indsFM], muNegD, gammaD)
         res[np.searchsorted(indices, indsFM)] = logDensFM
     if len(indsOut) > 0:
-        logDensOut = norm(loc=0, scale=sd).logpdf(D[indsOut])
+        logDensOut = normLogpdf(D[indsOut], 0, gammaD)
         res[np.searchsorted(indices, indsOut)] = logDensOut
         
     if not log:
@@ -277,6 +318,101 @@ if __name__ == '__main__':
 
 # The point process stuff
 
+class IndexSet:
+    '''
+    A set of pair indices (out of 0,...,N-1) with O(1) insertion, deletion,
+    membership and uniform sampling:
+        - items[:size] are the members (in no particular order)
+        - pos[i] is the position of i in items (-1 if i is not a member)
+    Deletion swaps the last member into the freed position.
+    '''
+    def __init__(self, N, members=()):
+        self.items = np.empty(N, dtype=int)
+        self.pos = np.full(N, -1, dtype=int)
+        self.size = 0
+        for i in members:
+            self.add(i)
+            
+    def __len__(self):
+        return self.size
+    
+    def __contains__(self, i):
+        return self.pos[i] >= 0
+    
+    def __iter__(self):
+        return iter(self.items[:self.size].tolist())
+    
+    def add(self, i):
+        if self.pos[i] >= 0:
+            return
+        self.items[self.size] = i
+        self.pos[i] = self.size
+        self.size += 1
+        
+    def remove(self, i):
+        p = self.pos[i]
+        if p < 0:
+            raise KeyError(i)
+        last = self.items[self.size-1]
+        self.items[p] = last
+        self.pos[last] = p
+        self.pos[i] = -1
+        self.size -= 1
+        
+    def sample(self):
+        '''
+        One member drawn uniformly at random
+        '''
+        return self.items[np.random.randint(self.size)]
+
+
+def initializeIndexSets(N, E_MF, E_FM):
+    '''
+    Index sets for the partition of all N pairs into 
+    "out" (not in any point process), "MF" and "FM"
+    Returns a dictionary of IndexSet
+    '''
+    indexSets = {'out': IndexSet(N), 'MF': IndexSet(N, E_MF), 'FM': IndexSet(N, E_FM)}
+    for i in range(N):
+        if (i not in E_MF) and (i not in E_FM):
+            indexSets['out'].add(i)
+            
+    return indexSets
+
+
+def samplePairs(sets, batch_size=1):
+    '''
+    Draw min(batch_size, total size) distinct pairs uniformly from the union of 
+    the (disjoint) IndexSets in "sets";
+    O(batch_size) when batch_size is small compared to the total size
+    '''
+    sizes = np.array([len(S) for S in sets])
+    total = sizes.sum()
+    
+    if total <= batch_size:
+        return [i for S in sets for i in S]
+    
+    # draw distinct positions in the union...
+    if batch_size == 1:
+        positions = [np.random.randint(total)]
+    elif 4 * batch_size < total:
+        positions = set()
+        while len(positions) < batch_size:
+            positions.add(np.random.randint(total))
+        positions = list(positions)
+    else:
+        positions = choice(total, size=batch_size, replace=False)
+    
+    # ... and map them to the members
+    bounds = np.cumsum(sizes)
+    chosen = []
+    for p in positions:
+        j = np.searchsorted(bounds, p, side='right')
+        chosen.append(sets[j].items[p - (bounds[j] - sizes[j])])
+        
+    return chosen
+
+
 def initializePP(E, indsMF, indsFM):
     '''
     Initialize MF and FM point process configurations.
@@ -295,18 +431,21 @@ def initializePP(E, indsMF, indsFM):
     
     return E_MF, E_FM, gammaMF, gammaFM
 
-def updateGammaPP(E_MF, E_FM, gammaPrior):
+def updateGammaPP(E_MF, E_FM, gammaPrior, temperature=1):
     '''
     Update gammaMF and gammaFM
+    E_MF, E_FM: the MF and FM event sets (dictionaries or IndexSets; only the sizes are used)
     gammaPrior: dictionary of prior, with "n0" and "b0"
+    temperature: inverse temperature (beta) of the tempered posterior, likelihood^beta * prior
+        (1 = the usual posterior)
     '''
     
     N_MF = len(E_MF); N_FM = len(E_FM)
     
-    gammaMF = np.random.gamma(gammaPrior['n0']+N_MF, 
-                              1/(gammaPrior['b0']+1))
-    gammaFM = np.random.gamma(gammaPrior['n0']+N_FM, 
-                              1/(gammaPrior['b0']+1))
+    gammaMF = np.random.gamma(gammaPrior['n0']+temperature*N_MF, 
+                              1/(gammaPrior['b0']+temperature))
+    gammaFM = np.random.gamma(gammaPrior['n0']+temperature*N_FM, 
+                              1/(gammaPrior['b0']+temperature))
 
     return gammaMF, gammaFM
         
@@ -433,7 +572,52 @@ def proposePPold(E, E_MF, E_FM, batch_size = 1):
     
 
 
-def proposePP(E, E_MF, E_FM, batch_size = 1):
+def moveTypeProbs(N_out, N_in, moveWeights=None):
+    '''
+    Probabilities of the birth, death and swap moves in proposePP;
+    proportional to [2*N_out, N_in, N_in] (times the optional moveWeights)
+    N_out: number of pairs outside
+    N_in: number of pairs in MF or FM
+    moveWeights: optional length 3 array of (positive) weights for b, d, s
+    '''
+    probs = np.array([N_out * 2, N_in, N_in], dtype=float)
+    if moveWeights is not None:
+        probs *= moveWeights
+    return probs/probs.sum()
+
+
+def logProposalRatio(step, B, N_out, N_in, moveWeights=None):
+    '''
+    Hastings correction log q(new -> old) - log q(old -> new) of a proposePP move
+    step: type of the move ('b', 'd' or 's')
+    B: number of pairs changed
+    N_out, N_in: number of pairs outside/inside BEFORE the move
+    moveWeights: the move type weights used in the proposal
+    
+    (with moveWeights=None and B=1 this is 0: the default scheme is symmetric)
+    '''
+    def logq(step, N_out, N_in):
+        # choose the type, then B pairs out of the pool (all of them if the pool is small), 
+        # (and a surface for each birth)
+        p = moveTypeProbs(N_out, N_in, moveWeights)['bds'.index(step)]
+        pool = N_out if step == 'b' else N_in
+        res = np.log(p)
+        if pool > B:
+            res -= gammaln(pool+1) - gammaln(B+1) - gammaln(pool-B+1)
+        if step == 'b':
+            res -= B * np.log(2)
+        return res
+    
+    if step == 'b':
+        return logq('d', N_out-B, N_in+B) - logq('b', N_out, N_in)
+    elif step == 'd':
+        return logq('b', N_out+B, N_in-B) - logq('d', N_out, N_in)
+    else:
+        return 0.0
+
+
+def proposePP(E, E_MF, E_FM, batch_size = 1, indexSets = None, undoLog = None, 
+              moveWeights = None):
     '''
     (The lastest version of the function)
     Propose change in the point process configurations.
@@ -446,57 +630,66 @@ def proposePP(E, E_MF, E_FM, batch_size = 1):
         - THE index of the pair that is changed
         - the type of change they went through
         
+    indexSets: dictionary of IndexSet for "out", "MF" and "FM" (see initializeIndexSets),
+        kept in sync with E_MF and E_FM (updated in place);
+        if None, they are built from E_MF and E_FM (O(N))
+    undoLog: optional list; (pair, source) is appended for each changed pair,
+        source being where the pair was before ("out", "MF" or "FM"),
+        so that the proposal can be reverted by "undoProposal"
+    moveWeights: optional length 3 array of weights for the b, d, s move types
+        (see moveTypeProbs; the Hastings correction is logProposalRatio)
+        
     NOTE: since some of the potential changes conflict, right now only ONE change is proposed
     That is, batch_size is FIXED at 1 for now!
     '''
     N = len(E)
-    indsMF = list(E_MF.keys()); N_MF = len(indsMF)
-    indsFM = list(E_FM.keys()); N_FM = len(indsFM)
-    indsOut = list(set(range(N)) - set(indsMF+indsFM)); N_out = N - N_MF - N_FM
+    if indexSets is None:
+        indexSets = initializeIndexSets(N, E_MF, E_FM)
+    setOut, setMF, setFM = indexSets['out'], indexSets['MF'], indexSets['FM']
+    N_MF = len(setMF); N_FM = len(setFM); N_out = len(setOut)
     
-    change_prob = np.array([N_out * 2, N_MF + N_FM, N_MF + N_FM])
-    change_prob = change_prob/change_prob.sum()
+    change_prob = moveTypeProbs(N_out, N_MF + N_FM, moveWeights)
     
     step = choice(['b','d','s'], p = change_prob)
     
     if step == 'b':
         # birth step
-        if N_out <= batch_size:
-            chosen = indsOut
-        else:
-            chosen = choice(indsOut, size=batch_size, replace=False)
+        chosen = samplePairs([setOut], batch_size)
         # for each chosen one, randomly assign it to each surface
         for c in chosen:
+            setOut.remove(c)
+            if undoLog is not None:
+                undoLog.append((c, 'out'))
             if np.random.random_sample() < 0.5:
-                E_MF[c] = E[c]
+                E_MF[c] = E[c]; setMF.add(c)
             else:
                 E_FM[c] = E[c][::-1] # need to reverse age order on FM
+                setFM.add(c)
     elif step == 'd':
         # death step
-        if N_MF + N_FM <= batch_size:
-            chosen = indsMF + indsFM
-        else:
-            chosen = choice(indsMF+indsFM, size=batch_size, replace=False)
+        chosen = samplePairs([setMF, setFM], batch_size)
         # for each chosen one, delete it from its event set
         for c in chosen:
-            if c in E_MF:
-                del E_MF[c]
+            if undoLog is not None:
+                undoLog.append((c, 'MF' if c in setMF else 'FM'))
+            if c in setMF:
+                del E_MF[c]; setMF.remove(c)
             else:
-                del E_FM[c]
+                del E_FM[c]; setFM.remove(c)
+            setOut.add(c)
     else:
         # swap step
-        if N_MF + N_FM <= batch_size:
-            chosen = indsMF + indsFM
-        else:
-            chosen = choice(indsMF+indsFM, size=batch_size, replace=False)
+        chosen = samplePairs([setMF, setFM], batch_size)
         # for each chosen one, switch its surface (and reverse age order)
         for c in chosen:
-            if c in E_MF:
-                age_c = E_MF.pop(c)
-                E_FM[c] = age_c[::-1]
+            if undoLog is not None:
+                undoLog.append((c, 'MF' if c in setMF else 'FM'))
+            if c in setMF:
+                age_c = E_MF.pop(c); setMF.remove(c)
+                E_FM[c] = age_c[::-1]; setFM.add(c)
             else:
-                age_c = E_FM.pop(c)
-                E_MF[c] = age_c[::-1]
+                age_c = E_FM.pop(c); setFM.remove(c)
+                E_MF[c] = age_c[::-1]; setMF.add(c)
                 
     chosen = list(chosen)
     chosen.sort()
@@ -506,6 +699,48 @@ def proposePP(E, E_MF, E_FM, batch_size = 1):
     return E_MF, E_FM, chosen, step
 
 
+def getUndoneEventSets(E, undoLog):
+    '''
+    The part of the configuration BEFORE a proposal, for the changed pairs only;
+    Returns small E_MF, E_FM dictionaries (only the changed pairs that were on MF/FM)
+    E: dictionary of all (a_M, a_F) points
+    undoLog: list of (pair, source) recorded by proposePP
+    '''
+    E_MF_old = {c: E[c] for c, source in undoLog if source == 'MF'}
+    E_FM_old = {c: E[c][::-1] for c, source in undoLog if source == 'FM'}
+    
+    return E_MF_old, E_FM_old
+
+
+def undoProposal(E, E_MF, E_FM, undoLog, indexSets=None):
+    '''
+    Revert a proposal (in place) using the undo log recorded by proposePP;
+    costs O(len(undoLog))
+    E: dictionary of all (a_M, a_F) points
+    E_MF, E_FM: current event sets
+    undoLog: list of (pair, source) recorded by proposePP
+    indexSets: optional dictionary of IndexSet to revert as well
+    '''
+    for c, source in reversed(undoLog):
+        # take it out of where it is now...
+        if c in E_MF:
+            del E_MF[c]; current = 'MF'
+        elif c in E_FM:
+            del E_FM[c]; current = 'FM'
+        else:
+            current = 'out'
+        # ... and put it back
+        if source == 'MF':
+            E_MF[c] = E[c]
+        elif source == 'FM':
+            E_FM[c] = E[c][::-1]
+        if indexSets is not None:
+            indexSets[current].remove(c)
+            indexSets[source].add(c)
+            
+    return E_MF, E_FM
+
+
 def getPoints(E, subset=None):
     '''
     Return a (n,p) array of the points in event set E (or a subset)
@@ -518,8 +753,8 @@ def getPoints(E, subset=None):
     else:
         #p = X.shape[1]
         if subset:
-            E_sub = {i: age for i,age in E.items() if i in subset}
-            X = np.array(list(E_sub.values()))
+            # (look up the subset entries only)
+            X = np.array([E[i] for i in subset if i in E])
             #n = len(subset)
         else:
             X = np.array(list(E.values()))
@@ -563,36 +798,40 @@ def initializeGMM(X, K=2):
     return components, labels
 
 
-def updateOneComponent(X, mu, precision, muPrior, precisionPrior):
+def updateOneComponent(X, mu, precision, muPrior, precisionPrior, temperature=1):
     '''
     X: (n,p) array of data
     mu: (p,1) array of current mean
     precision: (p,p) matrix of current precision
     muPrior: dictionary of prior mean and precision
     precisionPrior: dictionary of prior df and invScale
+    temperature: inverse temperature (beta) of the tempered posterior, likelihood^beta * prior
+        (1 = the usual posterior)
     '''
     
-    n = X.shape[0]
+    n = X.shape[0] * temperature
     An_inv = inv(muPrior['precision'] + n * precision)
-    Xsum = np.sum(X, axis=0)
+    Xsum = np.sum(X, axis=0) * temperature
     bn = muPrior['precision'].dot(muPrior['mean']) + precision.dot(Xsum)
     
     mu = multivariate_normal(An_inv.dot(bn), An_inv).rvs()
     
-    S_mu = np.matmul((X-mu).T, X-mu)
+    S_mu = np.matmul((X-mu).T, X-mu) * temperature
     
     precision = wishart(precisionPrior['df'] + n, 
                         inv(precisionPrior['invScale'] + S_mu)).rvs()
     
     return mu, precision
 
-def updateGaussianComponents(X, Z, components, muPrior, precisionPrior):
+def updateGaussianComponents(X, Z, components, muPrior, precisionPrior, temperature=1):
     '''
     X: (n,p) array of data
     Z: length n, array like component indicator
     components: list of (mu, precision) for K Gaussian components
     muPrior: dictionary of prior mean and precision
     precisionPrior: dictionary of prior df and invScale
+    temperature: inverse temperature (beta) of the tempered posterior, likelihood^beta * prior
+        (1 = the usual posterior)
     '''
     K = len(components)
     
@@ -601,7 +840,7 @@ def updateGaussianComponents(X, Z, components, muPrior, precisionPrior):
         if subX.shape[0] > 0:
             mu, precision = components[k]
             components[k] = updateOneComponent(subX, mu, precision, 
-                      muPrior, precisionPrior)
+                      muPrior, precisionPrior, temperature)
             
     return components
 
@@ -610,11 +849,12 @@ def getProbVector(p):
     #print(p)
     return p/p.sum()
 
-def updateComponentIndicator(X, weight, components):
+def updateComponentIndicator(X, weight, components, temperature=1):
     '''
     X: (n,p) array of data
     components: list of (mu, precision) for K Gaussian components
     (05/13 fix: use weights in indicator update! previous version was wrong)
+    temperature: inverse temperature (beta) of the tempered posterior (1 = the usual posterior)
     '''
     K = len(components)
     n = X.shape[0]
@@ -624,7 +864,7 @@ def updateComponentIndicator(X, weight, components):
     for k in range(K):
         mu, precision = components[k]
         MVN = multivariate_normal(mu, inv(precision))
-        logDens[k,:] = MVN.logpdf(X) + np.log(weight[k])
+        logDens[k,:] = (MVN.logpdf(X) + np.log(weight[k])) * temperature
 #        logProb = MVN.logpdf(X)
 #        if np.any(np.isnan(logProb)):
 #            print(mu, precision)
@@ -636,48 +876,60 @@ def updateComponentIndicator(X, weight, components):
                                              p=getProbVector(v)), 0, logDens)
     return Z
 
-def updateMixtureWeight(Z, weightPrior):
+def updateMixtureWeight(Z, weightPrior, temperature=1):
     '''
     Z: length n, array like component indicator
     weightPrior: length K, array like prior (for the Dirichlet prior)
+    temperature: inverse temperature (beta) of the tempered posterior (1 = the usual posterior)
     '''
     unique, counts = np.unique(Z, return_counts=True)
     mixtureCounts = dict(zip(unique,counts))
     
-    alpha = weightPrior
+    # (a copy: the prior itself must not accumulate the counts)
+    alpha = np.array(weightPrior, dtype=float)
     
     for k in mixtureCounts:
-        alpha[k] += mixtureCounts[k]
+        alpha[k] += temperature * mixtureCounts[k]
         
     return dirichlet(alpha).rvs()[0]
 
-def evalDensity(X, weight, components, log=True):
+def evalDensity(X, weight, components, log=True, temperature=1):
     '''
     Evaluate the entire density function (after mixture) on points X;
     Returns a length-n array of density/log-density
     X: (n,p) array of data
     weight: length K vector of mixture weights
     components: list of (mu, precision) for K Gaussian components
+    temperature: inverse temperature (beta); if not 1, the tempered mixture 
+        sum_k (weight_k * density_k)^beta is returned instead
+        (the tempered complete-data likelihood with the component label summed out)
     '''
     
-    n = X.shape[0]
+    n, p = X.shape
     K = len(weight)
     
     mix_dens = np.empty((n,K))
     
+    # Gaussian densities in closed form (same as multivariate_normal(mu, inv(precision)).pdf)
     for k in range(K):
         mu, precision = components[k]
-        MVN = multivariate_normal(mu, inv(precision))
-        mix_dens[:,k] = MVN.pdf(X)
+        dX = X - mu
+        quad = np.einsum('ij,jk,ik->i', dX, precision, dX)
+        logdet = np.linalg.slogdet(precision)[1]
+        mix_dens[:,k] = np.exp(0.5*logdet - 0.5*p*np.log(2*np.pi) - 0.5*quad)
         
     #print(mix_dens)
         
-    total_dens = np.sum(weight * mix_dens, axis=1)
+    total_dens = weight * mix_dens
+    if temperature != 1:
+        total_dens **= temperature
+    total_dens = np.sum(total_dens, axis=1)
     
     if log:
         total_dens = np.log(total_dens)
         
     return total_dens
+
 #%% test
 #x_test = np.random.randn(50,2) + 2
 
@@ -16,7 +16,7 @@ Created on Sat Aug 29 11:35:17 2020
 import numpy as np
 from numpy.linalg import inv
 from numpy.random import choice
-from scipy.special import logit, expit
+from scipy.special import logit, expit, log_ndtr, ndtri_exp, gammaln
 from scipy.stats import multivariate_normal, norm, truncnorm
 from scipy.stats import wishart, invwishart
 from scipy.stats import dirichlet
@@ -30,10 +30,88 @@ from numpy.random import default_rng
 rng = default_rng()
 
 
+#%%
+
+# pre-allocated work buffers
+
+class DPGMMWorkspace:
+    '''
+    Work buffers for one MCMC chain on N pairs with (at most) Kmax mixture components;
+    created once (in "fit") and re-used in every iteration, 
+    so that the hot functions below don't allocate length-N arrays each time
+    
+    X: (N,2) array of all the (a_M, a_F) points
+    Kmax: maximum num of mixture components
+    '''
+    def __init__(self, X, Kmax=10):
+        self.N = X.shape[0]
+        self.Kmax = Kmax
+        # the points, and the flipped points (for the FM surface)
+        self.X = np.ascontiguousarray(X, dtype=float)
+        self.Xflip = np.ascontiguousarray(self.X[:,(1,0)])
+        # 0,...,N-1 (used to scatter permutations)
+        self.positions = np.arange(self.N)
+        self.buffers = dict()
+        
+    def get(self, name, shape, dtype=float):
+        '''
+        Return an (uninitialized) array of the given shape for buffer "name";
+        the memory is allocated the first time only (with room for N rows, 
+        unless the rows are already N long, e.g. the (3,N) score arrays), 
+        later calls return views into the same memory
+        '''
+        if np.isscalar(shape):
+            shape = (shape,)
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        
+        buf = self.buffers.get((name, dtype))
+        if buf is None or buf.size < size:
+            rowsize = int(np.prod(shape[1:]))
+            room = self.N * rowsize if rowsize < self.N else size
+            buf = np.empty(max(size, room), dtype=dtype)
+            self.buffers[(name, dtype)] = buf
+            
+        return buf[:size].reshape(shape)
+
+
 #%%
 
 # 1-d Gaussian stuff (score model)
 
+def sampleTruncatedNormal(mean, std, lower=-np.inf, upper=np.inf, size=None, generator=None):
+    '''
+    Draw from N(mean, std^2) truncated to [lower, upper] by the inverse CDF in log scale
+    (stays accurate far into the tails; no scipy distribution objects);
+    all of mean, std, lower, upper can be arrays (e.g. one entry per chain), they are broadcast
+    generator: Generator (or RandomState) to draw the uniforms from; if None, the module Generator "rng"
+    
+    returns a float (or an array of the broadcast shape / size)
+    '''
+    generator = rng if generator is None else generator
+    
+    a = (np.asarray(lower, dtype=float) - mean)/std
+    b = (np.asarray(upper, dtype=float) - mean)/std
+    a, b = np.broadcast_arrays(a, b)
+    
+    # work in the lower tail: if the whole interval is above 0, flip it
+    flip = a > 0
+    a, b = np.where(flip, -b, a), np.where(flip, -a, b)
+    
+    # log CDF at a uniform point between the CDF values at a and b
+    logPa = log_ndtr(a); logPb = log_ndtr(b)
+    # (uniform on (0,1], so that the log below is finite)
+    u = 1 - generator.uniform(size=a.shape if size is None else size)
+    with np.errstate(divide='ignore'):
+        logP = logPb + np.log(u + (1-u) * np.exp(logPa - logPb))
+    
+    z = ndtri_exp(logP)
+    z = np.where(flip, -z, z)
+    
+    res = z * std + mean
+    
+    return res if np.ndim(res) > 0 else float(res)
+
 ## linked score
 
 def initializeLinkedScore(L, initThres = 0.6):
@@ -75,7 +153,7 @@ def updateLModel(L, indsMF, indsFM, muL, gammaL, gammaPrior):
     mu_mean = np.mean(L[inds])
     mu_std = 1/np.math.sqrt(len(inds) * gammaL)
     
-    muL = truncnorm(a=(0-mu_mean)/mu_std, b=np.inf).rvs() * mu_std + mu_mean
+    muL = sampleTruncatedNormal(mu_mean, mu_std, lower=0)
     
     #deMean = L
     deMean = copy(L)
@@ -87,6 +165,22 @@ def updateLModel(L, indsMF, indsFM, muL, gammaL, gammaPrior):
     
     return muL, gammaL
 
+def updateLModelFromStats(nIn, sumIn, sumSq, N, muL, gammaL, gammaPrior):
+    '''
+    The update of updateLModel from sufficient statistics (same draws);
+    Returns muL and gammaL
+    nIn, sumIn: number and sum of the linked scores of the points in either process
+    sumSq: sum of squares of all N linked scores
+    '''
+    muL = sampleTruncatedNormal(sumIn/nIn, 1/np.math.sqrt(nIn * gammaL), lower=0)
+    
+    SS = sumSq - 2*muL*sumIn + nIn*muL**2
+    
+    gammaL = np.random.gamma((gammaPrior['nu0'] + N)/2, 
+                             2/(gammaPrior['nu0'] * gammaPrior['sigma0'] + SS))
+    
+    return muL, gammaL
+
 def evalLLikelihood(L, indsMF, indsFM, muL, gammaL, subset=None, log=True):
     '''
     Evaluate the linked score component of the likelihood (on a subset of entries);
@@ -174,11 +268,11 @@ def updateDModel(D, indsMF, indsFM, muD, muNegD, gammaD, gammaPrior):
     
     muD_mean = np.mean(D[indsMF])
     muD_std = 1/np.math.sqrt(len(indsMF) * gammaD)
-    muD = truncnorm(a=(0-muD_mean)/muD_std, b=np.inf).rvs() * muD_std + muD_mean
+    muD = sampleTruncatedNormal(muD_mean, muD_std, lower=0)
     
     muNegD_mean = np.mean(D[indsFM])
     muNegD_std = 1/np.math.sqrt(len(indsFM) * gammaD)
-    muNegD = truncnorm(a=-np.inf, b=(0-muNegD_mean)/muNegD_std).rvs() * muNegD_std + muNegD_mean
+    muNegD = sampleTruncatedNormal(muNegD_mean, muNegD_std, upper=0)
     
     #deMean = D
     deMean = copy(D)
@@ -192,6 +286,24 @@ def updateDModel(D, indsMF, indsFM, muD, muNegD, gammaD, gammaPrior):
     return muD, muNegD, gammaD
 
 
+def updateDModelFromStats(nMF, sumMF, nFM, sumFM, sumSq, N, muD, muNegD, gammaD, gammaPrior):
+    '''
+    The update of updateDModel from sufficient statistics (same draws);
+    Returns muD, muNegD, gammaD
+    nMF, sumMF (nFM, sumFM): number and sum of the direction scores of the points in the MF (FM) process
+    sumSq: sum of squares of all N direction scores
+    '''
+    muD = sampleTruncatedNormal(sumMF/nMF, 1/np.math.sqrt(nMF * gammaD), lower=0)
+    muNegD = sampleTruncatedNormal(sumFM/nFM, 1/np.math.sqrt(nFM * gammaD), upper=0)
+    
+    SS = (sumSq - 2*muD*sumMF + nMF*muD**2 - 2*muNegD*sumFM + nFM*muNegD**2)
+    
+    gammaD = np.random.gamma((gammaPrior['nu0'] + N)/2, 
+                             2/(gammaPrior['nu0'] * gammaPrior['sigma0'] + SS))
+    
+    return muD, muNegD, gammaD
+
+
 def evalDLikelihood(D, indsMF, indsFM, muD, muNegD, gammaD, subset=None, log=True):
     '''
     Evaluate the direction score component of the likelihood (on a subset of entries);
@@ -236,6 +348,46 @@ def evalDLikelihood(D, indsMF, indsFM, muD, muNegD, gammaD, subset=None, log=Tru
         
     return res
 
+## both scores, for all pairs at once
+
+def evalScoreLikelihoods(L, D, muL, gammaL, muD, muNegD, gammaD, out=None, ws=None):
+    '''
+    Evaluate the score model (L and D) log-likelihood of ALL pairs under each type
+    Returns (3,N) array, rows are the log-likelihood if the pair is
+        0: outside (the ghost events), 1: on the MF surface, 2: on the FM surface
+    L, D: length N linked and direction scores (transformed) of all pairs
+    muL, gammaL, muD, muNegD, gammaD: parameters of the score models
+    out: optional (3,N) array to write the result into
+    ws: optional DPGMMWorkspace to take scratch space from
+    '''
+    N = len(L)
+    if out is None:
+        out = np.empty((3,N))
+    tmp = ws.get('score_tmp', N) if ws is not None else np.empty(N)
+    
+    constL = -0.5*np.log(2*np.pi) + 0.5*np.log(gammaL)
+    constD = -0.5*np.log(2*np.pi) + 0.5*np.log(gammaD)
+    
+    # outside: both centered at 0
+    np.multiply(L, L, out=out[0]); out[0] *= -0.5*gammaL
+    np.multiply(D, D, out=tmp); tmp *= -0.5*gammaD
+    out[0] += tmp
+    out[0] += constL + constD
+    
+    # the linked score part is the same for MF and FM
+    np.subtract(L, muL, out=tmp); np.square(tmp, out=tmp); tmp *= -0.5*gammaL
+    tmp += constL + constD
+    
+    # MF
+    np.subtract(D, muD, out=out[1]); np.square(out[1], out=out[1]); out[1] *= -0.5*gammaD
+    out[1] += tmp
+    
+    # FM
+    np.subtract(D, muNegD, out=out[2]); np.square(out[2], out=out[2]); out[2] *= -0.5*gammaD
+    out[2] += tmp
+    
+    return out
+
 #%%
    
 # test score model update
@@ -312,16 +464,18 @@ if __name__ == '__main__':
 # =============================================================================
 
 
-def updateGamma(C, gammaPrior):
+def updateGamma(C, gammaPrior, counts=None):
     '''
     Update gammaMF and gammaFM based on C indicators
     - C: values in 0,1,2,3
     - gammaPrior: dictionary of prior
+    - counts: optional, the type counts np.bincount(C, minlength=4) if already known
     
     '''
-    N = len(C)
-    N_MF = np.sum(C%2==0)
-    N_FM = N - N_MF
+    if counts is None:
+        counts = np.bincount(C, minlength=4)
+    N_MF = counts[0] + counts[2]
+    N_FM = counts[1] + counts[3]
     
     gammaMF = np.random.gamma(gammaPrior['n0']+N_MF, 1/(gammaPrior['b0']+1))
     gammaFM = np.random.gamma(gammaPrior['n0']+N_FM, 1/(gammaPrior['b0']+1))
@@ -329,20 +483,71 @@ def updateGamma(C, gammaPrior):
     return gammaMF, gammaFM
 
 
-def updateEta(C, etaPrior):
+def updateEta(C, etaPrior, counts=None):
     '''
     Update thinning prob eta+ and eta- on MF, FM surfaces
     - C: values in 0,1,2,3
     - etaPrior: dictionary of prior for eta
+    - counts: optional, the type counts np.bincount(C, minlength=4) if already known
     
     '''
+    if counts is None:
+        counts = np.bincount(C, minlength=4)
     
-    etaMF = np.random.beta(etaPrior['a']+np.sum(C==2), etaPrior['b']+np.sum(C==0))
-    etaFM = np.random.beta(etaPrior['a']+np.sum(C==3), etaPrior['b']+np.sum(C==1))
+    etaMF = np.random.beta(etaPrior['a']+counts[2], etaPrior['b']+counts[0])
+    etaFM = np.random.beta(etaPrior['a']+counts[3], etaPrior['b']+counts[1])
     
     return etaMF, etaFM
 
 
+# the order of the types in the grouped permutation:
+# real MF, ghost MF, real FM, ghost FM
+# (so that each surface is one contiguous block)
+TYPE_ORDER = np.array([2,0,3,1])
+
+
+def groupByType(C, out=None, ws=None):
+    '''
+    Counting sort of the pairs by type (stable, in the order of TYPE_ORDER);
+    Returns:
+        - perm: length N permutation; perm[offsets[j]:offsets[j+1]] are the
+            (increasing) indices of the pairs with type TYPE_ORDER[j]
+        - offsets: length 5 array of block boundaries
+    - C: values in 0,1,2,3
+    - out: optional length N int array to write the permutation into
+    - ws: optional DPGMMWorkspace to take scratch space from
+    '''
+    N = len(C)
+    if out is None:
+        out = np.empty(N, dtype=np.intp)
+    if ws is not None:
+        dest = ws.get('group_dest', N, np.intp)
+        rank = ws.get('group_rank', N, np.intp)
+        flag = ws.get('group_flag', N, np.intp)
+        positions = ws.positions
+    else:
+        dest = np.empty(N, dtype=np.intp); rank = np.empty(N, dtype=np.intp)
+        flag = np.empty(N, dtype=np.intp); positions = np.arange(N)
+
+    counts = np.bincount(C, minlength=4)[TYPE_ORDER]
+    offsets = np.zeros(5, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+
+    # destination of each pair = block start + rank within its type
+    dest[:] = 0
+    # (an integer flag: a cumsum of a bool array makes a length-N cast copy)
+    for j, t in enumerate(TYPE_ORDER):
+        np.equal(C, t, out=flag, casting='unsafe')
+        np.cumsum(flag, out=rank)
+        rank += offsets[j] - 1
+        rank *= flag
+        dest += rank
+
+    out[dest] = positions
+
+    return out, offsets
+
+
 def getPoints(E, subset=None, flip = False):
     '''
     Return a (n,2) array of the points in event set E (or a subset)
@@ -389,7 +594,158 @@ if __name__ == '__main__':
 #%%
 # new: 08/29/2020
 # DP Gaussian mixture part
+
+# container for the Gaussian components (struct of arrays)
+class GaussianComponents:
+    '''
+    K (2-d) Gaussian components stored as arrays:
+        - means: (K,2) array
+        - precisions: (K,2,2) array
+    plus cached derived quantities (re-computed whenever components change):
+        - logNorm: (K,) log normalizing constants, 0.5*log|precision| - log(2*pi)
+        - offDiag: (K,) precision[0,1] + precision[1,0]
+    
+    Indexing with an integer gives a (mu, precision) pair (as views), 
+    so it can be used like the old list of (mu, precision) tuples;
+    indexing with a slice or an index array gives a new container
+    '''
+    def __init__(self, means, precisions):
+        self.means = np.array(means, dtype=float).reshape((-1,2))
+        self.precisions = np.array(precisions, dtype=float).reshape((-1,2,2))
+        self.logNorm = np.empty(len(self.means))
+        self.offDiag = np.empty(len(self.means))
+        self.updateCache()
+        
+    @classmethod
+    def fromList(cls, components):
+        '''
+        Build from a list of (mu, precision) tuples (or return as is if already a container)
+        '''
+        if isinstance(components, cls):
+            return components
+        return cls([mu for mu,_ in components], [precision for _,precision in components])
+    
+    def toList(self):
+        '''
+        Return a list of (mu, precision) tuples (copies)
+        '''
+        return [(self.means[k].copy(), self.precisions[k].copy()) for k in range(len(self))]
+    
+    def copy(self):
+        return GaussianComponents(self.means, self.precisions)
+    
+    def __len__(self):
+        return self.means.shape[0]
+    
+    def __getitem__(self, k):
+        if isinstance(k, (slice, list, np.ndarray)):
+            return GaussianComponents(self.means[k], self.precisions[k])
+        return self.means[k], self.precisions[k]
+    
+    def __setitem__(self, k, comp):
+        mu, precision = comp
+        self.means[k] = mu
+        self.precisions[k] = precision
+        self.updateCache(k)
+        
+    def updateCache(self, which=None):
+        '''
+        Re-compute the cached quantities (for all components, or just "which": index or mask)
+        '''
+        which = slice(None) if which is None else which
+        P = self.precisions[which]
+        det = P[...,0,0]*P[...,1,1] - P[...,0,1]*P[...,1,0]
+        self.logNorm[which] = 0.5*np.log(det) - np.log(2*np.pi)
+        self.offDiag[which] = P[...,0,1] + P[...,1,0]
+        
+    def permute(self, order):
+        '''
+        Re-order the components in place: new component k is old component order[k]
+        '''
+        self.means[:] = self.means[order]
+        self.precisions[:] = self.precisions[order]
+        self.logNorm[:] = self.logNorm[order]
+        self.offDiag[:] = self.offDiag[order]
+        
+    def redraw(self, mask, muPrior, precisionPrior, priorCache=None):
+        '''
+        Replace the components where mask is True by new draws from the prior (base measure)
+        priorCache: optional, from getPriorCache(muPrior, precisionPrior)
+        '''
+        which = np.flatnonzero(mask)
+        if len(which) == 0:
+            return
+        
+        if priorCache is None:
+            priorCache = getPriorCache(muPrior, precisionPrior)
+        self.means[which], self.precisions[which] = samplePriorComponents(len(which), priorCache)
+        self.updateCache(which)
+    
     
+# quantities derived from the priors of the components (compute once per model)
+def getPriorCache(muPrior, precisionPrior):
+    '''
+    muPrior: dictionary of prior mean and precision
+    precisionPrior: dictionary of prior df and invScale
+    
+    return: a dictionary of
+        - "muPrecision": prior precision of the means
+        - "muPrecisionMean": prior precision times prior mean
+        - "muCovChol": Cholesky factor of the prior covariance of the means
+        - "df", "invScale": Wishart prior parameters of the precisions
+        - "scaleChol": Cholesky factor of the Wishart scale matrix, inv(invScale)
+    '''
+    muPrecision = np.asarray(muPrior['precision'], dtype=float)
+    invScale = np.asarray(precisionPrior['invScale'], dtype=float)
+    
+    return {'muPrecision': muPrecision,
+            'muPrecisionMean': muPrecision.dot(muPrior['mean']),
+            'muCovChol': np.linalg.cholesky(inv(muPrecision)),
+            'df': precisionPrior['df'],
+            'invScale': invScale,
+            'scaleChol': np.linalg.cholesky(inv(invScale))}
+
+
+# 2x2 Wishart draws for many components at once (Bartlett decomposition)
+def sampleWishart2(df, scaleChol):
+    '''
+    df: length K array of degrees of freedom (or a scalar)
+    scaleChol: (K,2,2) array of the (lower) Cholesky factors of the scale matrices 
+        (or one (2,2) factor for all)
+    
+    return: (K,2,2) array of draws from Wishart(df[k], scaleChol[k] scaleChol[k]^T)
+    '''
+    df = np.asarray(df, dtype=float)
+    scaleChol = np.asarray(scaleChol, dtype=float)
+    K = max(df.size, scaleChol.size//4)
+    
+    # W = L A A^T L^T, with A lower triangular:
+    # A[0,0]^2 ~ chi2(df), A[1,1]^2 ~ chi2(df-1), A[1,0] ~ N(0,1)
+    A = np.zeros((K,2,2))
+    A[:,0,0] = np.sqrt(rng.chisquare(df * np.ones(K)))
+    A[:,1,1] = np.sqrt(rng.chisquare(df * np.ones(K) - 1))
+    A[:,1,0] = rng.standard_normal(K)
+    
+    LA = np.matmul(scaleChol, A)
+    
+    return np.matmul(LA, np.swapaxes(LA, -1, -2))
+
+
+# sample components from the prior (base measure), as arrays
+def samplePriorComponents(Knew, priorCache):
+    '''
+    Knew: number of new components to generate
+    priorCache: from getPriorCache
+    
+    return: (Knew,2) array of means, (Knew,2,2) array of precisions
+    '''
+    mean = np.linalg.solve(priorCache['muPrecision'], priorCache['muPrecisionMean'])
+    means = mean + rng.standard_normal((Knew,2)).dot(priorCache['muCovChol'].T)
+    precisions = sampleWishart2(np.full(Knew, priorCache['df']), priorCache['scaleChol'])
+    
+    return means, precisions
+
+
 # sample new components directly from the prior (base measure)
 def sampleNewComp(Knew, muPrior, precisionPrior):
     '''
@@ -399,43 +755,42 @@ def sampleNewComp(Knew, muPrior, precisionPrior):
     
     return: a list of NEW components
     '''
-    comps = []
-    
     if Knew == 0:
-        return comps
-    
-    muCov = inv(muPrior['precision'])
-    precisionScale = inv(precisionPrior['invScale'])
+        return []
     
+    means, precisions = samplePriorComponents(Knew, getPriorCache(muPrior, precisionPrior))
     
-    for k in range(Knew):
-        mu = rng.multivariate_normal(muPrior['mean'], muCov)
-        precision = wishart(precisionPrior['df'], precisionScale).rvs()
-        
-        comps.append((mu, precision))
-    
-    return comps
+    return [(means[k], precisions[k]) for k in range(Knew)]
 
 
 # re-order components (and re-label labels) by sizes of components
-def relabel(labels, components, Kmax=10):
-    have_labels, counts = np.unique(labels,return_counts=True)
-    label_order = np.argsort(counts)[::-1]
-    
-    new_labels = np.empty_like(labels)
-    new_components = list()
-    
-    for k in range(len(have_labels)):
-        # re-label
-        new_labels[labels==label_order[k]] = k
-        # move around components
-        new_components.append(components[label_order[k]])
-        
-    # also include those components not present in population
-    other_comps = [components[k] for k in range(Kmax) if k not in have_labels]
-    new_components.extend(other_comps)
+def relabel(labels, components, Kmax=10, out=None, counts=None):
+    '''
+    labels: length n array of component labels (values in 0,...,Kmax-1)
+    components: GaussianComponents (or list) of Kmax components; RE-ORDERED IN PLACE
+    out: optional length n int array to write the new labels into (can be labels itself)
+    counts: optional length Kmax int array of the label counts, np.bincount(labels, minlength=Kmax);
+        if given, it is not re-computed, and it is RE-ORDERED IN PLACE to match the new labels
+    
+    returns: new labels and re-ordered components 
+        (components with data come first, by descending counts; then the empty ones)
+    '''
+    if counts is None:
+        counts = np.bincount(labels, minlength=Kmax)
+    label_order = np.argsort(-counts, kind='stable')
+    counts[:] = counts[label_order]
+    
+    # lookup table: old label -> new label
+    lookup = np.empty(Kmax, dtype=np.intp)
+    lookup[label_order] = np.arange(Kmax)
+    
+    new_labels = np.take(lookup, labels, out=out, mode='clip')
+    if isinstance(components, GaussianComponents):
+        components.permute(label_order)
+    else:
+        components[:] = [components[k] for k in label_order]
     
-    return new_labels, new_components
+    return new_labels, components
 
 
 # initialize DP GMM 
@@ -449,7 +804,7 @@ def initializeDPGMM(X, muPrior, precisionPrior, K=3, Kmax=10):
     K: number of components to initialize with
     Kmax: max number of components for the truncated DP GMM
     
-    returns: a list of Kmax components (center and co)
+    returns: GaussianComponents of Kmax components (center and precision), and labels
     '''
     kmeans = KMeans(n_clusters=K).fit(X)
     labels = kmeans.labels_
@@ -467,7 +822,7 @@ def initializeDPGMM(X, muPrior, precisionPrior, K=3, Kmax=10):
         new_comps = sampleNewComp(Kmax-K, muPrior, precisionPrior)
         components.extend(new_comps)
         
-    return components, labels
+    return GaussianComponents.fromList(components), labels
 
 
 # update Gaussian components
@@ -483,13 +838,28 @@ def updateOneComponent(X, mu, precision, muPrior, precisionPrior):
     '''
     
     n = X.shape[0]
-    An_inv = inv(muPrior['precision'] + n * precision)
     Xsum = np.sum(X, axis=0)
+    XXsum = np.matmul(X.T, X)
+    
+    return updateOneComponentFromStats(n, Xsum, XXsum, mu, precision, 
+                                       muPrior, precisionPrior)
+
+
+def updateOneComponentFromStats(n, Xsum, XXsum, mu, precision, muPrior, precisionPrior):
+    '''
+    Same update as updateOneComponent, but with the data summarized by
+    n: number of data points
+    Xsum: (p,) sum of the data points
+    XXsum: (p,p) sum of outer products x x^T
+    '''
+    
+    An_inv = inv(muPrior['precision'] + n * precision)
     bn = muPrior['precision'].dot(muPrior['mean']) + precision.dot(Xsum)
     
     mu = multivariate_normal(An_inv.dot(bn), An_inv).rvs()
     
-    S_mu = np.matmul((X-mu).T, X-mu)
+    # sum of (x-mu)(x-mu)^T
+    S_mu = XXsum - np.outer(mu, Xsum) - np.outer(Xsum, mu) + n * np.outer(mu, mu)
     
     precision = wishart(precisionPrior['df'] + n, 
                         inv(precisionPrior['invScale'] + S_mu)).rvs()
@@ -497,14 +867,119 @@ def updateOneComponent(X, mu, precision, muPrior, precisionPrior):
     return mu, precision
 
 
+def getComponentStats(X, Z, Kmax, ws=None, counts=None):
+    '''
+    Sufficient statistics of the data in each component
+    X: (n,2) array of data
+    Z: length n, int array of component labels (values in 0,...,Kmax-1)
+    ws: optional DPGMMWorkspace to take scratch space from
+    counts: optional, the component counts np.bincount(Z, minlength=Kmax) if already known
+    
+    returns: counts (Kmax,), sums (Kmax,2), sums of outer products (Kmax,2,2)
+    '''
+    n = X.shape[0]
+    tmp = ws.get('stats_tmp', n) if ws is not None else np.empty(n)
+    
+    if counts is None:
+        counts = np.bincount(Z, minlength=Kmax)
+    sums = np.empty((Kmax,2))
+    XXsums = np.empty((Kmax,2,2))
+    
+    for j in range(2):
+        np.copyto(tmp, X[:,j])
+        sums[:,j] = np.bincount(Z, weights=tmp, minlength=Kmax)
+        for l in range(j,2):
+            np.multiply(X[:,j], X[:,l], out=tmp)
+            XXsums[:,j,l] = np.bincount(Z, weights=tmp, minlength=Kmax)
+            XXsums[:,l,j] = XXsums[:,j,l]
+    
+    return counts, sums, XXsums
+
+
+def sampleComponentsFromStats(counts, sums, XXsums, precisions, priorCache):
+    '''
+    The update of updateOneComponentFromStats, for all the components at once
+    (a component with count 0 gets a new draw from the prior)
+    counts, sums, XXsums: from getComponentStats
+    precisions: (K,2,2) array of current precisions (the means are drawn given these)
+    priorCache: from getPriorCache
+    
+    return: (K,2) array of means, (K,2,2) array of precisions
+    '''
+    K = len(counts)
+    n = np.asarray(counts, dtype=float)
+    
+    # means: N(An^{-1} bn, An^{-1}), An = prior precision + n * precision
+    An = priorCache['muPrecision'] + n[:,None,None] * precisions
+    bn = priorCache['muPrecisionMean'] + np.matmul(precisions, sums[:,:,None])[:,:,0]
+    An_inv = inv(An)
+    means = (np.matmul(An_inv, bn[:,:,None])[:,:,0] + 
+             np.matmul(np.linalg.cholesky(An_inv), rng.standard_normal((K,2,1)))[:,:,0])
+    
+    # precisions: Wishart(df + n, inv(invScale + sum of (x-mu)(x-mu)^T))
+    outer = sums[:,:,None] * means[:,None,:]
+    S_mu = (XXsums - outer - np.swapaxes(outer, -1, -2) + 
+            n[:,None,None] * means[:,:,None] * means[:,None,:])
+    scaleChol = np.linalg.cholesky(inv(priorCache['invScale'] + S_mu))
+    
+    return means, sampleWishart2(priorCache['df'] + n, scaleChol)
+
+
+# log density of 2x2 Wishart(df, inv(invScale)) at precisions (stacked arrays are broadcast)
+def wishartLogpdf2(precisions, df, invScale):
+    '''
+    precisions: (...,2,2) array
+    df: degrees of freedom (scalar or array)
+    invScale: (...,2,2) array, inverse of the scale matrix
+    '''
+    P = precisions; V = invScale
+    logdetP = np.log(P[...,0,0]*P[...,1,1] - P[...,0,1]*P[...,1,0])
+    logdetV = np.log(V[...,0,0]*V[...,1,1] - V[...,0,1]*V[...,1,0])
+    trace = np.einsum('...ij,...ji->...', V, P)
+    
+    # (log of the bivariate gamma function: 0.5*log(pi) + log Gamma(a) + log Gamma(a-1/2))
+    return (0.5*(df-3)*logdetP - 0.5*trace + 0.5*df*logdetV - df*np.log(2) - 
+            0.5*np.log(np.pi) - gammaln(df/2) - gammaln(df/2 - 0.5))
+
+
+def componentUpdateLogpdf(counts, sums, XXsums, oldPrecisions, means, precisions, priorCache):
+    '''
+    Log density of getting (means, precisions) from the update in sampleComponentsFromStats
+    (starting from oldPrecisions), for each component;
+    with counts 0, this is the prior (base measure) log density of the components
+    counts, sums, XXsums: from getComponentStats
+    
+    return: length K array
+    '''
+    n = np.asarray(counts, dtype=float)
+    
+    # means
+    An = priorCache['muPrecision'] + n[:,None,None] * oldPrecisions
+    bn = priorCache['muPrecisionMean'] + np.matmul(oldPrecisions, sums[:,:,None])[:,:,0]
+    d = means - np.linalg.solve(An, bn[:,:,None])[:,:,0]
+    logdetA = np.linalg.slogdet(An)[1]
+    logMean = (0.5*logdetA - np.log(2*np.pi) - 
+               0.5*np.einsum('ki,kij,kj->k', d, An, d))
+    
+    # precisions
+    outer = sums[:,:,None] * means[:,None,:]
+    S_mu = (XXsums - outer - np.swapaxes(outer, -1, -2) + 
+            n[:,None,None] * means[:,:,None] * means[:,None,:])
+    logPrecision = wishartLogpdf2(precisions, priorCache['df'] + n, priorCache['invScale'] + S_mu)
+    
+    return logMean + logPrecision
+
+
 # b): update all components
 #     i) update from data X if n_j > 0
 #     ii) draw new components if n_j == 0
-def updateGaussianComponents(X, Z, components, muPrior, precisionPrior):
+def updateGaussianComponents(X, Z, components, muPrior, precisionPrior, ws=None, counts=None,
+                             priorCache=None, stats=None):
     '''
     X: (n,p) array of data
     Z: length n, array like component indicator (only K distinct labels)
-    components: list of (mu, precision) for Kmax Gaussian components
+    components: GaussianComponents (or list of (mu, precision)) for Kmax Gaussian components
+        (updated in place)
     muPrior: dictionary of prior mean and precision
     precisionPrior: dictionary of prior df and invScale
     
@@ -512,19 +987,38 @@ def updateGaussianComponents(X, Z, components, muPrior, precisionPrior):
         - Z has K distinct values, 0,1,...,K-1
         - The labels are already ordered by component counts!
         - components has length Kmax (the last Kmax-K components have no data points)
+    ws: optional DPGMMWorkspace to take scratch space from
+    counts: optional, the component counts of Z (e.g. from updateComponentIndicator)
+    priorCache: optional, from getPriorCache(muPrior, precisionPrior)
+    stats: optional (sums, XXsums) of getComponentStats, if already known (with counts; 
+        e.g. summed over the chunks of a threaded label draw), then X is not read
+    
+    (a GaussianComponents container is updated with one batched draw for all the components)
     '''
     Kmax = len(components)
     
-    have_labels = np.unique(Z)
-    K = len(have_labels)
+    if stats is None:
+        counts, sums, XXsums = getComponentStats(X, Z, Kmax, ws=ws, counts=counts)
+    else:
+        sums, XXsums = stats
+    K = np.count_nonzero(counts)
+    
+    if isinstance(components, GaussianComponents):
+        if priorCache is None:
+            priorCache = getPriorCache(muPrior, precisionPrior)
+        components.means[:], components.precisions[:] = sampleComponentsFromStats(counts, sums, XXsums, 
+                                                                                  components.precisions, 
+                                                                                  priorCache)
+        components.updateCache()
+        return components
     
     for k in range(K):
-        subX = X[Z==k,:]
-        if subX.shape[0] > 0:
+        if counts[k] > 0:
             mu, precision = components[k]
-            components[k] = updateOneComponent(subX, mu, precision, 
-                      muPrior, precisionPrior)
+            components[k] = updateOneComponentFromStats(counts[k], sums[k], XXsums[k], 
+                      mu, precision, muPrior, precisionPrior)
     
+    # components without data: new draws from the prior
     if Kmax > K:
         components[K:Kmax] = sampleNewComp(Kmax-K, muPrior, precisionPrior)
             
@@ -545,46 +1039,144 @@ def getProbVector(p):
     #print(p)
     return p/p.sum()
 
+# vectorized version of getProbVector + choice, for all rows at once
+def sampleIndicators(logProbs, out=None, ws=None, generator=None):
+    '''
+    Draw one label for each row of an (n,K) array of (unnormalized) log-probabilities;
+    Returns length-n array of labels in 0,...,K-1
+    (same hack correction as getProbVector: inf -> 3000, -inf -> -3000)
+    
+    NOTE: logProbs is over-written (with the unnormalized cumulative probabilities)
+    out: optional length-n int array to write the labels into
+    ws: optional DPGMMWorkspace to take scratch space from
+    generator: Generator to draw the uniforms from; if None, the module Generator "rng"
+    '''
+    generator = rng if generator is None else generator
+    n, K = logProbs.shape
+    if out is None:
+        out = np.empty(n, dtype=np.intp)
+    if ws is not None:
+        rowmax = ws.get('sample_rowmax', n)
+        u = ws.get('sample_u', n)
+        flag = ws.get('sample_flag', n, bool)
+    else:
+        rowmax = np.empty(n); u = np.empty(n); flag = np.empty(n, dtype=bool)
+    
+    np.clip(logProbs, -3000, 3000, out=logProbs)
+    np.max(logProbs, axis=1, out=rowmax)
+    if np.isnan(rowmax, out=flag).any():
+        raise ValueError('probabilities contain NaN')
+    
+    logProbs -= rowmax[:,None]
+    np.exp(logProbs, out=logProbs)
+    np.cumsum(logProbs, axis=1, out=logProbs)
+    
+    # inverse CDF: label = number of categories with cumulative prob <= u
+    generator.random(out=u)
+    u *= logProbs[:,K-1]
+    out[:] = 0
+    for k in range(K-1):
+        np.less_equal(logProbs[:,k], u, out=flag)
+        np.add(out, flag, out=out)
+    
+    return out
+
+
+# log-density of each (2-d) Gaussian component, in closed form
+def evalComponentDensities(X, components, out=None, ws=None):
+    '''
+    Evaluate the log-density of each Gaussian component on points X;
+    Returns (n,K) array of log-densities
+    X: (n,2) array of data
+    components: GaussianComponents (or list of (mu, precision)) for K Gaussian components
+    out: optional (n,K) array to write into
+    ws: optional DPGMMWorkspace to take scratch space from
+    '''
+    components = GaussianComponents.fromList(components)
+    n = X.shape[0]
+    K = len(components)
+    if out is None:
+        out = np.empty((n,K))
+    if ws is not None:
+        dx = ws.get('dens_dx', (n,K)); dy = ws.get('dens_dy', (n,K))
+    else:
+        dx = np.empty((n,K)); dy = np.empty((n,K))
+    
+    P = components.precisions
+    
+    np.subtract(X[:,0,None], components.means[:,0], out=dx)
+    np.subtract(X[:,1,None], components.means[:,1], out=dy)
+    
+    # quadratic form (x-mu)^T precision (x-mu)
+    np.multiply(dx, P[:,0,0], out=out); out *= dx
+    dx *= dy; dx *= components.offDiag; out += dx
+    np.multiply(dy, P[:,1,1], out=dx); dx *= dy; out += dx
+    
+    out *= -0.5
+    out += components.logNorm
+        
+    return out
+
+
 # inherited from previous version; should work fine
-def updateComponentIndicator(X, weight, components):
+def updateComponentIndicator(X, weight, components, out=None, ws=None, counts=None, logDens=None):
     '''
     X: (n,p) array of data
-    components: list of (mu, precision) for K Gaussian components
+    components: GaussianComponents (or list of (mu, precision)) for K Gaussian components
     (05/13 fix: use weights in indicator update! previous version was wrong)
     
     08/29 addtion: relabel the indicators and components by descending counts
+        (components are re-ordered in place)
+    
+    out: optional length-n int array to write the labels into
+    ws: optional DPGMMWorkspace to take scratch space from
+    counts: optional length-K int array; filled with the component counts (of the new labels), 
+        so that the later updates do not need to count again
+    logDens: optional (n,K) array of the component log-densities on X, if already evaluated 
+        (e.g. rows of the cache from the type update); it is not modified
     '''
     K = len(components)
-    n = X.shape[0]
-    
-    logDens = np.empty((K,n))
     
-    for k in range(K):
-        mu, precision = components[k]
-        MVN = multivariate_normal(mu, inv(precision))
-        logDens[k,:] = MVN.logpdf(X) + np.log(weight[k])
-#        logProb = MVN.logpdf(X)
-#        if np.any(np.isnan(logProb)):
-#            print(mu, precision)
-#            raise ValueError("NaN in log likelihood!")
-#        else:
-#            logDens[k,:] = logProb
-        
-    Z = np.apply_along_axis(lambda v: choice(range(K), replace=False, 
-                                             p=getProbVector(v)), 0, logDens)
+    Z = drawComponentIndicator(X, weight, components, out=out, ws=ws, logDens=logDens)
     
     # relabel for later use!
-    Z, components = relabel(Z, components, Kmax=len(components))
+    if counts is None:
+        counts = np.empty(K, dtype=np.intp)
+    counts[:] = np.bincount(Z, minlength=K)
+    Z, components = relabel(Z, components, Kmax=K, out=Z, counts=counts)
     
     return Z
 
 
+# the label draw of updateComponentIndicator (without the relabeling)
+def drawComponentIndicator(X, weight, components, out=None, ws=None, logDens=None, generator=None):
+    '''
+    Draw the component labels of the points X given the weights and components;
+    Returns length-n array of labels
+    out, ws, logDens: as in updateComponentIndicator
+    generator: Generator to draw from; if None, the module Generator "rng"
+    '''
+    K = len(components)
+    n = X.shape[0]
+    
+    cached = logDens
+    logDens = ws.get('indicator_logProbs', (n,K)) if ws is not None else np.empty((n,K))
+    if cached is None:
+        logDens = evalComponentDensities(X, components, out=logDens, ws=ws)
+    else:
+        np.copyto(logDens, cached)
+    with np.errstate(divide='ignore'):
+        logDens += np.log(weight[:K])
+        
+    return sampleIndicators(logDens, out=out, ws=ws, generator=generator)
+
+
 # update component weights
-def updateMixtureWeight(Z, alpha, Kmax=10):
+def updateMixtureWeight(Z, alpha, Kmax=10, counts=None):
     '''
     Z: length n, array like component indicator
     alpha: the precision parameter for DP
-    
+    counts: optional, the component counts np.bincount(Z, minlength=Kmax) if already known
     
     Assume that Z is labeled properly with descending counts
     
@@ -594,26 +1186,19 @@ def updateMixtureWeight(Z, alpha, Kmax=10):
     '''
     
     # count component sizes
-    counts = np.empty(shape=Kmax)
-    for k in range(Kmax):
-        counts[k] = np.sum(Z==k)
-    
-    # calculate the v's
-    V = np.empty(shape=Kmax)
-    for k in range(Kmax-1):
-        alpha_k = 1+counts[k]
-        beta_k = alpha + np.sum(counts[(k+1):])
-        V[k] = rng.beta(alpha_k, beta_k)
-    V[Kmax-1] = 1
-    
-    # calculate mixture probs
-    W = np.empty_like(V)
-    W[0] = V[0]
-    V[0] = 1-V[0]
-    W[1] = V[1] * V[0]
-    for k in range(1, Kmax-1):
-        V[k] = V[k-1] * (1-V[k])
-        W[k+1] = V[k+1] * V[k]
+    if counts is None:
+        counts = np.bincount(Z, minlength=Kmax)
+    
+    # number of points in the later components, sum(counts[k+1:]), for each k
+    tails = np.cumsum(counts[::-1])[::-1]
+    
+    # calculate the v's (all at once)
+    V = np.ones(Kmax)
+    V[:-1] = rng.beta(1 + counts[:-1], alpha + tails[1:])
+    
+    # calculate mixture probs (stick-breaking)
+    W = V.copy()
+    W[1:] *= np.cumprod(1 - V[:-1])
         
     return W
   
@@ -650,6 +1235,328 @@ def updateAlpha(K, N, alpha, alphaPrior):
     return alpha
 
 
+# adapt the truncation level of the stick-breaking representation
+def adaptTruncation(weight, components, counts, alpha, priorCache, tailTol=1e-3, minKmax=2, maxKmax=100):
+    '''
+    Grow or shrink the number of components (the truncation level Kmax) of a truncated DP mixture,
+    based on the weight of the last ("tail") stick, which holds all the left-over weight:
+        - grow: while the tail weight is above tailTol, split the tail stick
+            and add a new (empty) component drawn from the prior; 
+            the split is the stick-breaking posterior draw of updateMixtureWeight 
+            in the one larger truncation: Beta(1 + n_K, alpha) for the last 
+            component K (whose count n_K may be positive, with nothing behind it), 
+            then Beta(1, alpha) for the new empty ones
+        - shrink: while the last two components are empty and their weights add up to 
+            less than tailTol/2, merge them into one tail stick
+            (only behind the last occupied component: after split-merge moves 
+            the occupied components are not necessarily the first ones)
+    
+    weight: length Kmax vector of mixture weights (from updateMixtureWeight)
+    components: GaussianComponents of the Kmax components
+    counts: length Kmax int array of the component counts
+    alpha: the precision parameter for DP
+    priorCache: from getPriorCache
+    
+    returns: weights and GaussianComponents with the new truncation level
+    '''
+    W = list(weight)
+    
+    # grow
+    Knew = 0
+    while W[-1] > tailTol and len(W) < maxKmax:
+        v = rng.beta(1 + (counts[-1] if Knew == 0 else 0), alpha)
+        W[-1:] = [W[-1] * v, W[-1] * (1-v)]
+        Knew += 1
+    
+    if Knew > 0:
+        means, precisions = samplePriorComponents(Knew, priorCache)
+        components = GaussianComponents(np.concatenate((components.means, means)), 
+                                        np.concatenate((components.precisions, precisions)))
+        return np.array(W), components
+    
+    # shrink
+    Kmax = len(W)
+    occupied = np.flatnonzero(counts)
+    Klast = occupied[-1]+1 if len(occupied) > 0 else 0
+    while Kmax > max(Klast+1, minKmax) and W[Kmax-2] + W[Kmax-1] < tailTol/2:
+        W[Kmax-2] += W[Kmax-1]
+        Kmax -= 1
+    
+    if Kmax < len(W):
+        return np.array(W[:Kmax]), components[:Kmax]
+    
+    return weight, components
+
+
+# slice sampler for the DP mixture (no fixed truncation)
+def updateDPSlice(X, Z, weight, components, alpha, priorCache, out=None, ws=None, logDens=None):
+    '''
+    One sweep of the slice sampler for the DP Gaussian mixture on X
+    (Walker 2007; Kalli, Griffin and Walker 2011):
+        0) points without a label (Z = -1, the points that just moved onto this surface)
+            get one from the current (instantiated) mixture; since their type was drawn 
+            with the labels summed out, this completes a joint draw of type and label
+        1) components and stick-breaking weights up to the last occupied component
+        2) slice variables u_i ~ Unif(0, weight of the component of i), then new sticks
+            (and components from the prior) until the left-over weight is below all the u_i
+        3) labels given the slices: point i can only go to the components with weight > u_i
+    so only the components the slices require are instantiated and evaluated
+    (the labels are NOT re-ordered by counts, the stick-breaking order is kept)
+
+    X: (n,2) array of data
+    Z: length-n int array of the current labels of X, -1 for the points without one
+    weight: length K vector of weights of the instantiated components
+    components: GaussianComponents of the K instantiated components
+    alpha: the precision parameter for DP
+    priorCache: from getPriorCache
+    out: optional length-n int array to write the labels into (may be Z itself)
+    ws: optional DPGMMWorkspace to take scratch space from
+    logDens: optional (n,K) array of the component log-densities of X 
+        (e.g. cached by the type update), used for step 0
+
+    returns: labels, weights (length K', sum < 1) and GaussianComponents of the K' new components
+    '''
+    n = X.shape[0]
+    if out is None:
+        out = np.empty(n, dtype=np.intp)
+    if out is not Z:
+        out[:] = Z
+    Z = out
+
+    # 0) labels of the new points, given the current mixture
+    new = np.flatnonzero(Z < 0)
+    if len(new) > 0:
+        if logDens is not None:
+            logProbs = logDens[new]
+        else:
+            logProbs = evalComponentDensities(X[new], components)
+        with np.errstate(divide='ignore'):
+            logProbs += np.log(weight)
+        Z[new] = sampleIndicators(logProbs)
+
+    # 1) components and sticks of the occupied range (the rest are dropped)
+    K = Z.max()+1 if n > 0 else 0
+    counts, sums, XXsums = getComponentStats(X, Z, K, ws=ws)
+    means, precisions = sampleComponentsFromStats(counts, sums, XXsums,
+                                                  components.precisions[:K], priorCache)
+
+    tails = np.cumsum(counts[::-1])[::-1]
+    V = rng.beta(1 + counts, alpha + np.append(tails[1:], 0))
+
+    # 2) slice variables, and more sticks until the left-over weight is below all of them
+    W = V * np.append(1, np.cumprod(1 - V[:-1])) if K > 0 else V
+    u = rng.uniform(size=n) * W[Z]
+    uMin = u.min() if n > 0 else 1
+
+    left = np.prod(1 - V)
+    newV = []
+    while left > uMin or K + len(newV) == 0:
+        v = rng.beta(1, alpha)
+        newV.append(v * left)
+        left *= 1 - v
+
+    if newV:
+        W = np.append(W, newV)
+        newMeans, newPrecisions = samplePriorComponents(len(newV), priorCache)
+        means = np.concatenate((means, newMeans))
+        precisions = np.concatenate((precisions, newPrecisions))
+    components = GaussianComponents(means, precisions)
+
+    # 3) labels given the slices
+    K = len(W)
+    logProbs = ws.get('slice_logProbs', (n,K)) if ws is not None else None
+    logProbs = evalComponentDensities(X, components, out=logProbs, ws=ws)
+    logProbs[W[None,:] <= u[:,None]] = -np.inf
+    Z = sampleIndicators(logProbs, out=Z, ws=ws)
+
+    return Z, W, components
+
+
+# split-merge move for the (truncated) DP mixture
+def splitMergeMove(X, Z, weight, components, members, priorCache, nScans=3):
+    '''
+    One split-merge Metropolis-Hastings move on the labels and components of a DP mixture, 
+    with restricted Gibbs launch states (Jain and Neal 2004; 2007 for non-conjugate priors), 
+    given the mixture weights:
+        - pick two points i, j at random
+        - if they are in the same component k: propose to move i (and some of the others in k)
+            to an empty component e, with new parameters for k and e
+        - otherwise: propose to merge the component of i (e) into that of j (k), 
+            with new parameters for k (and a prior draw for the now empty e)
+    the proposals come from restricted Gibbs scans over the points of the two components only,
+    so a move costs time proportional to the sizes of the two components (not to n)
+    
+    X: (n,2) array of data
+    Z: length n int array of labels; UPDATED IN PLACE if accepted
+    weight: length K vector of mixture weights
+    components: GaussianComponents of the K components; UPDATED IN PLACE if accepted
+    members: list of K index arrays, the points in each component; UPDATED IN PLACE if accepted
+    priorCache: from getPriorCache
+    nScans: number of restricted Gibbs scans for the launch states
+    
+    returns: move type ('split' or 'merge'), and whether it was accepted
+    '''
+    n = len(Z)
+    if n < 2:
+        return None, False
+    
+    i, j = rng.choice(n, 2, replace=False)
+    k = Z[j]
+    split = (Z[i] == k)
+    if split:
+        empty = [c for c in range(len(members)) if len(members[c]) == 0]
+        if not empty:
+            return 'split', False
+        e = empty[rng.integers(len(empty))]
+    else:
+        e = Z[i]
+    # number of empty components in the merged state
+    nEmpty = sum(len(m) == 0 for m in members) + (0 if split else 1)
+    
+    # the other points in the two components, then i and j
+    S = np.concatenate((members[k], members[e]))
+    S = S[(S != i) & (S != j)]
+    points = np.concatenate((S, [i, j]))
+    Xs = X[points]
+    m = len(S)
+    # (an empty component can have weight 0: log 0 = -inf, so a split into it is rejected)
+    with np.errstate(divide='ignore'):
+        logW = np.log(weight[[e, k]])
+    
+    def getStats(g):
+        # stats of the two components (0: e, 1: k), given the labels g of S
+        return getComponentStats(Xs, np.append(g, [0, 1]), 2)
+    
+    def logTarget(labels, means, precisions):
+        # log of weights * densities of the points (labels of S, i, j), and the prior of the parameters 
+        logDens = evalComponentDensities(Xs, GaussianComponents(means, precisions))
+        return (np.sum(logDens[np.arange(m+2), labels] + logW[labels]) + 
+                np.sum(componentUpdateLogpdf(np.zeros(2), np.zeros((2,2)), np.zeros((2,2,2)), 
+                                             precisions, means, precisions, priorCache)))
+    
+    def restrictedScan(means, precisions, g=None, newMeans=None, newPrecisions=None):
+        # one scan: labels of S, then the parameters of the two components;
+        # draws them (unless given), and returns their log transition probability
+        logDens = evalComponentDensities(Xs[:m], GaussianComponents(means, precisions)) + logW
+        logProbK = -np.logaddexp(0, logDens[:,0] - logDens[:,1])
+        logProbE = -np.logaddexp(0, logDens[:,1] - logDens[:,0])
+        if g is None:
+            g = (rng.random(m) < np.exp(logProbK)).astype(np.intp)
+        logq = np.sum(np.where(g == 1, logProbK, logProbE))
+        
+        counts, sums, XXsums = getStats(g)
+        if newMeans is None:
+            newMeans, newPrecisions = sampleComponentsFromStats(counts, sums, XXsums, 
+                                                                precisions, priorCache)
+        logq += np.sum(componentUpdateLogpdf(counts, sums, XXsums, precisions, 
+                                             newMeans, newPrecisions, priorCache))
+        return g, newMeans, newPrecisions, logq
+    
+    def launchSplit():
+        # (prior draws of the parameters; the first scan then draws the labels from them)
+        means, precisions = samplePriorComponents(2, priorCache)
+        for t in range(nScans):
+            _, means, precisions, _ = restrictedScan(means, precisions)
+        return means, precisions
+    
+    def launchMerge():
+        stats = getComponentStats(Xs, np.zeros(m+2, dtype=np.intp), 1)
+        means, precisions = samplePriorComponents(1, priorCache)
+        for t in range(nScans):
+            means, precisions = sampleComponentsFromStats(*stats, precisions, priorCache)
+        return stats, precisions
+    
+    # (the labels of S, i, j in the merged state)
+    merged = np.ones(m+2, dtype=np.intp)
+    
+    # current and proposed parameters of (e, k)
+    curMeans = np.stack((components.means[e], components.means[k]))
+    curPrecisions = np.stack((components.precisions[e], components.precisions[k]))
+    
+    if split:
+        # propose the split
+        launchMeans, launchPrecisions = launchSplit()
+        g, newMeans, newPrecisions, logqSplit = restrictedScan(launchMeans, launchPrecisions)
+        # (reverse) merge into the current parameters of k
+        stats, mergePrecisions = launchMerge()
+        logqMerge = componentUpdateLogpdf(*stats, mergePrecisions, curMeans[1:], curPrecisions[1:], 
+                                          priorCache)[0]
+        # (the reverse merge also draws e's current parameters from the prior)
+        labels = np.append(g, [0, 1])
+        logAlpha = (logTarget(labels, newMeans, newPrecisions) - 
+                    logTarget(merged, curMeans, curPrecisions) + 
+                    componentUpdateLogpdf(np.zeros(1), np.zeros((1,2)), np.zeros((1,2,2)), 
+                                          curPrecisions[:1], curMeans[:1], curPrecisions[:1], 
+                                          priorCache)[0] + 
+                    logqMerge - logqSplit + np.log(nEmpty))
+    else:
+        # propose the merge (and a prior draw for e)
+        stats, mergePrecisions = launchMerge()
+        mergeMeans, mergePrecisionsNew = sampleComponentsFromStats(*stats, mergePrecisions, priorCache)
+        logqMerge = componentUpdateLogpdf(*stats, mergePrecisions, mergeMeans, mergePrecisionsNew, 
+                                          priorCache)[0]
+        priorMeans, priorPrecisions = samplePriorComponents(1, priorCache)
+        newMeans = np.concatenate((priorMeans, mergeMeans))
+        newPrecisions = np.concatenate((priorPrecisions, mergePrecisionsNew))
+        labels = merged
+        # (reverse) split into the current state
+        gCur = (Z[S] == k).astype(np.intp)
+        launchMeans, launchPrecisions = launchSplit()
+        _, _, _, logqSplit = restrictedScan(launchMeans, launchPrecisions, gCur, curMeans, curPrecisions)
+        logAlpha = (logTarget(labels, newMeans, newPrecisions) - 
+                    componentUpdateLogpdf(np.zeros(1), np.zeros((1,2)), np.zeros((1,2,2)), 
+                                          priorPrecisions, priorMeans, priorPrecisions, 
+                                          priorCache)[0] - 
+                    logTarget(np.append(gCur, [0, 1]), curMeans, curPrecisions) + 
+                    logqSplit - np.log(nEmpty) - logqMerge)
+    
+    if np.log(rng.random()) >= logAlpha:
+        return ('split' if split else 'merge'), False
+    
+    # accepted: apply the move
+    Z[points] = np.where(labels == 1, k, e)
+    members[e] = points[labels == 0]
+    members[k] = points[labels == 1]
+    components[e] = (newMeans[0], newPrecisions[0])
+    components[k] = (newMeans[1], newPrecisions[1])
+    
+    return ('split' if split else 'merge'), True
+
+
+def updateSplitMerge(X, Z, weight, components, priorCache, nMoves=1, nScans=3, counts=None):
+    '''
+    Run nMoves split-merge moves (splitMergeMove) on a DP mixture, given the weights
+    X: (n,2) array of data
+    Z: length n int array of labels; UPDATED IN PLACE
+    weight: length K vector of mixture weights
+    components: GaussianComponents of the K components; UPDATED IN PLACE
+    counts: optional length K int array of the label counts, np.bincount(Z, minlength=K);
+        if given, it is UPDATED IN PLACE to match the new labels
+    
+    returns: dictionaries of the number of proposed and accepted moves, by move type
+    '''
+    K = len(components)
+    if counts is None:
+        counts = np.bincount(Z, minlength=K)
+    
+    # the points of each component (one sort, updated by the accepted moves)
+    order = np.argsort(Z, kind='stable')
+    members = np.split(order, np.cumsum(counts)[:-1])
+    
+    proposed = {'split': 0, 'merge': 0}
+    accepted = {'split': 0, 'merge': 0}
+    for t in range(nMoves):
+        move, acc = splitMergeMove(X, Z, weight, components, members, priorCache, nScans)
+        if move is None:
+            break
+        proposed[move] += 1
+        accepted[move] += acc
+    
+    counts[:] = [len(m) for m in members]
+    
+    return proposed, accepted
+
+
 #%%
 
 # Gaussian mixture stuff (spatial density model)
@@ -771,33 +1678,88 @@ def initializeGMM(X, K=2):
 #        
 #    return dirichlet(alpha).rvs()[0]
 
-def evalDensity(X, weight, components, log=True):
+def pruneComponents(weight, components, epsilon):
+    '''
+    Drop the mixture components with weight below epsilon (but always keep the largest one),
+    to make density evaluations cheaper;
+    the pruned density under-estimates the full one by at most
+        bound = sum over the dropped k of weight_k * max_x N(x | mu_k, precision_k)
+              = sum over the dropped k of weight_k * sqrt(|precision_k|)/(2*pi)
+    at every point x
+    weight: length K vector of mixture weights
+    components: GaussianComponents (or list of (mu, precision)) for (at least) K Gaussian components
+    
+    returns: kept weights, kept components (GaussianComponents), bound
+    '''
+    K = len(weight)
+    components = GaussianComponents.fromList(components)
+    
+    keep = weight >= epsilon
+    keep[np.argmax(weight)] = True
+    if keep.all():
+        return weight, components, 0.0
+    
+    bound = np.sum(weight[~keep] * np.exp(components.logNorm[:K][~keep]))
+    which = np.flatnonzero(keep)
+    
+    return weight[which], components[which], bound
+
+
+def evalDensity(X, weight, components, log=True, out=None, ws=None, epsilon=0, logDens=None):
     '''
     Evaluate the entire density function (after mixture) on points X;
     Returns a length-n array of density/log-density
     X: (n,p) array of data
     weight: length K vector of mixture weights
-    components: list of (mu, precision) for K Gaussian components
+    components: GaussianComponents (or list of (mu, precision)) for K Gaussian components
+    out: optional length-n array to write into
+    ws: optional DPGMMWorkspace to take scratch space from
+    epsilon: if > 0, skip the components with weight below epsilon 
+        (see pruneComponents for the error bound)
+    logDens: optional (n,K) array of the component log-densities on X, if already evaluated 
+        (see evalComponentDensities); it is not modified (epsilon is not used then)
     '''
     
+    if epsilon > 0 and logDens is None:
+        weight, components, _ = pruneComponents(weight, components, epsilon)
+    
     n = X.shape[0]
     K = len(weight)
     
-    mix_dens = np.empty((n,K))
+    if out is None:
+        out = np.empty(n)
+    if ws is not None:
+        mix_dens = ws.get('mix_logDens', (n,K))
+        rowsum = ws.get('mix_rowsum', n)
+    else:
+        mix_dens = None; rowsum = np.empty(n)
     
-    for k in range(K):
-        mu, precision = components[k]
-        MVN = multivariate_normal(mu, inv(precision))
-        mix_dens[:,k] = MVN.pdf(X)
+    # log of weight_k * density_k
+    if logDens is not None:
+        if mix_dens is None:
+            mix_dens = np.empty((n,K))
+        np.copyto(mix_dens, logDens[:,:K])
+    else:
+        if len(components) > K:
+            components = components[:K]
+        mix_dens = evalComponentDensities(X, components, out=mix_dens, ws=ws)
+    with np.errstate(divide='ignore'):
+        mix_dens += np.log(weight)
         
     #print(mix_dens)
-        
-    total_dens = np.sum(weight * mix_dens, axis=1)
     
-    if log:
-        total_dens = np.log(total_dens)
+    # log-sum-exp over the components
+    np.max(mix_dens, axis=1, out=out)
+    mix_dens -= out[:,None]
+    np.exp(mix_dens, out=mix_dens)
+    np.sum(mix_dens, axis=1, out=rowsum)
+    np.log(rowsum, out=rowsum)
+    out += rowsum
+    
+    if not log:
+        np.exp(out, out=out)
         
-    return total_dens
+    return out
 #%% test
 #x_test = np.random.randn(50,2) + 2
 